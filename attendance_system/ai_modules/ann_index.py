@@ -0,0 +1,209 @@
+# attendance_system/ai_modules/ann_index.py
+"""
+Approximate nearest-neighbour search for large galleries, in plain NumPy.
+
+IVFIndex clusters the gallery with k-means into `nlist` inverted lists; a query
+only scans the `nprobe` lists whose centroids are closest to it. With pq_m > 0
+the vectors inside the lists are product-quantized (pq_m bytes per vector) and
+the best `rerank` candidates are re-scored exactly against the gallery matrix.
+
+Raising nprobe (or rerank) trades latency for recall; recall_report() measures both.
+"""
+import time
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+
+def _sq_dists(a: np.ndarray, b: np.ndarray, b_sq: Optional[np.ndarray] = None) -> np.ndarray:
+    """Squared euclidean distances between the rows of a and b, shape (len(a), len(b))."""
+    if b_sq is None:
+        b_sq = np.einsum("ij,ij->i", b, b)
+    d = np.einsum("ij,ij->i", a, a)[:, None] + b_sq[None, :] - 2.0 * (a @ b.T)
+    return np.maximum(d, 0.0, out=d)
+
+
+def kmeans(x: np.ndarray, k: int, iters: int = 10, seed: int = 0) -> np.ndarray:
+    """Plain Lloyd k-means. Empty clusters are re-seeded from random points."""
+    rng = np.random.default_rng(seed)
+    x = np.asarray(x, dtype=np.float32)
+    k = min(k, len(x))
+    centroids = x[rng.choice(len(x), k, replace=False)].copy()
+    for _ in range(iters):
+        assign = np.argmin(_sq_dists(x, centroids), axis=1)
+        counts = np.bincount(assign, minlength=k)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, x)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        if empty.any():
+            centroids[empty] = x[rng.choice(len(x), int(empty.sum()), replace=False)]
+    return centroids
+
+
+class IVFIndex:
+    """
+    Inverted-file index over gallery rows. Stores row numbers (into the gallery
+    matrix) per list, plus either the raw vectors or their PQ codes.
+    """
+
+    def __init__(self, nlist: int = 256, nprobe: int = 8, pq_m: int = 0, rerank: int = 32, seed: int = 0):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.pq_m = pq_m
+        self.rerank = rerank
+        self.seed = seed
+        self.centroids = None   # (nlist, dim)
+        self.codebooks = None   # (pq_m, 256, dim // pq_m) when PQ is enabled
+        self._rows = []         # per list: int64 gallery row numbers
+        self._data = []         # per list: float32 vectors, or uint8 PQ codes
+
+    @property
+    def is_trained(self) -> bool:
+        return self.centroids is not None
+
+    def __len__(self):
+        return sum(len(r) for r in self._rows)
+
+    # -----------------------
+    # Build
+    # -----------------------
+
+    def train(self, vectors: np.ndarray, iters: int = 10, sample: int = 64):
+        """Fit coarse centroids (and PQ codebooks) on at most sample * nlist vectors."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        rng = np.random.default_rng(self.seed)
+        if len(vectors) > sample * self.nlist:
+            vectors = vectors[rng.choice(len(vectors), sample * self.nlist, replace=False)]
+
+        dim = vectors.shape[1]
+        self.centroids = kmeans(vectors, self.nlist, iters, self.seed)
+        self.nlist = len(self.centroids)
+        self._rows = [np.empty(0, dtype=np.int64) for _ in range(self.nlist)]
+
+        if self.pq_m:
+            if dim % self.pq_m:
+                raise ValueError(f"pq_m={self.pq_m} must divide the vector size {dim}")
+            residuals = vectors - self.centroids[self._assign(vectors)]
+            sub = dim // self.pq_m
+            self.codebooks = np.stack([
+                kmeans(residuals[:, j * sub:(j + 1) * sub], 256, iters, self.seed + j)
+                for j in range(self.pq_m)
+            ])
+            self._data = [np.empty((0, self.pq_m), dtype=np.uint8) for _ in range(self.nlist)]
+        else:
+            self._data = [np.empty((0, dim), dtype=np.float32) for _ in range(self.nlist)]
+
+    def empty_copy(self) -> "IVFIndex":
+        """A new, empty index sharing this one's trained centroids and codebooks."""
+        other = IVFIndex(self.nlist, self.nprobe, self.pq_m, self.rerank, self.seed)
+        other.centroids, other.codebooks = self.centroids, self.codebooks
+        other._rows = [np.empty(0, dtype=np.int64) for _ in range(self.nlist)]
+        other._data = [d[:0] for d in self._data]
+        return other
+
+    def _assign(self, vectors: np.ndarray) -> np.ndarray:
+        return np.argmin(_sq_dists(vectors, self.centroids), axis=1)
+
+    def _encode(self, residuals: np.ndarray) -> np.ndarray:
+        sub = residuals.shape[1] // self.pq_m
+        codes = np.empty((len(residuals), self.pq_m), dtype=np.uint8)
+        for j in range(self.pq_m):
+            codes[:, j] = np.argmin(_sq_dists(residuals[:, j * sub:(j + 1) * sub], self.codebooks[j]), axis=1)
+        return codes
+
+    def add(self, vectors: np.ndarray, rows: np.ndarray):
+        """Insert vectors (gallery rows `rows`) into their nearest lists. Safe to call incrementally."""
+        if not self.is_trained:
+            raise RuntimeError("IVFIndex.add called before train")
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.centroids.shape[1])
+        rows = np.asarray(rows, dtype=np.int64)
+        if not len(rows):
+            return
+        lists = self._assign(vectors)
+        payload = self._encode(vectors - self.centroids[lists]) if self.pq_m else vectors
+        for c in np.unique(lists):
+            sel = lists == c
+            self._rows[c] = np.concatenate([self._rows[c], rows[sel]])
+            self._data[c] = np.concatenate([self._data[c], payload[sel]])
+
+    # -----------------------
+    # Search
+    # -----------------------
+
+    def search(self, queries: np.ndarray, k: int, base: np.ndarray, base_sq: np.ndarray,
+               nprobe: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Approximate top-k gallery rows per query. `base`/`base_sq` are the gallery
+        matrix and its squared row norms, used for exact re-ranking.
+        Returns (rows, distances) of shape (num_queries, k); missing slots are -1 / inf.
+        """
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, self.centroids.shape[1])
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        out_rows = np.full((len(queries), k), -1, dtype=np.int64)
+        out_dists = np.full((len(queries), k), np.inf, dtype=np.float32)
+        if not len(queries):
+            return out_rows, out_dists
+
+        coarse = _sq_dists(queries, self.centroids)
+        probes = np.argpartition(coarse, nprobe - 1, axis=1)[:, :nprobe] if nprobe < self.nlist \
+            else np.broadcast_to(np.arange(self.nlist), coarse.shape)
+
+        for qi, q in enumerate(queries):
+            lists = [c for c in probes[qi] if len(self._rows[c])]
+            if not lists:
+                continue
+            rows = np.concatenate([self._rows[c] for c in lists])
+
+            if self.pq_m:
+                # asymmetric distance: per-list lookup tables over the query residual
+                sub = q.shape[0] // self.pq_m
+                approx = []
+                for c in lists:
+                    r = (q - self.centroids[c]).reshape(self.pq_m, 1, sub)
+                    table = ((self.codebooks - r) ** 2).sum(axis=2)           # (pq_m, 256)
+                    approx.append(table[np.arange(self.pq_m), self._data[c]].sum(axis=1))
+                approx = np.concatenate(approx)
+                n_keep = min(max(k, self.rerank), len(rows))
+                if n_keep < len(rows):
+                    rows = rows[np.argpartition(approx, n_keep - 1)[:n_keep]]
+                d = _sq_dists(q[None, :], base[rows], base_sq[rows])[0]
+            else:
+                vecs = np.concatenate([self._data[c] for c in lists])
+                d = _sq_dists(q[None, :], vecs)[0]
+
+            n = min(k, len(rows))
+            top = np.argpartition(d, n - 1)[:n] if n < len(rows) else np.arange(n)
+            top = top[np.argsort(d[top])]
+            out_rows[qi, :n] = rows[top]
+            out_dists[qi, :n] = np.sqrt(d[top])
+        return out_rows, out_dists
+
+
+def recall_report(gallery, index: IVFIndex, k: int = 1, nprobes=(1, 2, 4, 8, 16, 32),
+                  num_queries: int = 500, noise: float = 0.02, seed: int = 0) -> List[dict]:
+    """
+    Compare `index` with exact search on the gallery. Queries are gallery rows
+    with a little gaussian noise. Returns one dict per setting with recall@k
+    and mean latency per query in milliseconds (the 'exact' row is the baseline).
+    """
+    rng = np.random.default_rng(seed)
+    base = gallery.encodings
+    picks = rng.choice(len(base), min(num_queries, len(base)), replace=False)
+    queries = base[picks] + rng.normal(0.0, noise, size=(len(picks), base.shape[1])).astype(np.float32)
+
+    t0 = time.perf_counter()
+    truth, _ = gallery.search(queries, k, exact=True)
+    exact_ms = (time.perf_counter() - t0) * 1000 / len(queries)
+    report = [{"setting": "exact", "recall": 1.0, "ms_per_query": exact_ms}]
+
+    base_sq = gallery.sq_norms
+    for nprobe in nprobes:
+        if nprobe > index.nlist:
+            break
+        t0 = time.perf_counter()
+        rows, _ = index.search(queries, k, base, base_sq, nprobe=nprobe)
+        ms = (time.perf_counter() - t0) * 1000 / len(queries)
+        hits = sum(len(np.intersect1d(r, t)) for r, t in zip(rows, truth))
+        report.append({"setting": f"nprobe={nprobe}", "recall": hits / truth.size, "ms_per_query": ms})
+    return report
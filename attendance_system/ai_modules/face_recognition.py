@@ -94,51 +94,71 @@
 #NEW CODE GOES BELOW:
 import os
 import glob
+import hashlib
 import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import List, Dict, Tuple
+from typing import List, Dict, Optional, Tuple
 from datetime import datetime
 
 import numpy as np
 import cv2
 import face_recognition
 
+from .gallery import Gallery, GalleryManager, published_gallery_dir
+
 # Paths
 BASE_DIR = Path(__file__).resolve().parents[1]
 DATA_DIR = BASE_DIR / "face_dataset"
-ENCODINGS_FILE = BASE_DIR / "encodings" / "encodings.pkl"
+GALLERY_DIR = BASE_DIR / "encodings"              # CURRENT + gen-NNNNNN/ (gallery.npy, gallery_index.npz, gallery.json)
+ENCODINGS_FILE = GALLERY_DIR / "encodings.pkl"    # legacy pickle, only read by migrate_pickle_gallery()
+EMBEDDING_CACHE_FILE = GALLERY_DIR / "embedding_cache.pkl"
+
+# Stored in the gallery header; a gallery built with another model is refused
+MODEL_VERSION = "dlib_face_recognition_resnet_model_v1"
+GALLERY_DTYPE = "float32"  # or "float16" to halve the on-disk/page-cache size
+GALLERY_CHECK_INTERVAL = 2.0  # seconds between checks for a gallery published by another process
+
+# Approximate search (ai_modules/ann_index.py) for large galleries
+ANN_MIN_GALLERY = 20000   # build an IVF index once the gallery has this many rows; 0 disables
+ANN_NPROBE = 8            # lists scanned per query: higher = better recall, slower
+ANN_PQ_M = 0              # > 0 enables product quantization with this many bytes per encoding
+
+# Faces are detected on a downscaled copy of the frame; encodings still use full-resolution crops.
+DETECTION_SCALE = "auto"  # a factor in (0, 1], or "auto" to derive it from MIN_FACE_SIZE
+MIN_FACE_SIZE = 80        # smallest face (pixels in the full frame) that auto mode must still find
+HOG_MIN_FACE = 40         # smallest face HOG finds: 80px window, halved by the default upsample
+
+IMAGE_PATTERNS = ("*.jpg", "*.jpeg", "*.png", "*.bmp", "*.webp")
 
 # Ensure directories exist
 DATA_DIR.mkdir(parents=True, exist_ok=True)
-(ENCODINGS_FILE.parent).mkdir(parents=True, exist_ok=True)
+GALLERY_DIR.mkdir(parents=True, exist_ok=True)
 
-# Cache for performance
-_CACHE = {
-    "mt": None,           # modification time of encodings.pkl
-    "ids": [],
-    "encodings": []
-}
+# Per-stage timing, {(stage, scale): [calls, total_ms]}; see get_stage_stats()
+_STAGE_STATS = {}
+
+# Per-subject slices of the gallery, built from the enrollment roster
+_SUBJECT_VIEWS = {}       # subject_id -> (global gallery it was cut from, view, roster revision, checked at)
+_ROSTER_LOADER = None     # callable(subject_id) -> iterable of enrolled user_ids
+_ROSTER_REVISION = None   # callable(subject_id) -> counter bumped by every enrollment change, in any process
 
 # -----------------------
 # Utility Functions
 # -----------------------
 
-def _load_encodings_from_disk():
-    """Load encodings.pkl into memory if present."""
-    if not ENCODINGS_FILE.exists():
-        _CACHE.update({"mt": None, "ids": [], "encodings": []})
-        return
+def _prepare_gallery(gallery: Gallery, previous: Gallery) -> Gallery:
+    """Called by the gallery manager on every newly published gallery before it goes live."""
+    if ANN_MIN_GALLERY and len(gallery) >= ANN_MIN_GALLERY:
+        # reuse the previous quantizers so a reload after an enrollment only re-assigns rows
+        gallery.build_index(nprobe=ANN_NPROBE, pq_m=ANN_PQ_M, trained=previous.index)
+    return gallery
 
-    mt = os.path.getmtime(ENCODINGS_FILE)
-    if _CACHE["mt"] == mt:
-        return  # cache up-to-date
 
-    with open(ENCODINGS_FILE, "rb") as f:
-        data = pickle.load(f)
-
-    _CACHE["mt"] = mt
-    _CACHE["ids"] = data.get("ids", [])
-    _CACHE["encodings"] = data.get("encodings", [])
+# Live gallery: memory-mapped from the published generation, swapped when a new one appears
+_GALLERY = GalleryManager(GALLERY_DIR, model=MODEL_VERSION, check_interval=GALLERY_CHECK_INTERVAL,
+                          prepare=_prepare_gallery)
 
 
 def enroll_user(user_id: str, image_paths: list):
@@ -157,89 +177,314 @@ def enroll_user(user_id: str, image_paths: list):
     build_encodings()
 
 
-def build_encodings() -> Tuple[int, int]:
+def _list_dataset_images() -> List[Tuple[str, str]]:
+    """
+    Return sorted (user_id, image_path) pairs for every image under face_dataset/.
+    Sorting keeps the gallery row order stable between builds.
     """
-    Scan face_dataset/<user_id>/* images, compute encodings, and save to ENCODINGS_FILE.
+    images = []
+    for user_dir in sorted(DATA_DIR.iterdir()):
+        if not user_dir.is_dir():
+            continue
+        paths = set()
+        for pattern in IMAGE_PATTERNS:
+            paths.update(glob.glob(str(user_dir / pattern)))
+        images.extend((user_dir.name, p) for p in sorted(paths))
+    return images
+
+
+def _file_digest(path: str) -> str:
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _encode_image(img_path: str) -> list:
+    """Detect and encode every face in one image file. Returns a list of 128-d encodings."""
+    image = cv2.imread(img_path)
+    if image is None:
+        return []
+    rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    boxes = face_recognition.face_locations(rgb, model="hog")  # "cnn" if GPU available
+    return face_recognition.face_encodings(rgb, boxes)
+
+
+def _load_embedding_cache() -> dict:
+    if not EMBEDDING_CACHE_FILE.exists():
+        return {}
+    try:
+        with open(EMBEDDING_CACHE_FILE, "rb") as f:
+            return pickle.load(f)
+    except Exception as e:
+        print("Embedding cache unreadable, re-encoding everything:", e)
+        return {}
+
+
+def _encode_images(paths: List[str], workers: int = 1, chunksize: int = 8):
+    """
+    Yield the encodings of each path, in input order.
+    With workers > 1 the images are spread over a process pool and results
+    stream back chunk by chunk as they complete.
+    """
+    if workers <= 1 or len(paths) <= 1:
+        for path in paths:
+            yield _encode_image(path)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        yield from pool.map(_encode_image, paths, chunksize=chunksize)
+
+
+def build_encodings(full: bool = False, workers: int = 1, chunksize: int = 8,
+                    dtype: str = GALLERY_DTYPE) -> Tuple[int, int]:
+    """
+    Scan face_dataset/<user_id>/* images, compute encodings, and save them as the gallery in GALLERY_DIR.
+    Encodings are cached per image, keyed on (mtime, size) with a content hash fallback,
+    so only new or changed images are re-encoded. Pass full=True to ignore the cache.
+    workers > 1 encodes images in a process pool; the output is identical to the serial run.
     Returns (num_users, num_images_encoded).
     """
+    old_cache = {} if full else _load_embedding_cache()
+    by_digest = {entry["sha1"]: entry for entry in old_cache.values()}
+
+    new_cache = {}
+    pending = {}   # sha1 -> image path still to be encoded
+    changed = full or published_gallery_dir(GALLERY_DIR) is None
+
+    images = _list_dataset_images()
+    for user_id, img_path in images:
+        key = os.path.relpath(img_path, DATA_DIR)
+        st = os.stat(img_path)
+        entry = old_cache.get(key)
+
+        if entry is None or (entry["mtime_ns"], entry["size"]) != (st.st_mtime_ns, st.st_size):
+            # new or touched file: only re-encode if the content really differs
+            digest = _file_digest(img_path)
+            cached = by_digest.get(digest)
+            entry = {"mtime_ns": st.st_mtime_ns, "size": st.st_size, "sha1": digest,
+                     "encodings": cached["encodings"] if cached is not None else None}
+            if cached is None:
+                pending.setdefault(digest, img_path)
+            changed = True
+
+        new_cache[key] = entry
+
+    # images (or whole users) removed since the last build
+    if old_cache.keys() - new_cache.keys():
+        changed = True
+
+    if pending:
+        digests = list(pending)
+        encoded = {}
+        for i, encs in enumerate(_encode_images(list(pending.values()), workers, chunksize), 1):
+            encoded[digests[i - 1]] = encs
+            if i % 100 == 0:
+                print(f"  encoded {i}/{len(digests)} images")
+        for entry in new_cache.values():
+            if entry["encodings"] is None:
+                entry["encodings"] = encoded[entry["sha1"]]
+
+    # merge in dataset order so the result does not depend on worker scheduling
     all_encodings = []
     all_ids = []
+    for user_id, img_path in images:
+        for enc in new_cache[os.path.relpath(img_path, DATA_DIR)]["encodings"]:
+            all_encodings.append(enc)
+            all_ids.append(user_id)
 
-    num_users = 0
-    num_images = 0
+    if changed:
+        _GALLERY.publish(all_ids, all_encodings, dtype=dtype)
+        with open(EMBEDDING_CACHE_FILE, "wb") as f:
+            pickle.dump(new_cache, f)
 
-    for user_dir in DATA_DIR.iterdir():
-        if not user_dir.is_dir():
-            continue
-        user_id = user_dir.name
-        num_users += 1
-
-        image_paths = []
-        for pattern in ("*.jpg", "*.jpeg", "*.png", "*.bmp", "*.webp"):
-            image_paths.extend(glob.glob(str(user_dir / pattern)))
-
-        for img_path in image_paths:
-            image = cv2.imread(img_path)
-            if image is None:
-                continue
-            rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-            boxes = face_recognition.face_locations(rgb, model="hog")  # "cnn" if GPU available
-            encs = face_recognition.face_encodings(rgb, boxes)
-            for enc in encs:
-                all_encodings.append(enc)
-                all_ids.append(user_id)
-                num_images += 1
-
-    with open(ENCODINGS_FILE, "wb") as f:
-        pickle.dump({"ids": all_ids, "encodings": all_encodings}, f)
-
-    # update cache
-    _CACHE.update({
-        "mt": os.path.getmtime(ENCODINGS_FILE) if ENCODINGS_FILE.exists() else None,
-        "ids": all_ids,
-        "encodings": all_encodings
-    })
-
-    return num_users, num_images
+    print(f"Encodings built: {len(images)} images, {len(pending)} re-encoded, {len(all_encodings)} faces")
+    num_users = sum(1 for d in DATA_DIR.iterdir() if d.is_dir())
+    return num_users, len(all_encodings)
 
 
 def load_encodings():
     """
     Load encodings into cache and return dict-like { 'ids': [...], 'encodings': [...] }
     """
-    _load_encodings_from_disk()
-    return {"ids": _CACHE["ids"], "encodings": _CACHE["encodings"]}
+    gallery = get_gallery()
+    return {"ids": list(gallery.ids), "encodings": list(gallery.encodings)}
 
 
-def recognize_faces_in_frame(frame, tolerance: float = 0.5) -> List[Dict]:
+def migrate_pickle_gallery(dtype: str = GALLERY_DTYPE) -> dict:
     """
-    Input: BGR frame (OpenCV)
-    Output: list of dicts
-    [{'user_id': 'bob', 'location': (top,right,bottom,left), 'distance': 0.36}, ...]
+    Convert a legacy encodings.pkl ({'ids': [...], 'encodings': [...]}) into the
+    binary gallery format. Only run this on a pickle you produced yourself.
+    Returns the new gallery header.
+    """
+    with open(ENCODINGS_FILE, "rb") as f:
+        data = pickle.load(f)
+    return _GALLERY.publish(data.get("ids", []), data.get("encodings", []), dtype=dtype)
+
+
+def get_gallery() -> Gallery:
+    """Return the live Gallery. Cheap enough to call per frame: the disk is checked at most every GALLERY_CHECK_INTERVAL."""
+    return _GALLERY.get()
+
+
+def gallery_generation() -> int:
+    """Incremented each time this process swaps in a new gallery."""
+    return _GALLERY.generation
+
+
+def set_roster_loader(loader, revision=None):
+    """
+    Register loader(subject_id) -> user_ids enrolled in that subject (used by subject_gallery).
+    With revision(subject_id) -> roster counter, a cached view is re-cut when the counter moves,
+    checked at most every GALLERY_CHECK_INTERVAL, so enrollments saved by another process show up.
     """
-    _load_encodings_from_disk()
-    known_encodings = _CACHE["encodings"]
-    known_ids = _CACHE["ids"]
+    global _ROSTER_LOADER, _ROSTER_REVISION
+    _ROSTER_LOADER = loader
+    _ROSTER_REVISION = revision
+    _SUBJECT_VIEWS.clear()
 
-    if not known_encodings:
-        return []
 
-    rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-    boxes = face_recognition.face_locations(rgb, model="hog")
+def invalidate_subject_gallery(subject_id=None):
+    """Drop the cached view of one subject (or all) after its roster changed."""
+    if subject_id is None:
+        _SUBJECT_VIEWS.clear()
+    else:
+        _SUBJECT_VIEWS.pop(int(subject_id), None)
+
+
+def subject_gallery(subject_id) -> Gallery:
+    """
+    The part of the gallery belonging to students enrolled in subject_id.
+    Cached until the roster changes (invalidate_subject_gallery, or a new roster revision)
+    or the global gallery is reloaded.
+    """
+    gallery = get_gallery()
+    if _ROSTER_LOADER is None:
+        return gallery
+    subject_id = int(subject_id)
+    now = time.monotonic()
+    cached = _SUBJECT_VIEWS.get(subject_id)
+    if cached is not None and cached[0] is gallery:
+        if _ROSTER_REVISION is None or now - cached[3] < GALLERY_CHECK_INTERVAL:
+            return cached[1]
+        revision = _ROSTER_REVISION(subject_id)
+        if revision == cached[2]:
+            _SUBJECT_VIEWS[subject_id] = (gallery, cached[1], revision, now)
+            return cached[1]
+    revision = _ROSTER_REVISION(subject_id) if _ROSTER_REVISION is not None else None
+    view = gallery.subset(_ROSTER_LOADER(subject_id))
+    _SUBJECT_VIEWS[subject_id] = (gallery, view, revision, now)
+    return view
+
+
+def _record_stage(stage: str, scale: float, started: float):
+    entry = _STAGE_STATS.setdefault((stage, scale), [0, 0.0])
+    entry[0] += 1
+    entry[1] += (time.perf_counter() - started) * 1000
+
+
+def get_stage_stats() -> Dict[float, Dict[str, float]]:
+    """Average milliseconds per call of each stage, grouped by detection scale."""
+    stats = {}
+    for (stage, scale), (calls, total_ms) in sorted(_STAGE_STATS.items(), key=lambda kv: (-kv[0][1], kv[0][0])):
+        stats.setdefault(scale, {})[stage] = total_ms / calls
+    return stats
+
+
+def reset_stage_stats():
+    _STAGE_STATS.clear()
+
+
+def detection_scale(scale=None) -> float:
+    """Resolve a detection scale; 'auto' shrinks until MIN_FACE_SIZE faces are HOG_MIN_FACE pixels."""
+    scale = DETECTION_SCALE if scale is None else scale
+    if scale == "auto":
+        return min(1.0, HOG_MIN_FACE / float(MIN_FACE_SIZE))
+    scale = float(scale)
+    if not 0 < scale <= 1:
+        raise ValueError(f"detection scale must be in (0, 1], got {scale}")
+    return scale
+
+
+def detect_faces(rgb, scale=None) -> List[Tuple[int, int, int, int]]:
+    """
+    HOG face boxes (top, right, bottom, left) in an RGB frame. Detection runs on a
+    copy resized by `scale` (default DETECTION_SCALE); boxes are mapped back to
+    full-resolution coordinates. HOG cost is proportional to pixel count.
+    """
+    scale = detection_scale(scale)
+    small = rgb
+    if scale < 1:
+        t0 = time.perf_counter()
+        small = cv2.resize(rgb, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        _record_stage("resize", scale, t0)
+
+    t0 = time.perf_counter()
+    boxes = face_recognition.face_locations(small, model="hog")
+    _record_stage("detect", scale, t0)
+    if scale == 1:
+        return boxes
+
+    h, w = rgb.shape[:2]
+    return [(max(0, int(top / scale)), min(w, int(round(right / scale))),
+             min(h, int(round(bottom / scale))), max(0, int(left / scale)))
+            for top, right, bottom, left in boxes]
+
+
+def identify_faces(rgb, boxes, tolerance: float = 0.5, subject_id=None,
+                   fallback_to_global: bool = False) -> List[Optional[Dict]]:
+    """
+    Encode the given face boxes and match them against the gallery in one batch.
+    Returns one entry per box: a result dict (see recognize_faces_in_frame) or None.
+    """
+    gallery = get_gallery()
+    scoped = subject_gallery(subject_id) if subject_id is not None else gallery
+
+    if not boxes or (not len(scoped) and not (fallback_to_global and len(gallery))):
+        return [None] * len(boxes)
+
+    scale = detection_scale()
+    t0 = time.perf_counter()
     encs = face_recognition.face_encodings(rgb, boxes)
+    _record_stage("encode", scale, t0)
+
+    t0 = time.perf_counter()
+    best = scoped.best_matches(encs, tolerance)
+    enrolled = [b is not None for b in best]
+    if fallback_to_global and scoped is not gallery:
+        missed = [i for i, b in enumerate(best) if b is None]
+        if missed:
+            for i, b in zip(missed, gallery.best_matches([encs[i] for i in missed], tolerance)):
+                best[i] = b
+    _record_stage("match", scale, t0)
 
     results = []
-    for enc, (top, right, bottom, left) in zip(encs, boxes):
-        distances = face_recognition.face_distance(known_encodings, enc)
-        if len(distances) == 0:
-            continue
-        best_idx = int(np.argmin(distances))
-        best_distance = float(distances[best_idx])
-        if best_distance <= tolerance:
-            results.append({
-                "user_id": known_ids[best_idx],
-                "location": (top, right, bottom, left),
-                "distance": best_distance
-            })
-
+    for b, in_roster, (top, right, bottom, left) in zip(best, enrolled, boxes):
+        results.append(None if b is None else {
+            "user_id": b[0],
+            "location": (top, right, bottom, left),
+            "distance": b[1],
+            "enrolled": in_roster
+        })
     return results
+
+
+def recognize_faces_in_frame(frame, tolerance: float = 0.5, subject_id=None,
+                             fallback_to_global: bool = False) -> List[Dict]:
+    """
+    Input: BGR frame (OpenCV)
+    Output: list of dicts
+    [{'user_id': 'bob', 'location': (top,right,bottom,left), 'distance': 0.36, 'enrolled': True}, ...]
+    With subject_id, faces are matched against that subject's students only;
+    fallback_to_global then retries unmatched faces against everyone ('enrolled': False).
+    """
+    gallery = get_gallery()
+    scoped = subject_gallery(subject_id) if subject_id is not None else gallery
+
+    if not len(scoped) and not (fallback_to_global and len(gallery)):
+        return []
+
+    rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    boxes = detect_faces(rgb)
+    matches = identify_faces(rgb, boxes, tolerance, subject_id, fallback_to_global)
+    return [m for m in matches if m is not None]
@@ -0,0 +1,450 @@
+# attendance_system/ai_modules/gallery.py
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from .ann_index import IVFIndex
+
+ENCODING_DIM = 128
+
+# On-disk gallery format (see save_gallery / load_gallery)
+GALLERY_FORMAT = "attendance-gallery"
+GALLERY_FORMAT_VERSION = 1
+MATRIX_NAME = "gallery.npy"        # (N, 128) float32 or float16 rows, grouped by user
+INDEX_NAME = "gallery_index.npz"   # users, offsets, squared row norms
+HEADER_NAME = "gallery.json"       # format version, model, dtype, count, checksum
+
+# Published generations (see publish_gallery / GalleryManager)
+CURRENT_NAME = "CURRENT"           # number of the live generation
+GENERATION_PREFIX = "gen-"         # gen-000001/, gen-000002/, ... each a complete gallery
+KEEP_GENERATIONS = 2               # the live one plus the one before it
+
+
+class Gallery:
+    """
+    All known face encodings in one contiguous float32 matrix, with a parallel
+    array of user ids (row i of the matrix belongs to ids[i]).
+    Rows are preallocated and grown geometrically so adding encodings does not
+    reallocate on every call.
+    """
+
+    def __init__(self, ids: Iterable[str] = (), encodings: Iterable = (), capacity: int = 0,
+                 dim: int = ENCODING_DIM):
+        ids = list(ids)
+        encodings = np.asarray(list(encodings), dtype=np.float32).reshape(-1, dim)
+        if len(ids) != len(encodings):
+            raise ValueError(f"got {len(ids)} ids for {len(encodings)} encodings")
+
+        capacity = max(capacity, len(ids))
+        self.dim = dim
+        self._size = 0
+        self._matrix = np.empty((capacity, dim), dtype=np.float32)
+        self._sq_norms = np.empty(capacity, dtype=np.float32)
+        self._ids = np.empty(capacity, dtype=object)
+        self._index = None  # optional IVFIndex, see build_index()
+        if len(ids):
+            self._append(ids, encodings)
+
+    @classmethod
+    def from_matrix(cls, ids: np.ndarray, matrix: np.ndarray, sq_norms: Optional[np.ndarray] = None) -> "Gallery":
+        """
+        Wrap an existing (N, dim) float32 matrix without copying it, e.g. a
+        read-only np.memmap. The matrix is only copied if the gallery is modified.
+        """
+        g = cls.__new__(cls)
+        g.dim = matrix.shape[1]
+        g._size = len(matrix)
+        g._matrix = matrix
+        if sq_norms is None:
+            sq_norms = np.einsum("ij,ij->i", matrix, matrix)
+        g._sq_norms = np.asarray(sq_norms, dtype=np.float32)
+        g._ids = np.asarray(ids, dtype=object)
+        g._index = None
+        return g
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def encodings(self) -> np.ndarray:
+        return self._matrix[:self._size]
+
+    @property
+    def ids(self) -> np.ndarray:
+        return self._ids[:self._size]
+
+    @property
+    def sq_norms(self) -> np.ndarray:
+        return self._sq_norms[:self._size]
+
+    @property
+    def index(self) -> Optional[IVFIndex]:
+        return self._index
+
+    def subset(self, user_ids: Iterable[str]) -> "Gallery":
+        """A new, compact Gallery holding only the rows of the given users."""
+        rows = np.flatnonzero(np.isin(self.ids, list(user_ids)))
+        return Gallery.from_matrix(self.ids[rows], self.encodings[rows], self.sq_norms[rows])
+
+    def build_index(self, nlist: Optional[int] = None, nprobe: int = 8, pq_m: int = 0,
+                    rerank: int = 32, trained: Optional[IVFIndex] = None) -> IVFIndex:
+        """
+        Train an approximate IVF (optionally IVF-PQ) index over the current rows.
+        search() uses it from then on; rows added later are inserted incrementally.
+        nlist defaults to ~sqrt(len(self)). Passing a `trained` index with the same
+        settings reuses its quantizers, so only the (cheap) list assignment is redone.
+        """
+        nlist = nlist or max(1, int(np.sqrt(self._size)))
+        if trained is not None and trained.is_trained and trained.pq_m == pq_m:
+            index = trained.empty_copy()
+            index.nprobe, index.rerank = nprobe, rerank
+        else:
+            index = IVFIndex(nlist=nlist, nprobe=nprobe, pq_m=pq_m, rerank=rerank)
+            index.train(self.encodings)
+        index.add(self.encodings, np.arange(self._size))
+        self._index = index
+        return index
+
+    # -----------------------
+    # Mutation
+    # -----------------------
+
+    def _reserve(self, needed: int):
+        capacity = len(self._matrix)
+        if needed <= capacity and self._matrix.flags.writeable and self._sq_norms.flags.writeable:
+            return
+        new_capacity = max(needed, capacity * 2, 64)
+        matrix = np.empty((new_capacity, self.dim), dtype=np.float32)
+        sq_norms = np.empty(new_capacity, dtype=np.float32)
+        ids = np.empty(new_capacity, dtype=object)
+        matrix[:self._size] = self._matrix[:self._size]
+        sq_norms[:self._size] = self._sq_norms[:self._size]
+        ids[:self._size] = self._ids[:self._size]
+        self._matrix, self._sq_norms, self._ids = matrix, sq_norms, ids
+
+    def _append(self, ids: List[str], encodings: np.ndarray):
+        start, end = self._size, self._size + len(ids)
+        self._reserve(end)
+        self._matrix[start:end] = encodings
+        self._sq_norms[start:end] = np.einsum("ij,ij->i", self._matrix[start:end], self._matrix[start:end])
+        self._ids[start:end] = ids
+        self._size = end
+        if self._index is not None:
+            self._index.add(self._matrix[start:end], np.arange(start, end))
+
+    def add(self, user_id: str, encodings: Iterable):
+        """Append one or more encodings for user_id."""
+        encodings = np.asarray(list(encodings), dtype=np.float32).reshape(-1, self.dim)
+        if len(encodings):
+            self._append([user_id] * len(encodings), encodings)
+
+    def remove_user(self, user_id: str) -> int:
+        """Drop every encoding of user_id. Returns the number of rows removed."""
+        keep = self.ids != user_id
+        removed = int(self._size - keep.sum())
+        if removed:
+            self._reserve(self._size)
+            n = self._size - removed
+            self._matrix[:n] = self.encodings[keep]
+            self._sq_norms[:n] = self._sq_norms[:self._size][keep]
+            self._ids[:n] = self.ids[keep]
+            self._ids[n:self._size] = None
+            self._size = n
+            if self._index is not None:
+                # row numbers shifted; retrain with the same settings
+                old = self._index
+                self.build_index(old.nlist, old.nprobe, old.pq_m, old.rerank, trained=old)
+        return removed
+
+    # -----------------------
+    # Matching
+    # -----------------------
+
+    def distances(self, face_encodings) -> np.ndarray:
+        """
+        Euclidean distance of every query encoding to every gallery row,
+        computed as one matrix product: ||a-b||^2 = |a|^2 + |b|^2 - 2 a.b
+        Returns an array of shape (num_queries, len(self)).
+        """
+        queries = np.asarray(face_encodings, dtype=np.float32).reshape(-1, self.dim)
+        q_sq = np.einsum("ij,ij->i", queries, queries)
+        sq = q_sq[:, None] + self._sq_norms[:self._size][None, :] - 2.0 * (queries @ self.encodings.T)
+        np.maximum(sq, 0.0, out=sq)
+        return np.sqrt(sq, out=sq)
+
+    def search(self, face_encodings, k: int = 1, exact: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Top-k nearest gallery rows for every query.
+        Returns (rows, distances), both of shape (num_queries, k), sorted by distance.
+        Uses the ANN index when one was built, unless exact=True.
+        """
+        k = min(k, self._size)
+        if self._index is not None and not exact and k:
+            rows, dists = self._index.search(face_encodings, k, self.encodings, self.sq_norms)
+            return rows, dists
+        dists = self.distances(face_encodings)
+        if k == 0:
+            empty = np.empty((len(dists), 0))
+            return empty.astype(np.int64), empty.astype(np.float32)
+        if k < self._size:
+            rows = np.argpartition(dists, k - 1, axis=1)[:, :k]
+        else:
+            rows = np.broadcast_to(np.arange(self._size), dists.shape).copy()
+        part = np.take_along_axis(dists, rows, axis=1)
+        order = np.argsort(part, axis=1)
+        return np.take_along_axis(rows, order, axis=1), np.take_along_axis(part, order, axis=1)
+
+    def match(self, face_encodings, k: int = 1) -> List[List[Tuple[str, float]]]:
+        """Top-k (user_id, distance) candidates per query encoding."""
+        rows, dists = self.search(face_encodings, k)
+        ids = self.ids
+        return [[(ids[r], float(d)) for r, d in zip(row, dist) if r >= 0] for row, dist in zip(rows, dists)]
+
+    def best_matches(self, face_encodings, tolerance: float) -> List[Optional[Tuple[str, float]]]:
+        """Best (user_id, distance) per query, or None where nothing is within tolerance."""
+        if not self._size:
+            return [None] * len(face_encodings)
+        return [cands[0] if cands and cands[0][1] <= tolerance else None
+                for cands in self.match(face_encodings, k=1)]
+
+
+# -----------------------
+# On-disk format
+# -----------------------
+
+def _matrix_checksum(matrix: np.ndarray) -> str:
+    return hashlib.sha256(np.ascontiguousarray(matrix).data).hexdigest()
+
+
+def save_gallery(directory, ids, encodings, dtype: str = "float32", model: str = "") -> dict:
+    """
+    Write a gallery as three files in `directory`:
+      gallery.npy        - flat (N, 128) matrix, rows grouped by user
+      gallery_index.npz  - unique user ids, row offsets per user, squared row norms
+      gallery.json       - header: format version, model, dtype, count and sha256 of the matrix
+    Nothing is pickled, so loading never executes code. The header is written
+    last; each file is replaced atomically. Returns the header dict.
+    """
+    if dtype not in ("float32", "float16"):
+        raise ValueError(f"unsupported gallery dtype {dtype!r}")
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    ids = np.asarray(list(ids), dtype=str)
+    matrix = np.asarray(list(encodings), dtype=np.float32).reshape(-1, ENCODING_DIM)
+    if len(ids) != len(matrix):
+        raise ValueError(f"got {len(ids)} ids for {len(matrix)} encodings")
+
+    # group rows by user so each user is one contiguous [start, end) slice
+    order = np.argsort(ids, kind="stable")
+    ids, matrix = ids[order], matrix[order].astype(dtype)
+    users, starts = np.unique(ids, return_index=True)
+    offsets = np.append(starts, len(ids)).astype(np.int64)
+    sq_norms = np.einsum("ij,ij->i", matrix.astype(np.float32), matrix.astype(np.float32))
+
+    header = {
+        "format": GALLERY_FORMAT,
+        "version": GALLERY_FORMAT_VERSION,
+        "model": model,
+        "dtype": dtype,
+        "count": int(len(matrix)),
+        "dim": ENCODING_DIM,
+        "users": int(len(users)),
+        "sha256": _matrix_checksum(matrix),
+    }
+
+    def _replace(name, write):
+        tmp = directory / (name + ".tmp")
+        with open(tmp, "wb") as f:
+            write(f)
+        os.replace(tmp, directory / name)
+
+    _replace(MATRIX_NAME, lambda f: np.save(f, matrix, allow_pickle=False))
+    _replace(INDEX_NAME, lambda f: np.savez(f, users=users, offsets=offsets, sq_norms=sq_norms))
+    _replace(HEADER_NAME, lambda f: f.write(json.dumps(header, indent=2).encode("utf-8")))
+    return header
+
+
+def read_gallery_header(directory) -> Optional[dict]:
+    path = Path(directory) / HEADER_NAME
+    if not path.exists():
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load_gallery(directory, model: Optional[str] = None, verify: bool = False) -> Gallery:
+    """
+    Open a gallery written by save_gallery. float32 matrices are memory-mapped
+    read-only (zero-copy); float16 ones are widened to float32 once on load.
+    Raises ValueError if the files are missing, inconsistent or for another model.
+    verify=True also recomputes the matrix checksum.
+    """
+    directory = Path(directory)
+    header = read_gallery_header(directory)
+    if header is None or header.get("format") != GALLERY_FORMAT:
+        raise ValueError(f"no gallery found in {directory}")
+    if header["version"] > GALLERY_FORMAT_VERSION:
+        raise ValueError(f"gallery format v{header['version']} is newer than supported v{GALLERY_FORMAT_VERSION}")
+    if model is not None and header["model"] != model:
+        raise ValueError(f"gallery was built with {header['model']!r}, expected {model!r}; rebuild it")
+
+    matrix = np.load(directory / MATRIX_NAME, mmap_mode="r", allow_pickle=False)
+    with np.load(directory / INDEX_NAME, allow_pickle=False) as index:
+        users, offsets, sq_norms = index["users"], index["offsets"], index["sq_norms"]
+
+    if matrix.shape != (header["count"], header["dim"]) or str(matrix.dtype) != header["dtype"] \
+            or offsets[-1] != len(matrix) or len(sq_norms) != len(matrix):
+        raise ValueError(f"gallery files in {directory} do not match their header")
+    if verify and _matrix_checksum(matrix) != header["sha256"]:
+        raise ValueError(f"gallery checksum mismatch in {directory}")
+
+    if matrix.dtype != np.float32:
+        matrix = matrix.astype(np.float32)
+    ids = np.repeat(users.astype(object), np.diff(offsets))
+    return Gallery.from_matrix(ids, matrix, sq_norms)
+
+
+# -----------------------
+# Generations
+# -----------------------
+
+def _generation_dir(root: Path, generation: int) -> Path:
+    return root / f"{GENERATION_PREFIX}{generation:06d}"
+
+
+def current_generation(root) -> Optional[int]:
+    """Number in root/CURRENT, or None if nothing has been published yet."""
+    try:
+        with open(Path(root) / CURRENT_NAME, "r", encoding="utf-8") as f:
+            return int(f.read().strip())
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def published_gallery_dir(root) -> Optional[Path]:
+    """Directory of the live gallery: the CURRENT generation, else an unversioned gallery directly in root."""
+    root = Path(root)
+    generation = current_generation(root)
+    if generation is not None:
+        return _generation_dir(root, generation)
+    if (root / HEADER_NAME).exists():
+        return root
+    return None
+
+
+def publish_gallery(root, ids, encodings, dtype: str = "float32", model: str = "") -> Tuple[int, dict]:
+    """
+    Write a complete gallery into a fresh generation directory under `root`, then
+    switch root/CURRENT to it with one atomic rename. Readers see either the old
+    or the new gallery, never a mix. Older generations beyond KEEP_GENERATIONS are removed.
+    Returns (generation, header).
+    """
+    root = Path(root)
+    root.mkdir(parents=True, exist_ok=True)
+    staging = Path(tempfile.mkdtemp(prefix=".staging-", dir=root))
+    try:
+        header = save_gallery(staging, ids, encodings, dtype=dtype, model=model)
+        existing = [int(p.name[len(GENERATION_PREFIX):]) for p in root.glob(GENERATION_PREFIX + "*")
+                    if p.name[len(GENERATION_PREFIX):].isdigit()]
+        generation = max(existing + [current_generation(root) or 0]) + 1
+        while True:
+            try:
+                os.rename(staging, _generation_dir(root, generation))
+                break
+            except OSError:
+                if not _generation_dir(root, generation).exists():
+                    raise
+                generation += 1  # another process published concurrently
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+    tmp = root / (CURRENT_NAME + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(f"{generation}\n")
+    os.replace(tmp, root / CURRENT_NAME)
+
+    for p in root.glob(GENERATION_PREFIX + "*"):
+        suffix = p.name[len(GENERATION_PREFIX):]
+        if suffix.isdigit() and int(suffix) <= generation - KEEP_GENERATIONS:
+            shutil.rmtree(p, ignore_errors=True)
+    return generation, header
+
+
+class GalleryManager:
+    """
+    Holds the live Gallery of a published root directory.
+
+    get() is what the recognition loop calls on every frame: it returns the
+    current reference and, at most once per `check_interval` seconds, reads the
+    small CURRENT file to notice generations published by other processes.
+    A new generation is loaded by whichever thread noticed it while the others
+    keep using the previous gallery; the swap is a single reference assignment.
+    `generation` counts swaps in this process.
+
+    prepare(new, old) may post-process a freshly loaded gallery (e.g. build its ANN index).
+    """
+
+    def __init__(self, root, model: Optional[str] = None, check_interval: float = 2.0,
+                 prepare: Optional[Callable[[Gallery, Gallery], Gallery]] = None):
+        self.root = Path(root)
+        self.model = model
+        self.check_interval = check_interval
+        self.prepare = prepare
+        self.generation = 0
+        self._gallery = Gallery()
+        self._published = None   # on-disk generation of _gallery (-1: unversioned, None: nothing)
+        self._checked = float("-inf")
+        self._loading = threading.Lock()
+
+    def get(self) -> Gallery:
+        now = time.monotonic()
+        if now - self._checked >= self.check_interval:
+            self._checked = now
+            self.refresh()
+        return self._gallery
+
+    def refresh(self, wait: bool = False) -> bool:
+        """Load the published generation if it differs from ours. Returns True if the gallery was swapped."""
+        if not self._loading.acquire(blocking=wait):
+            return False  # another thread is already loading it
+        try:
+            published = current_generation(self.root)
+            if published is None and (self.root / HEADER_NAME).exists():
+                published = -1
+            if published == self._published:
+                return False
+
+            gallery = Gallery()
+            if published is not None:
+                try:
+                    gallery = load_gallery(published_gallery_dir(self.root), model=self.model)
+                except (OSError, ValueError) as e:
+                    print("Face gallery not loaded, keeping the previous one:", e)
+                    self._published = published  # do not retry a broken generation every check
+                    return False
+                if self.prepare is not None:
+                    gallery = self.prepare(gallery, self._gallery)
+
+            self._gallery = gallery
+            self._published = published
+            self.generation += 1
+            return True
+        finally:
+            self._loading.release()
+
+    def publish(self, ids, encodings, dtype: str = "float32") -> dict:
+        """publish_gallery() into our root and swap it in immediately. Returns the header."""
+        _, header = publish_gallery(self.root, ids, encodings, dtype=dtype, model=self.model or "")
+        self.refresh(wait=True)
+        self._checked = time.monotonic()
+        return header
@@ -1,63 +1,130 @@
 # attendance_system/ai_modules/liveness_detection.py
+import sys
+from collections import OrderedDict
+from itertools import chain
+from typing import Dict, Hashable, List, Sequence
+
 import cv2
 import numpy as np
 import dlib
-from scipy.spatial import distance as dist
 
 # You need shape_predictor_68_face_landmarks.dat -> download manually and place path here
 SHAPE_PREDICTOR_PATH = "c:/Users/viraj/Downloads/attendance_system/attendance_system/models/shape_predictor_68_face_landmarks.dat"
 
-detector = dlib.get_frontal_face_detector()
-predictor = None
-try:
-    predictor = dlib.shape_predictor(SHAPE_PREDICTOR_PATH)
-except Exception as e:
-    print("dlib predictor not found; liveness blink detection won't work until you download the model:", e)
+# The detector and the ~100 MB landmark model are loaded on first use, not at import
+_MODELS = {}
 
-# Eye aspect ratio helper
-def eye_aspect_ratio(eye):
-    A = dist.euclidean(eye[1], eye[5])
-    B = dist.euclidean(eye[2], eye[4])
-    C = dist.euclidean(eye[0], eye[3])
-    eps = 1e-6
-    return (A + B) / (2.0 * (C + eps))
+
+def get_detector():
+    if "detector" not in _MODELS:
+        _MODELS["detector"] = dlib.get_frontal_face_detector()
+    return _MODELS["detector"]
+
+
+def get_predictor():
+    """The 68-point shape predictor, or None if the model file is missing (reported once)."""
+    if "predictor" not in _MODELS:
+        try:
+            _MODELS["predictor"] = dlib.shape_predictor(SHAPE_PREDICTOR_PATH)
+        except Exception as e:
+            print("dlib predictor not found; liveness blink detection won't work until you download the model:", e)
+            _MODELS["predictor"] = None
+    return _MODELS["predictor"]
 
 # Indexes for 68-landmark model
 LEFT_EYE_IDX = list(range(36, 42))
 RIGHT_EYE_IDX = list(range(42, 48))
+MOUTH_IDX = list(range(48, 68))
+NOSE_TIP_IDX = 30
 
 # Simple blink detector: count frames with EAR < threshold
 EAR_THRESHOLD = 0.22
 CONSEC_FRAMES = 2
 
+_EYES_IDX = np.array([LEFT_EYE_IDX, RIGHT_EYE_IDX])  # (2, 6)
+
+
+# -----------------------
+# Landmarks as arrays
+# -----------------------
+
+def shape_to_np(shape, out=None) -> np.ndarray:
+    """
+    dlib full_object_detection -> (68, 2) int32 array of (x, y), written into `out`
+    (e.g. one row of a preallocated batch) when given. dlib only exposes points as
+    objects, so the coordinates are streamed into the array without building
+    per-point tuples or an intermediate list.
+    """
+    if out is None:
+        out = np.empty((68, 2), dtype=np.int32)
+    out.reshape(-1)[:] = np.fromiter(chain.from_iterable((p.x, p.y) for p in shape.parts()),
+                                     dtype=out.dtype, count=out.size)
+    return out
+
+
+def _to_dlib_rect(rect):
+    if isinstance(rect, tuple):
+        top, right, bottom, left = rect
+        return dlib.rectangle(int(left), int(top), int(right), int(bottom))
+    return rect
+
+
+def face_landmarks(gray_frame, rects: Sequence) -> np.ndarray:
+    """
+    68-point landmarks for every face box (dlib rectangles or (top, right, bottom, left)).
+    Returns an (n, 68, 2) int32 array, filled in place; the predictor runs once per face.
+    """
+    predictor = get_predictor()
+    if predictor is None or not len(rects):
+        return np.empty((0, 68, 2), dtype=np.int32)
+    landmarks = np.empty((len(rects), 68, 2), dtype=np.int32)
+    for i, rect in enumerate(rects):
+        shape_to_np(predictor(gray_frame, _to_dlib_rect(rect)), out=landmarks[i])
+    return landmarks
+
+
+def eye_aspect_ratios(landmarks: np.ndarray) -> np.ndarray:
+    """
+    Mean eye aspect ratio of both eyes for a batch of (n, 68, 2) landmark arrays; returns (n,).
+    EAR = (|p1-p5| + |p2-p4|) / (2 |p0-p3|) over the six points of each eye.
+    """
+    eyes = landmarks[:, _EYES_IDX].astype(np.float32)   # (n, 2, 6, 2)
+    vertical = np.linalg.norm(eyes[:, :, [1, 2]] - eyes[:, :, [5, 4]], axis=-1).sum(axis=-1)
+    horizontal = np.linalg.norm(eyes[:, :, 0] - eyes[:, :, 3], axis=-1)
+    ear = vertical / (2.0 * (horizontal + 1e-6))        # (n, 2)
+    return ear.mean(axis=1)
+
+
+# Eye aspect ratio helper
+def eye_aspect_ratio(eye):
+    """EAR of one eye given its six (x, y) points."""
+    eye = np.asarray(eye, dtype=np.float32)
+    A = np.linalg.norm(eye[1] - eye[5])
+    B = np.linalg.norm(eye[2] - eye[4])
+    C = np.linalg.norm(eye[0] - eye[3])
+    eps = 1e-6
+    return (A + B) / (2.0 * (C + eps))
+
+
 class BlinkDetector:
+    """
+    Per-face blink state. The landmarks and EAR of the last processed frame are
+    kept in `landmarks` / `ear` so other liveness checks can reuse them.
+    """
+
+    __slots__ = ("counter", "blinks", "landmarks", "ear", "last_seen")
+
     def __init__(self):
         self.counter = 0
         self.blinks = 0
-
-    def process(self, gray_frame, rect):
-        """
-        rect: dlib rectangle or (top,right,bottom,left)
-        returns True if blink detected recently (i.e., we saw a blink)
-        """
-        if predictor is None:
-            return False
-        if isinstance(rect, tuple):
-            top, right, bottom, left = rect
-            rect_dlib = dlib.rectangle(left, top, right, bottom)
-        else:
-            rect_dlib = rect
-
-        shape = predictor(gray_frame, rect_dlib)
-        coords = []
-        for i in range(0,68):
-            coords.append((shape.part(i).x, shape.part(i).y))
-        leftEye = [coords[i] for i in LEFT_EYE_IDX]
-        rightEye = [coords[i] for i in RIGHT_EYE_IDX]
-        leftEAR = eye_aspect_ratio(leftEye)
-        rightEAR = eye_aspect_ratio(rightEye)
-        ear = (leftEAR + rightEAR) / 2.0
-
+        self.landmarks = None   # (68, 2) int32 from the last frame, or None
+        self.ear = None
+        self.last_seen = 0.0    # set by LivenessStore
+
+    def update(self, ear: float, landmarks=None) -> bool:
+        """Feed one frame's EAR; returns True on the frame a blink completes."""
+        self.ear = ear
+        self.landmarks = landmarks
         if ear < EAR_THRESHOLD:
             self.counter += 1
         else:
@@ -68,6 +135,80 @@ class BlinkDetector:
             self.counter = 0
         return False
 
+    def process(self, gray_frame, rect):
+        """
+        rect: dlib rectangle or (top,right,bottom,left)
+        returns True if blink detected recently (i.e., we saw a blink)
+        """
+        if get_predictor() is None:
+            return False
+        return detect_blinks(gray_frame, [self], [rect])[0]
+
+
+def detect_blinks(gray_frame, detectors: Sequence[BlinkDetector], rects: Sequence) -> List[bool]:
+    """
+    Blink check for several faces of one frame: landmarks per face, one batched
+    EAR computation, then each face's detector is updated. Returns one bool per face.
+    """
+    if get_predictor() is None or not len(rects):
+        return [False] * len(rects)
+    landmarks = face_landmarks(gray_frame, rects)
+    ears = eye_aspect_ratios(landmarks)
+    return [det.update(float(ear), lm) for det, ear, lm in zip(detectors, ears, landmarks)]
+
+
+class LivenessStore:
+    """
+    BlinkDetectors keyed by face track, bounded for all-day streams.
+    Entries unseen for `ttl` seconds are dropped, and beyond `max_entries`
+    the least recently seen one is evicted. Keys are whatever identifies a
+    face over time, e.g. (track_id, user_id).
+    """
+
+    def __init__(self, max_entries: int = 512, ttl: float = 30.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._states: "OrderedDict[Hashable, BlinkDetector]" = OrderedDict()  # least recently seen first
+        self.created = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self._states)
+
+    def __contains__(self, key):
+        return key in self._states
+
+    def get(self, key: Hashable, now: float) -> BlinkDetector:
+        """The detector for `key`, created if needed, marked as seen at `now`."""
+        state = self._states.get(key)
+        if state is None:
+            state = self._states[key] = BlinkDetector()
+            self.created += 1
+            if len(self._states) > self.max_entries:
+                self._states.popitem(last=False)
+                self.evicted += 1
+        else:
+            self._states.move_to_end(key)
+        state.last_seen = now
+        return state
+
+    def expire(self, now: float):
+        """Drop states not seen for ttl seconds; cheap, only looks at the oldest entries."""
+        while self._states:
+            key, state = next(iter(self._states.items()))
+            if now - state.last_seen <= self.ttl:
+                break
+            del self._states[key]
+            self.expired += 1
+
+    def stats(self) -> Dict:
+        approx = sys.getsizeof(self._states) + sum(
+            sys.getsizeof(st) + (st.landmarks.nbytes if st.landmarks is not None else 0)
+            for st in self._states.values())
+        return {"entries": len(self._states), "created": self.created, "expired": self.expired,
+                "evicted": self.evicted, "approx_bytes": approx}
+
 
 # attendance_system/ai_modules/liveness_detection.py NEW CODE FOR VIDEO IDENTIFY
 # import cv2
@@ -0,0 +1,261 @@
+# attendance_system/ai_modules/tracking.py
+"""
+Detect-then-track for the live attendance stream.
+
+Full HOG detection runs every `detect_every` frames (or sooner when a track is
+lost or its identity confidence has decayed). In between, each face box is
+moved with sparse Lucas-Kanade optical flow, which costs a fraction of a
+millisecond per face. Tracks keep the identity they were recognised with in an
+IdentityCache; a face is only re-encoded once that identity has decayed, aged
+past its TTL, or the face's box has jumped away from where it was encoded.
+"""
+import itertools
+import time
+from typing import Dict, List, Optional
+
+import cv2
+import numpy as np
+
+from . import face_recognition as fr
+
+_LK_PARAMS = dict(winSize=(15, 15), maxLevel=2,
+                  criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 10, 0.03))
+
+
+def iou(a, b) -> float:
+    """Intersection over union of two (top, right, bottom, left) boxes."""
+    top, bottom = max(a[0], b[0]), min(a[2], b[2])
+    left, right = max(a[3], b[3]), min(a[1], b[1])
+    inter = max(0, bottom - top) * max(0, right - left)
+    if not inter:
+        return 0.0
+    area_a = (a[2] - a[0]) * (a[1] - a[3])
+    area_b = (b[2] - b[0]) * (b[1] - b[3])
+    return inter / float(area_a + area_b - inter)
+
+
+class Track:
+    def __init__(self, track_id: int, box):
+        self.track_id = track_id
+        self.box = box            # (top, right, bottom, left)
+        self.points = None        # LK feature points inside the box
+        self.misses = 0           # consecutive detection rounds without a matching box
+
+    def result(self, match: Dict) -> Dict:
+        m = dict(match)
+        m["location"] = self.box
+        m["track_id"] = self.track_id
+        return m
+
+
+# -----------------------
+# Identity cache
+# -----------------------
+
+class _Identity:
+    __slots__ = ("match", "confidence", "box", "encoded_at")
+
+    def __init__(self, match, confidence, box, encoded_at):
+        self.match = match            # recognition result dict, or None for an unknown face
+        self.confidence = confidence  # 1.0 for a close match, decays every frame
+        self.box = box                # box the encoding was computed on
+        self.encoded_at = encoded_at
+
+
+class IdentityCache:
+    """
+    Last identity per track id. A cached identity is reused until one of:
+      - its confidence decays below `min_confidence` (close matches start at 1.0,
+        borderline matches just above min_confidence, so they are re-checked sooner);
+      - it is older than `ttl` seconds (`unknown_ttl` for faces that matched nobody);
+      - the track's box has moved so far from the encoded box that IoU < `reencode_iou`.
+    """
+
+    def __init__(self, tolerance: float = 0.5, confident_distance: float = 0.4, decay: float = 0.97,
+                 min_confidence: float = 0.5, ttl: float = 10.0, unknown_ttl: float = 1.0,
+                 reencode_iou: float = 0.3):
+        self.tolerance = tolerance
+        self.confident_distance = confident_distance
+        self.decay_rate = decay
+        self.min_confidence = min_confidence
+        self.ttl = ttl
+        self.unknown_ttl = unknown_ttl
+        self.reencode_iou = reencode_iou
+        self._entries: Dict[int, _Identity] = {}
+        self.hits = 0
+        self.encodes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def decay(self):
+        for e in self._entries.values():
+            e.confidence *= self.decay_rate
+
+    def match(self, track_id: int) -> Optional[Dict]:
+        e = self._entries.get(track_id)
+        return e.match if e is not None else None
+
+    def is_fresh(self, track_id: int, box, now: float) -> bool:
+        """True if the cached identity of `track_id` can be reused for a face at `box`."""
+        e = self._entries.get(track_id)
+        if e is None:
+            return False
+        ttl = self.ttl if e.match is not None else self.unknown_ttl
+        fresh = now - e.encoded_at <= ttl and iou(e.box, box) >= self.reencode_iou \
+            and (e.match is None or e.confidence >= self.min_confidence)
+        if fresh:
+            self.hits += 1
+        return fresh
+
+    def any_decayed(self) -> bool:
+        return any(e.match is not None and e.confidence < self.min_confidence for e in self._entries.values())
+
+    def put(self, track_id: int, box, match: Optional[Dict], now: float):
+        if match is None:
+            confidence = 0.0
+        else:
+            # linear from 1.0 at confident_distance down to min_confidence at the tolerance
+            span = max(self.tolerance - self.confident_distance, 1e-6)
+            excess = min(max(match.get("distance", 0.0) - self.confident_distance, 0.0) / span, 1.0)
+            confidence = 1.0 - excess * (1.0 - self.min_confidence)
+        self._entries[track_id] = _Identity(match, confidence, box, now)
+        self.encodes += 1
+
+    def retain(self, track_ids):
+        """Forget every track not in `track_ids`."""
+        keep = set(track_ids)
+        for tid in [tid for tid in self._entries if tid not in keep]:
+            del self._entries[tid]
+
+    def stats(self) -> Dict:
+        total = self.hits + self.encodes
+        return {"tracks": len(self._entries), "hits": self.hits, "encodes": self.encodes,
+                "hit_rate": self.hits / total if total else 0.0}
+
+
+class FaceTracker:
+    """Per-stream tracker; process(frame) returns the same dicts as recognize_faces_in_frame plus 'track_id'."""
+
+    def __init__(self, subject_id=None, tolerance: float = 0.5, fallback_to_global: bool = False,
+                 detect_every: int = 5, decay: float = 0.97, min_confidence: float = 0.5,
+                 iou_threshold: float = 0.3, max_misses: int = 2, identity_ttl: float = 10.0,
+                 unknown_ttl: float = 1.0, reencode_iou: float = 0.3):
+        self.subject_id = subject_id
+        self.tolerance = tolerance
+        self.fallback_to_global = fallback_to_global
+        self.detect_every = detect_every
+        self.iou_threshold = iou_threshold
+        self.max_misses = max_misses
+        self.identities = IdentityCache(tolerance=tolerance, decay=decay, min_confidence=min_confidence,
+                                        ttl=identity_ttl, unknown_ttl=unknown_ttl, reencode_iou=reencode_iou)
+
+        self.tracks: List[Track] = []
+        self._ids = itertools.count(1)
+        self._prev_gray = None
+        self._since_detect = 0
+        self._force_detect = True
+
+    # -----------------------
+    # Per frame
+    # -----------------------
+
+    def process(self, frame, gray=None, now: Optional[float] = None) -> List[Dict]:
+        """`now` is the frame's timestamp in seconds (defaults to the monotonic clock)."""
+        if gray is None:
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        if now is None:
+            now = time.monotonic()
+
+        self.identities.decay()
+        if self._force_detect or self._since_detect >= self.detect_every - 1 or self.identities.any_decayed():
+            self._detect(frame, gray, now)
+        else:
+            self._follow(gray)
+            self._since_detect += 1
+
+        self._prev_gray = gray
+        results = []
+        for t in self.tracks:
+            match = self.identities.match(t.track_id)
+            if match is not None and t.misses == 0:
+                results.append(t.result(match))
+        return results
+
+    def stats(self) -> Dict:
+        return self.identities.stats()
+
+    def _follow(self, gray):
+        """Shift every box by the median optical-flow displacement of its feature points."""
+        h, w = gray.shape[:2]
+        for t in self.tracks:
+            if t.misses:
+                continue  # not seen at the last detection: waits there to be matched or dropped
+            if t.points is None or len(t.points) < 4:
+                self._force_detect = True
+                continue
+            new_pts, status, _ = cv2.calcOpticalFlowPyrLK(self._prev_gray, gray, t.points, None, **_LK_PARAMS)
+            good = status.reshape(-1) == 1
+            if good.sum() < 4:
+                t.points = None
+                self._force_detect = True
+                continue
+            dx, dy = np.median(new_pts[good] - t.points[good], axis=0).reshape(2)
+            top, right, bottom, left = t.box
+            t.box = (int(np.clip(top + dy, 0, h - 1)), int(np.clip(right + dx, 0, w - 1)),
+                     int(np.clip(bottom + dy, 0, h - 1)), int(np.clip(left + dx, 0, w - 1)))
+            t.points = new_pts[good].reshape(-1, 1, 2)
+
+    def _detect(self, frame, gray, now: float):
+        rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        boxes = fr.detect_faces(rgb)
+
+        # greedy IoU association, best pairs first
+        pairs = sorted(((iou(t.box, b), ti, bi) for ti, t in enumerate(self.tracks) for bi, b in enumerate(boxes)),
+                       reverse=True)
+        used_t, used_b = set(), set()
+        for score, ti, bi in pairs:
+            if score < self.iou_threshold:
+                break
+            if ti in used_t or bi in used_b:
+                continue
+            used_t.add(ti)
+            used_b.add(bi)
+            self.tracks[ti].box = boxes[bi]
+            self.tracks[ti].misses = 0
+
+        kept = []
+        for ti, t in enumerate(self.tracks):
+            if ti not in used_t:
+                t.misses += 1
+                t.points = None  # stale; re-seeded when a detection matches the track again
+            if t.misses <= self.max_misses:
+                kept.append(t)
+        for bi, b in enumerate(boxes):
+            if bi not in used_b:
+                kept.append(Track(next(self._ids), b))
+        self.tracks = kept
+        # a missed track's identity is dropped too: it would otherwise decay unseen and force
+        # a full detection every frame; the face is re-encoded if it is detected again
+        self.identities.retain(t.track_id for t in kept if t.misses == 0)
+
+        # encode only faces whose cached identity is missing, decayed, expired or jumped
+        stale = [t for t in self.tracks if t.misses == 0 and not self.identities.is_fresh(t.track_id, t.box, now)]
+        if stale:
+            matches = fr.identify_faces(rgb, [t.box for t in stale], self.tolerance,
+                                        self.subject_id, self.fallback_to_global)
+            for t, m in zip(stale, matches):
+                self.identities.put(t.track_id, t.box, m, now)
+
+        for t in self.tracks:
+            if t.misses == 0:
+                t.points = self._features(gray, t.box)
+        self._since_detect = 0
+        self._force_detect = False
+
+    @staticmethod
+    def _features(gray, box) -> Optional[np.ndarray]:
+        top, right, bottom, left = box
+        mask = np.zeros(gray.shape[:2], dtype=np.uint8)
+        mask[max(0, top):max(0, bottom), max(0, left):max(0, right)] = 255
+        return cv2.goodFeaturesToTrack(gray, maxCorners=30, qualityLevel=0.01, minDistance=3, mask=mask)
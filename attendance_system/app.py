@@ -1,33 +1,98 @@
 import os
+import threading
 import time
 import base64
 from datetime import datetime
 from functools import wraps
 
-import cv2
-from flask import (Flask, Response, flash, redirect, render_template, request,
-                   session, url_for)
+from flask import (Flask, Response, flash, g, jsonify, redirect, render_template,
+                   request, session, url_for)
 from werkzeug.utils import secure_filename
 
 # import your DB helper
 import database_manager as db
+import attendance_writer
+import bulk_import
+import attendance_matrix
 
-# import our AI modules (make sure these files exist)
-from ai_modules import face_recognition as fr
-from ai_modules.liveness_detection import BlinkDetector
+# reads the orchestrator's status files only; no CV imports
+import camera_orchestrator as cameras
 
 # --- Flask app setup ---
 app = Flask(__name__)
 app.secret_key = 'your_super_secret_key'  # replace in production
 
-# Where to store uploaded enrollment photos
-DATASET_DIR = getattr(fr, "DATA_DIR", os.path.join(os.path.dirname(__file__), "face_dataset"))
-ENCODINGS_FILE = getattr(fr, "ENCODINGS_FILE", os.path.join(os.path.dirname(__file__), "encodings", "encodings.pkl"))
+# Where to store uploaded enrollment photos (same paths as ai_modules.face_recognition)
+DATASET_DIR = os.path.join(os.path.dirname(__file__), "face_dataset")
+ENCODINGS_FILE = os.path.join(os.path.dirname(__file__), "encodings", "encodings.pkl")
 
 # Ensure dataset + encodings dir exist
 os.makedirs(DATASET_DIR, exist_ok=True)
 os.makedirs(os.path.dirname(ENCODINGS_FILE), exist_ok=True)
 
+CAMERA_SOURCE = 0  # cv2.VideoCapture source for live sessions
+
+
+# One database transaction per request on the worker thread's persistent connection
+@app.before_request
+def begin_db_transaction():
+    db.begin()
+    g.db_transaction = True
+
+@app.teardown_request
+def finish_db_transaction(error=None):
+    if g.pop('db_transaction', False):
+        db.finish(ok=error is None)
+
+def own_transactions(f):
+    """Views that commit in chunks themselves (bulk import) leave the per-request transaction."""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if g.pop('db_transaction', False):
+            db.finish()
+        return f(*args, **kwargs)
+    return decorated_function
+
+# ATTENDANCE_REPORT_ONLY=1 runs a worker for admin pages and reports that never imports cv2/dlib
+REPORT_ONLY = os.environ.get("ATTENDANCE_REPORT_ONLY", "").lower() in ("1", "true", "yes")
+
+
+# -------------------------
+# AI modules, imported on first use
+# -------------------------
+_AI = {}
+_AI_LOCK = threading.Lock()
+
+def ai_modules():
+    """
+    (face_recognition, attendance_stream), imported and wired up on the first call.
+    Importing them loads cv2, dlib and its models, which costs seconds and hundreds
+    of MB, so workers only pay for it once a page actually needs recognition.
+    """
+    with _AI_LOCK:
+        if not _AI:
+            from ai_modules import face_recognition as fr
+            import attendance_stream as stream
+
+            # Live recognition only searches the students enrolled in the session's subject
+            fr.set_roster_loader(lambda subject_id: [s['user_id'] for s in db.get_enrolled_students(subject_id)],
+                                 revision=db.get_roster_revision)
+            db.add_roster_listener(fr.invalidate_subject_gallery)
+            # Students already marked present today skip the liveness check
+            stream.set_present_loader(lambda subject_id: [r['student_id'] for r in db.get_attendance_for_subject_today(subject_id)
+                                                          if r['status'] == 'Present'])
+            _AI.update(fr=fr, stream=stream)
+    return _AI["fr"], _AI["stream"]
+
+def cv_required(f):
+    """Routes that run recognition; a report-only worker answers 503."""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if REPORT_ONLY:
+            return Response("Face recognition is not available on this worker.", status=503, mimetype='text/plain')
+        return f(*args, **kwargs)
+    return decorated_function
+
 
 # -------------------------
 # Authentication decorators
@@ -137,18 +202,52 @@ def manage_enrollments():
     enrolled_students = [s['user_id'] for s in db.get_enrolled_students(selected_subject_id)] if selected_subject_id else []
     if request.method == 'POST':
         subject_id = request.form.get('subject_id')
-        enrolled_ids = request.form.getlist('student_ids')
-        currently_enrolled = [s['user_id'] for s in db.get_enrolled_students(subject_id)]
-        for sid in enrolled_ids:
-            if sid not in currently_enrolled: db.enroll_student(sid, subject_id)
-        for sid in currently_enrolled:
-            if sid not in enrolled_ids: db.unenroll_student(sid, subject_id)
-        flash("Enrollments updated!", "success")
+        added, removed = db.set_enrollments(subject_id, request.form.getlist('student_ids'))
+        flash(f"Enrollments updated! {added} added, {removed} removed.", "success")
         return redirect(url_for('manage_enrollments', subject_id=subject_id))
     return render_template('manage_enrollments.html', subjects=db.get_all_subjects(), students=db.get_all_users_by_role('student'),
                            selected_subject_id=selected_subject_id, enrolled_students=enrolled_students)
 
 
+# Encoding a term's worth of photos takes minutes: the import saves them and returns,
+# and the gallery update runs here in the background (one at a time).
+BUILD_WORKERS = int(os.environ.get("ATTENDANCE_BUILD_WORKERS", "1"))  # processes encoding new photos
+GALLERY_BUILD = bulk_import.GalleryBuild(lambda: ai_modules()[0].build_encodings(workers=BUILD_WORKERS))
+
+@app.route('/admin/import', methods=['GET', 'POST'])
+@login_required
+@role_required('admin')
+@own_transactions
+def bulk_import_users():
+    """Users/enrollments CSV and/or a ZIP of <user_id>/<photo> images; see bulk_import.py."""
+    if request.method == 'POST':
+        users_csv, photos_zip = request.files.get('users_csv'), request.files.get('photos_zip')
+        users_csv = users_csv if users_csv and users_csv.filename else None
+        photos_zip = photos_zip if photos_zip and photos_zip.filename else None
+        if not users_csv and not photos_zip:
+            flash("Choose a CSV file and/or a ZIP of photos.", "warning")
+            return redirect(request.url)
+
+        report = bulk_import.run(bulk_import.text_stream(users_csv.stream) if users_csv else None,
+                                 photos_zip.stream if photos_zip else None, build=False)
+        if report.photos:
+            if REPORT_ONLY:
+                flash("Photos saved. Encodings will be rebuilt by a recognition worker "
+                      "(or run: python manage_faces.py build).", "info")
+            else:
+                GALLERY_BUILD.start()
+                flash("Photos saved; the gallery is being updated in the background.", "info")
+        flash(f"Import finished: {report.summary()}.", "success" if not report.errors else "warning")
+        return render_template('bulk_import.html', report=report, build=GALLERY_BUILD.status())
+    return render_template('bulk_import.html', report=None, build=GALLERY_BUILD.status())
+
+@app.route('/admin/import/status')
+@login_required
+@role_required('admin')
+def bulk_import_status():
+    """State of the background gallery update started by the last photo import."""
+    return jsonify(GALLERY_BUILD.status())
+
 # -------------------------
 # Enrollment (Upload + Webcam)
 # -------------------------
@@ -202,7 +301,12 @@ def enroll_user(user_id):
             return redirect(request.url)
 
         # rebuild encodings
+        if REPORT_ONLY:
+            flash("Photos saved. Encodings will be rebuilt by a recognition worker "
+                  "(or run: python manage_faces.py build).", "info")
+            return redirect(url_for('manage_users'))
         try:
+            fr, _ = ai_modules()
             num_users, num_imgs = fr.build_encodings()
             flash(f"Enrollment updated. (users: {num_users}, images encoded: {num_imgs})", "success")
         except Exception as e:
@@ -257,30 +361,41 @@ def student_history(subject_id, student_id):
 @login_required
 @role_required('teacher')
 def historical_report(subject_id):
+    """Daily / term reports read the attendance rollups; monthly reports are a cached student x day matrix."""
     subject = db.get_subject_by_id(subject_id)
+    report_type = request.form.get('report_type', '')
     report_data, report_title, present_count, absent_count = [], "", 0, 0
+    student_totals, period_totals, matrix = [], [], None
 
     if request.method == 'POST':
-        report_type = request.form.get('report_type')
         if report_type == 'daily':
             report_date = request.form['report_date']
             report_data = db.get_attendance_for_subject_by_date(subject_id, report_date)
             report_title = f"Report for {datetime.strptime(report_date, '%Y-%m-%d').strftime('%B %d, %Y')}"
-            for record in report_data:
-                if record['status'] == 'Present':
-                    present_count += 1
-                elif record['status'] == 'Absent':
-                    absent_count += 1
+            period_totals = db.get_daily_totals(subject_id, report_date, report_date)
         elif report_type == 'monthly':
-            month_str = request.form['report_month']
-            year, month = map(int, month_str.split('-'))
-            _, num_days = __import__('calendar').monthrange(year, month)
-            start_date, end_date = f"{year}-{month:02d}-01", f"{year}-{month:02d}-{num_days}"
-            report_data = db.get_attendance_for_subject_by_month(subject_id, start_date, end_date)
-            report_title = f"Report for {datetime(year, month, 1).strftime('%B %Y')}"
+            # student x day matrix; an optional end month makes it a multi-month grid
+            start_month, end_month = sorted((request.form['report_month'],
+                                             request.form.get('report_month_end') or request.form['report_month']))
+            matrix = attendance_matrix.build_matrix(subject_id, start_month, end_month)
+            report_title = f"Report for {datetime.strptime(start_month, '%Y-%m').strftime('%B %Y')}"
+            if end_month != start_month:
+                report_title += f" - {datetime.strptime(end_month, '%Y-%m').strftime('%B %Y')}"
+        elif report_type == 'term':
+            start_month, end_month = sorted((request.form['start_month'], request.form['end_month']))
+            report_title = (f"Report for {datetime.strptime(start_month, '%Y-%m').strftime('%B %Y')} - "
+                            f"{datetime.strptime(end_month, '%Y-%m').strftime('%B %Y')}")
+            period_totals = db.get_monthly_totals(subject_id, start_month, end_month)
+            student_totals = db.get_student_totals(subject_id, start_month, end_month)
+        if matrix is not None:
+            present_count, absent_count = matrix.present_count, matrix.absent_count
+        else:
+            present_count = sum(row['present'] for row in period_totals)
+            absent_count = sum(row['absent'] for row in period_totals)
 
-    return render_template('historical_report.html', subject=subject, report_data=report_data,
-                           report_title=report_title, present_count=present_count, absent_count=absent_count)
+    return render_template('historical_report.html', subject=subject, report_type=report_type, report_data=report_data,
+                           report_title=report_title, present_count=present_count, absent_count=absent_count,
+                           student_totals=student_totals, period_totals=period_totals, matrix=matrix)
 
 
 # -------------------------
@@ -289,85 +404,54 @@ def historical_report(subject_id):
 @app.route('/video_feed/<int:subject_id>')
 @login_required
 @role_required('teacher')
+@cv_required
 def video_feed(subject_id):
-    return Response(gen_frames(subject_id), mimetype='multipart/x-mixed-replace; boundary=frame')
+    """?quality=high|medium|low picks the preview tier (default medium); slow clients are moved down."""
+    _, stream = ai_modules()
+    tier = request.args.get('quality', stream.DEFAULT_PREVIEW_TIER)
+    if tier not in stream.PREVIEW_TIERS:
+        return Response(f"unknown quality {tier!r}", status=400, mimetype='text/plain')
+    try:
+        viewer = stream.subscribe(CAMERA_SOURCE, subject_id, mark_attendance_record, tier)
+    except stream.CameraBusy as e:
+        return Response(str(e), status=409, mimetype='text/plain')
+    return Response(viewer.frames(), mimetype='multipart/x-mixed-replace; boundary=frame')
 
 def mark_attendance_record(student_id, subject_id, status='Present'):
-    try:
-        if hasattr(db, "log_attendance"):
-            db.log_attendance(student_id, subject_id, status=status)
-        else:
-            db.manual_attendance_update(student_id, subject_id, status)
-    except Exception as e:
-        print("Failed to mark attendance:", e)
-
-#new gen frames function with live detection:
-def gen_frames(subject_id):
-    cap = cv2.VideoCapture(0)
-    if not cap.isOpened():
-        print("ERROR: Unable to open camera (index 0).")
-    blink_detectors = {}
-    recognized_recent = {}
-    MIN_LOG_INTERVAL = 30  # seconds between duplicate logs
+    """Called from the camera pipeline: queues the mark for the write-behind writer, never touches disk."""
+    if not attendance_writer.submit(student_id, subject_id, status=status):
+        print(f"Attendance writer full, will retry {student_id} on a later frame")
+        return False
+    return True
 
-    try:
-        while True:
-            success, frame = cap.read()
-            if not success:
-                break
+@app.route('/stream_stats')
+@login_required
+@role_required('teacher')
+def stream_stats():
+    """Per-camera fps, queue depths, drop counts and viewer counts of the live streams."""
+    if not _AI:
+        return jsonify([])  # nothing has streamed from this worker yet
+    _, stream = ai_modules()
+    return jsonify(stream.broadcaster_stats())
 
-            try:
-                matches = fr.recognize_faces_in_frame(frame, tolerance=0.5)
-            except Exception as e:
-                matches = []
-                print("Face recognition error:", e)
-
-            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-
-            for m in matches:
-                user_id = m.get('user_id')
-                top, right, bottom, left = m.get('location')
-
-                # Draw rectangle around detected face
-                cv2.rectangle(frame, (left, top), (right, bottom), (0, 255, 0), 2)
-                label = f"{user_id} {m.get('distance', 0):.2f}"
-                cv2.putText(frame, label, (left, max(10, top - 10)),
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
-
-                # Initialize blink detector for the user
-                if user_id not in blink_detectors:
-                    blink_detectors[user_id] = BlinkDetector()
-
-                # Debugging for blink detection
-                try:
-                    blinked = blink_detectors[user_id].process(gray, m['location'])
-                    print(f"Blink status for {user_id}: {blinked}")
-                except Exception as e:
-                    print("Blink detection error:", e)
-                    blinked = False
-
-                now_ts = time.time()
-                last_ts = recognized_recent.get(user_id, 0)
-
-                # --- TEMPORARY BYPASS: Ignore blink detection for testing ---
-                # if (now_ts - last_ts) > MIN_LOG_INTERVAL:
-                if blinked and (now_ts - last_ts) > MIN_LOG_INTERVAL:
-
-                    print(f"Marking attendance for {user_id} in subject {subject_id}")
-                    mark_attendance_record(user_id, subject_id, status='Present')
-                    recognized_recent[user_id] = now_ts
-                    cv2.putText(frame, f"Marked {user_id}", (left, bottom + 25),
-                                cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
-
-            # Stream frame
-            ret, buffer = cv2.imencode('.jpg', frame)
-            if not ret:
-                continue
-            frame_bytes = buffer.tobytes()
-            yield (b'--frame\r\n'
-                   b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
-    finally:
-        cap.release()
+
+# -------------------------
+# Orchestrated classroom cameras (camera_orchestrator.py runs the inference)
+# -------------------------
+@app.route('/cameras')
+@login_required
+@role_required('teacher')
+def camera_list():
+    """fps, latency and current subject of every orchestrated camera."""
+    return jsonify(cameras.camera_status())
+
+@app.route('/cameras/<name>/feed')
+@login_required
+@role_required('teacher')
+def camera_feed(name):
+    if cameras.latest_jpeg(name) is None:
+        return Response(f"no frames from camera {name}", status=404, mimetype='text/plain')
+    return Response(cameras.camera_frames(name), mimetype='multipart/x-mixed-replace; boundary=frame')
 
 
 
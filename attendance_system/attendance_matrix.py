@@ -0,0 +1,186 @@
+"""
+Student x day attendance matrix for monthly / multi-month reports.
+
+    matrix = build_matrix(subject_id, "2024-01", "2024-03")
+    matrix.codes            # int8 [students, class days]: 0 none, 1 Present, 2 Absent, 3 other
+    matrix.student_present  # per-student totals; day_present etc. per day
+
+Each month is loaded with one query (database_manager.get_attendance_codes)
+and scattered into a small int8 array with NumPy; totals are column / row
+sums, so nothing is aggregated row by row in Python or in the template.
+Months are cached per (subject, month) and reused until their revision in
+the daily rollup (database_manager.get_month_revisions) changes, so only the
+current month is usually re-read; stale months are read one contiguous run
+at a time, never the fresh months between them.
+"""
+import calendar
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+import database_manager as db
+
+NONE, PRESENT, ABSENT, OTHER = 0, 1, 2, 3
+SYMBOLS = np.array(["", "P", "A", "O"])
+MAX_CACHED_MONTHS = 512
+
+
+def month_range(start_month, end_month):
+    """['YYYY-MM', ...] from start_month to end_month inclusive."""
+    year, month = map(int, start_month.split("-"))
+    end = tuple(map(int, end_month.split("-")))
+    months = []
+    while (year, month) <= end:
+        months.append(f"{year}-{month:02d}")
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+
+class _MonthCache:
+    """(subject_id, month) -> (revision, student_ids, codes [students, days in month]); LRU-bounded."""
+
+    def __init__(self, max_entries: int = MAX_CACHED_MONTHS):
+        self.max_entries = max_entries
+        self._months = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, revision):
+        with self._lock:
+            entry = self._months.get(key)
+            if entry is None or entry[0] != revision:
+                self.misses += 1
+                return None
+            self._months.move_to_end(key)
+            self.hits += 1
+            return entry[1], entry[2]
+
+    def put(self, key, revision, student_ids, codes):
+        with self._lock:
+            self._months[key] = (revision, student_ids, codes)
+            self._months.move_to_end(key)
+            while len(self._months) > self.max_entries:
+                self._months.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._months.clear()
+
+    def stats(self):
+        return {"months": len(self._months), "hits": self.hits, "misses": self.misses}
+
+
+_CACHE = _MonthCache()
+
+
+def _days_in(month):
+    year, number = map(int, month.split("-"))
+    return calendar.monthrange(year, number)[1]
+
+
+def _contiguous_runs(months):
+    """Split sorted 'YYYY-MM' months into runs of consecutive months."""
+    runs = []
+    for month in months:
+        if runs and month_range(runs[-1][-1], month)[1:] == [month]:
+            runs[-1].append(month)
+        else:
+            runs.append([month])
+    return runs
+
+
+def _load_months(subject_id, months):
+    """{month: (student_ids, codes)} for consecutive `months`, read in one query over their span."""
+    rows = db.get_attendance_codes(subject_id, months[0], months[-1])
+    loaded = {m: (np.array([], dtype=object), np.zeros((0, _days_in(m)), dtype=np.int8)) for m in months}
+    if not rows:
+        return loaded
+    month_col, student_col, day_col, code_col = zip(*rows)
+    month_col = np.array(month_col)
+    student_col = np.array(student_col, dtype=object)
+    day_col = np.array(day_col, dtype=np.int16) - 1
+    code_col = np.array(code_col, dtype=np.int8)
+    for month in months:
+        sel = month_col == month
+        if not sel.any():
+            continue
+        student_ids, row = np.unique(student_col[sel], return_inverse=True)
+        codes = np.zeros((len(student_ids), _days_in(month)), dtype=np.int8)
+        codes[row, day_col[sel]] = code_col[sel]
+        loaded[month] = (student_ids, codes)
+    return loaded
+
+
+class AttendanceMatrix:
+    """Status codes of `students` (rows) on `dates` (columns, class days only) plus their totals."""
+
+    def __init__(self, subject_id, months, students, dates, codes):
+        self.subject_id = subject_id
+        self.months = months
+        self.students = students            # [{'user_id', 'name'}] in row order
+        self.dates = dates                  # ['YYYY-MM-DD'] in column order
+        self.codes = codes                  # int8 [len(students), len(dates)]
+        self.student_present = (codes == PRESENT).sum(axis=1)
+        self.student_absent = (codes == ABSENT).sum(axis=1)
+        self.student_other = (codes == OTHER).sum(axis=1)
+        self.day_present = (codes == PRESENT).sum(axis=0)
+        self.day_absent = (codes == ABSENT).sum(axis=0)
+        self.day_other = (codes == OTHER).sum(axis=0)
+
+    @property
+    def present_count(self) -> int:
+        return int(self.day_present.sum())
+
+    @property
+    def absent_count(self) -> int:
+        return int(self.day_absent.sum())
+
+    def rows(self):
+        """(student, cell symbols, present, absent, other) per student, for templates."""
+        symbols = SYMBOLS[self.codes]
+        for i, student in enumerate(self.students):
+            yield (student, symbols[i].tolist(), int(self.student_present[i]), int(self.student_absent[i]),
+                   int(self.student_other[i]))
+
+
+def build_matrix(subject_id, start_month, end_month=None) -> AttendanceMatrix:
+    """The matrix of subject_id over the 'YYYY-MM' months start_month..end_month (default: one month)."""
+    months = month_range(start_month, end_month or start_month)
+    revisions = db.get_month_revisions(subject_id, months[0], months[-1])
+
+    pieces, stale = {}, []
+    for month in months:
+        cached = _CACHE.get((subject_id, month), revisions.get(month))
+        if cached is None:
+            stale.append(month)
+        else:
+            pieces[month] = cached
+    for run in _contiguous_runs(stale):  # fresh months between stale ones are not re-read
+        for month, (student_ids, codes) in _load_months(subject_id, run).items():
+            _CACHE.put((subject_id, month), revisions.get(month), student_ids, codes)
+            pieces[month] = (student_ids, codes)
+
+    students = [{"user_id": row["user_id"], "name": row["name"]}
+                for row in db.get_report_students(subject_id, months[0], months[-1])]
+    index = {s["user_id"]: i for i, s in enumerate(students)}
+    widths = [_days_in(m) for m in months]
+    full = np.zeros((len(students), sum(widths)), dtype=np.int8)
+    offset = 0
+    for month, width in zip(months, widths):
+        student_ids, codes = pieces[month]
+        if len(student_ids):
+            rows = np.array([index.get(sid, -1) for sid in student_ids])
+            known = rows >= 0  # records of since-deleted users are left out
+            full[rows[known], offset:offset + width] = codes[known]
+        offset += width
+
+    class_days = full.any(axis=0)  # only days with at least one record become columns
+    dates = [f"{m}-{d:02d}" for m, w in zip(months, widths) for d in range(1, w + 1)]
+    dates = [day for day, keep in zip(dates, class_days) if keep]
+    return AttendanceMatrix(subject_id, months, students, dates, full[:, class_days])
+
+
+def cache_stats():
+    return _CACHE.stats()
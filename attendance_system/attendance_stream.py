@@ -0,0 +1,586 @@
+"""
+Live attendance stream: per-session recognition/liveness state and a threaded
+capture -> inference -> annotate/encode pipeline connected by bounded queues.
+
+Every queue is "latest wins": when a stage falls behind, the oldest waiting item
+is dropped instead of blocking the stage before it, so the camera buffer is
+always drained and the preview never lags behind reality.
+
+One CameraBroadcaster runs per camera and fans its JPEG frames out to any
+number of viewers, so recognition cost scales with cameras, not with viewers.
+Preview frames are encoded once per quality tier (size, JPEG quality, fps cap),
+not once per viewer, and a viewer that falls behind is moved to a lower tier.
+"""
+import os
+import queue
+import threading
+import time
+import weakref
+
+import cv2
+
+from ai_modules import face_recognition as fr
+from ai_modules.liveness_detection import LivenessStore, detect_blinks
+from ai_modules.tracking import FaceTracker
+
+RECOGNITION_TOLERANCE = 0.5
+RECOGNITION_GLOBAL_FALLBACK = False  # also identify (but never mark) students from other classes
+
+# Detect-then-track: full detection every N frames, optical-flow tracking in between
+TRACKING_MODE = True
+DETECT_EVERY_N_FRAMES = 5
+
+MIN_LOG_INTERVAL = 30  # seconds between duplicate logs
+
+# Students already present skip liveness; the roster is re-read this often (seconds)
+ROSTER_REFRESH = 60.0
+
+# Liveness state per face track, bounded for all-day cameras
+LIVENESS_MAX_TRACKS = 512
+LIVENESS_TTL = 30.0  # seconds a track's blink state survives without being seen
+
+SUBSCRIBER_QUEUE_DEPTH = 2    # frames buffered per viewer
+DEMOTE_AFTER_DROPS = 10       # consecutive frames a viewer may miss before dropping to a lower tier
+SLOW_CLIENT_MAX_DROPS = 100   # ... and, on the lowest tier, before it is disconnected
+
+# Live pipelines, for stats reporting
+_PIPELINES = weakref.WeakSet()
+
+# One broadcaster per camera source
+_BROADCASTERS = {}
+_BROADCASTERS_LOCK = threading.Lock()
+
+_PRESENT_LOADER = None  # callable(subject_id) -> user_ids already marked present today
+
+
+def set_present_loader(loader):
+    """Register loader(subject_id) -> student ids already marked Present today (used by SessionRoster)."""
+    global _PRESENT_LOADER
+    _PRESENT_LOADER = loader
+
+
+# -------------------------
+# Who is already present
+# -------------------------
+class SessionRoster:
+    """
+    Students of a session already marked present. Loaded from the registered
+    present loader when the session starts, updated on every mark, and re-read
+    every `refresh` seconds so manual changes by the teacher are picked up.
+    """
+
+    def __init__(self, subject_id, loader=None, refresh: float = ROSTER_REFRESH):
+        self.subject_id = subject_id
+        self.loader = loader
+        self.refresh_every = refresh
+        self.present = set()
+        self._marked = {}           # user_id -> monotonic time of marks made by this session
+        self._next_refresh = 0.0
+        self.skipped = 0            # faces that skipped liveness because the student was present
+
+    def refresh(self, force: bool = False):
+        now = time.monotonic()
+        if self.loader is None or (not force and now < self._next_refresh):
+            return
+        self._next_refresh = now + self.refresh_every
+        try:
+            loaded = set(self.loader(self.subject_id))
+        except Exception as e:
+            print("Attendance roster not refreshed:", e)
+            return
+        # keep our own recent marks in case their write has not reached the database yet
+        recent = {u for u, ts in self._marked.items() if now - ts <= self.refresh_every}
+        self._marked = {u: ts for u, ts in self._marked.items() if u in recent}
+        self.present = loaded | recent
+
+    def is_present(self, user_id) -> bool:
+        return user_id in self.present
+
+    def mark(self, user_id):
+        self.present.add(user_id)
+        self._marked[user_id] = time.monotonic()
+
+
+# -------------------------
+# Recognition + liveness for one session
+# -------------------------
+class AttendanceSession:
+    """
+    Recognition, blink liveness and attendance marking for one subject's stream.
+    process() does the work and returns what to draw; annotate() draws it.
+    """
+
+    def __init__(self, subject_id, mark_fn, tracking: bool = TRACKING_MODE):
+        self.subject_id = subject_id
+        self.mark_fn = mark_fn  # mark_fn(student_id, subject_id, status='Present'); False = not accepted, retry later
+        self.roster = SessionRoster(subject_id, _PRESENT_LOADER)
+        self.liveness = LivenessStore(LIVENESS_MAX_TRACKS, LIVENESS_TTL)
+        self.recognized_recent = {}  # user_id -> last mark time, pruned after MIN_LOG_INTERVAL
+        self._next_prune = 0.0
+        self.tracker = FaceTracker(subject_id, tolerance=RECOGNITION_TOLERANCE,
+                                   fallback_to_global=RECOGNITION_GLOBAL_FALLBACK,
+                                   detect_every=DETECT_EVERY_N_FRAMES) if tracking else None
+
+    def process(self, frame, now_ts=None):
+        """Returns the frame's matches, each with an added 'marked' flag."""
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
+        try:
+            if self.tracker is not None:
+                matches = self.tracker.process(frame, gray, now=now_ts)
+            else:
+                matches = fr.recognize_faces_in_frame(frame, tolerance=RECOGNITION_TOLERANCE,
+                                                      subject_id=self.subject_id,
+                                                      fallback_to_global=RECOGNITION_GLOBAL_FALLBACK)
+        except Exception as e:
+            matches = []
+            print("Face recognition error:", e)
+
+        now = time.time() if now_ts is None else now_ts
+        self._expire(now)
+        self.roster.refresh()
+
+        for m in matches:
+            m['marked'] = False
+            m['present'] = self.roster.is_present(m.get('user_id'))
+        # students already present are only drawn: no landmarks, no blink check
+        pending = [m for m in matches if m.get('enrolled', True) and not m['present']]
+        self.roster.skipped += sum(1 for m in matches if m['present'])
+
+        # Blink state per face track (per user when not tracking), then liveness for all faces in one batch
+        detectors = [self.liveness.get((m.get('track_id'), m.get('user_id')), now) for m in pending]
+        try:
+            blinks = detect_blinks(gray, detectors, [m['location'] for m in pending])
+        except Exception as e:
+            print("Blink detection error:", e)
+            blinks = [False] * len(pending)
+
+        for m, blinked in zip(pending, blinks):
+            user_id = m.get('user_id')
+            last_ts = self.recognized_recent.get(user_id, float('-inf'))  # video offsets start at 0
+
+            # --- TEMPORARY BYPASS: Ignore blink detection for testing ---
+            # if (now - last_ts) > MIN_LOG_INTERVAL:
+            if blinked and (now - last_ts) > MIN_LOG_INTERVAL:
+                print(f"Marking attendance for {user_id} in subject {self.subject_id}")
+                if self.mark_fn(user_id, self.subject_id, status='Present') is False:
+                    continue
+                self.recognized_recent[user_id] = now
+                self.roster.mark(user_id)
+                m['marked'] = True
+                m['present'] = True
+
+        return matches
+
+    def _expire(self, now):
+        self.liveness.expire(now)
+        if now >= self._next_prune:
+            self._next_prune = now + MIN_LOG_INTERVAL
+            self.recognized_recent = {u: ts for u, ts in self.recognized_recent.items()
+                                      if now - ts <= MIN_LOG_INTERVAL}
+
+    def stats(self) -> dict:
+        stats = {"liveness": self.liveness.stats(), "recent_marks": len(self.recognized_recent),
+                 "present": len(self.roster.present), "liveness_skipped": self.roster.skipped}
+        if self.tracker is not None:
+            stats["identity_cache"] = self.tracker.stats()
+        return stats
+
+
+def process_rss_bytes() -> int:
+    """Resident memory of this process (0 where /proc is unavailable)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return 0
+
+
+def annotate(frame, matches):
+    """Draw boxes and labels for the matches returned by AttendanceSession.process."""
+    for m in matches:
+        user_id = m.get('user_id')
+        top, right, bottom, left = m.get('location')
+
+        if not m.get('enrolled', True):
+            # known face, but not on this subject's roster: label only
+            cv2.rectangle(frame, (left, top), (right, bottom), (0, 165, 255), 2)
+            cv2.putText(frame, f"{user_id} (not enrolled)", (left, max(10, top - 10)),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 165, 255), 2)
+            continue
+
+        # Draw rectangle around detected face
+        cv2.rectangle(frame, (left, top), (right, bottom), (0, 255, 0), 2)
+        label = f"{user_id} {m.get('distance', 0):.2f}"
+        cv2.putText(frame, label, (left, max(10, top - 10)),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
+        if m.get('marked'):
+            cv2.putText(frame, f"Marked {user_id}", (left, bottom + 25),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
+        elif m.get('present'):
+            cv2.putText(frame, "Present", (left, bottom + 25),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
+    return frame
+
+
+# -------------------------
+# Threaded pipeline
+# -------------------------
+class LatestQueue:
+    """Bounded queue whose put() never blocks: when full, the oldest item is dropped."""
+
+    def __init__(self, maxsize: int = 1):
+        self._q = queue.Queue(maxsize=maxsize)
+        self.maxsize = maxsize
+        self.dropped = 0
+
+    def put(self, item) -> bool:
+        """Enqueue item; returns True if an older item had to be dropped to make room."""
+        dropped = False
+        while True:
+            try:
+                self._q.put_nowait(item)
+                return dropped
+            except queue.Full:
+                try:
+                    self._q.get_nowait()
+                    self.dropped += 1
+                    dropped = True
+                except queue.Empty:
+                    pass
+
+    def get(self, timeout=None):
+        """Next item, or None after `timeout` seconds."""
+        try:
+            return self._q.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def qsize(self) -> int:
+        return self._q.qsize()
+
+
+class StreamSettings:
+    """How one preview tier is encoded: longest side, JPEG quality, and a frame rate cap."""
+
+    def __init__(self, max_side: int = 0, quality: int = 95, max_fps: float = 0.0):
+        self.max_side = max_side    # cap on max(width, height), so portrait feeds are bounded too; 0 = keep
+        self.quality = quality
+        self.max_fps = max_fps      # 0 = every inferred frame
+
+    def resize(self, frame):
+        h, w = frame.shape[:2]
+        if not self.max_side or max(h, w) <= self.max_side:
+            return frame
+        scale = self.max_side / max(h, w)
+        return cv2.resize(frame, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv2.INTER_AREA)
+
+    def as_dict(self) -> dict:
+        return {"max_side": self.max_side, "quality": self.quality, "max_fps": self.max_fps}
+
+
+# Preview tiers, best first; viewers falling behind move down this list
+PREVIEW_TIERS = {
+    "high": StreamSettings(max_side=960, quality=80, max_fps=15),
+    "medium": StreamSettings(max_side=640, quality=70, max_fps=10),
+    "low": StreamSettings(max_side=320, quality=50, max_fps=5),
+}
+DEFAULT_PREVIEW_TIER = "medium"  # the session page shows the preview in a small panel
+
+
+class FramePipeline:
+    """
+    capture thread -> inference thread -> annotate/encode thread -> frames() generator.
+    process_fn(frame) returns matches; annotate_fn(frame, matches) draws them.
+    cv2 and dlib release the GIL, so the stages really do overlap.
+
+    The encode stage writes one output queue per tier in `tiers` (name -> StreamSettings).
+    Each frame is annotated once, and only if some tier is due under its fps cap;
+    tiers with the same size and quality share one encoding. Set `active_tiers`
+    to limit encoding to the tiers somebody is watching (None = all).
+    """
+
+    def __init__(self, source, process_fn, annotate_fn=annotate, tiers=None, capture_depth: int = 1,
+                 inference_depth: int = 1, output_depth: int = 2, poll: float = 0.5):
+        self.source = source
+        self.process_fn = process_fn
+        self.annotate_fn = annotate_fn
+        self.poll = poll
+        self.tiers = dict(tiers or {"full": StreamSettings()})
+        self.active_tiers = None
+        self.captured = LatestQueue(capture_depth)   # (capture time, frame)
+        self.inferred = LatestQueue(inference_depth)  # (capture time, frame, matches)
+        self.outputs = {name: LatestQueue(output_depth) for name in self.tiers}  # JPEG bytes per tier
+        self.encoded = next(iter(self.outputs.values()))
+        self.counts = {"captured": 0, "processed": 0, "encoded": 0, "skipped": 0}
+        self.tier_counts = {name: 0 for name in self.tiers}
+        self._next_due = {name: 0.0 for name in self.tiers}
+        self.latency_ms = 0.0  # capture -> encoded, exponential moving average
+        self.started_at = None
+        self._stop = threading.Event()
+        self._threads = []
+        _PIPELINES.add(self)
+
+    # -- lifecycle --
+    def start(self):
+        self.started_at = time.time()
+        for target in (self._capture_loop, self._inference_loop, self._encode_loop):
+            t = threading.Thread(target=target, name=f"{target.__name__}-{self.source}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    @property
+    def running(self) -> bool:
+        return not self._stop.is_set()
+
+    # -- stages --
+    def _capture_loop(self):
+        cap = cv2.VideoCapture(self.source)
+        if not cap.isOpened():
+            print(f"ERROR: Unable to open camera ({self.source}).")
+        try:
+            while not self._stop.is_set():
+                success, frame = cap.read()
+                if not success:
+                    break
+                self.counts["captured"] += 1
+                self.captured.put((time.perf_counter(), frame))
+        finally:
+            cap.release()
+            self._stop.set()
+
+    def _inference_loop(self):
+        while not self._stop.is_set():
+            item = self.captured.get(timeout=self.poll)
+            if item is None:
+                continue
+            captured_at, frame = item
+            try:
+                matches = self.process_fn(frame)
+            except Exception as e:
+                print("Inference error:", e)
+                matches = []
+            self.counts["processed"] += 1
+            self.inferred.put((captured_at, frame, matches))
+
+    def _encode_loop(self):
+        while not self._stop.is_set():
+            item = self.inferred.get(timeout=self.poll)
+            if item is None:
+                continue
+            captured_at, frame, matches = item
+
+            now = time.perf_counter()
+            active = self.active_tiers
+            due = [name for name in self.tiers
+                   if (active is None or name in active) and now >= self._next_due[name]]
+            if not due:
+                self.counts["skipped"] += 1
+                continue
+
+            annotated = self.annotate_fn(frame, matches)
+            resized, encoded = {}, {}
+            for name in due:
+                settings = self.tiers[name]
+                self._next_due[name] = now + (1.0 / settings.max_fps if settings.max_fps else 0.0)
+                key = (settings.max_side, settings.quality)
+                if key not in encoded:
+                    if settings.max_side not in resized:
+                        resized[settings.max_side] = settings.resize(annotated)
+                    ret, buffer = cv2.imencode('.jpg', resized[settings.max_side],
+                                               [cv2.IMWRITE_JPEG_QUALITY, settings.quality])
+                    encoded[key] = buffer.tobytes() if ret else None
+                if encoded[key] is None:
+                    continue
+                self.tier_counts[name] += 1
+                self.outputs[name].put(encoded[key])
+            self.counts["encoded"] += 1
+            latency = (time.perf_counter() - captured_at) * 1000
+            self.latency_ms = latency if self.counts["encoded"] == 1 else 0.9 * self.latency_ms + 0.1 * latency
+
+    # -- output --
+    def frames(self):
+        """multipart/x-mixed-replace chunks; stops the pipeline when the client goes away."""
+        try:
+            while self.running or self.encoded.qsize():
+                frame_bytes = self.encoded.get(timeout=self.poll)
+                if frame_bytes is None:
+                    continue
+                yield (b'--frame\r\n'
+                       b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
+        finally:
+            self.stop()
+
+    def stats(self) -> dict:
+        elapsed = max(1e-6, time.time() - (self.started_at or time.time()))
+        return {
+            "source": self.source,
+            "running": self.running,
+            "fps": {name: round(n / elapsed, 1) for name, n in self.counts.items()},
+            "latency_ms": round(self.latency_ms, 1),
+            "queue_depth": {"captured": self.captured.qsize(), "inferred": self.inferred.qsize(),
+                            "encoded": self.encoded.qsize()},
+            "dropped": {"captured": self.captured.dropped, "inferred": self.inferred.dropped,
+                        "encoded": self.encoded.dropped},
+            "tiers": {name: dict(settings.as_dict(), fps=round(self.tier_counts[name] / elapsed, 1))
+                      for name, settings in self.tiers.items()},
+        }
+
+
+def pipeline_stats():
+    return [p.stats() for p in list(_PIPELINES)]
+
+
+# -------------------------
+# Shared camera broadcaster
+# -------------------------
+class CameraBusy(Exception):
+    """The camera is already running a session for another subject."""
+
+
+class Subscriber:
+    """One viewer of a CameraBroadcaster, with its own small frame queue."""
+
+    def __init__(self, broadcaster, tier: str):
+        self.broadcaster = broadcaster
+        self.tier = tier
+        self.queue = LatestQueue(SUBSCRIBER_QUEUE_DEPTH)
+        self.missed = 0       # consecutive frames dropped because this viewer was too slow
+        self.closed = False
+
+    def frames(self):
+        """multipart/x-mixed-replace chunks for this viewer; unsubscribes when done."""
+        try:
+            while not self.closed or self.queue.qsize():
+                frame_bytes = self.queue.get(timeout=0.5)
+                if frame_bytes is None:
+                    continue
+                self.missed = 0
+                yield (b'--frame\r\n'
+                       b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
+        finally:
+            self.broadcaster.unsubscribe(self)
+
+
+class CameraBroadcaster:
+    """
+    One capture + inference pipeline per camera. Started by the first subscriber,
+    stopped when the last one leaves. Only the tiers somebody watches are encoded.
+    Fan-out never blocks: a viewer that keeps missing frames is moved to the next
+    lower tier, and disconnected if it still cannot keep up on the lowest one.
+    """
+
+    def __init__(self, source, subject_id, mark_fn, tiers=None):
+        self.source = source
+        self.subject_id = subject_id
+        self.tier_names = list(tiers or PREVIEW_TIERS)
+        self.session = AttendanceSession(subject_id, mark_fn)
+        self.pipeline = FramePipeline(source, self.session.process, tiers=tiers or PREVIEW_TIERS)
+        self.pipeline.active_tiers = set()
+        self.subscribers = set()
+        self.demoted = 0
+        self.disconnected = 0
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def start(self):
+        self.pipeline.start()
+        for tier in self.tier_names:
+            t = threading.Thread(target=self._fanout_loop, args=(tier,), name=f"fanout-{tier}-{self.source}",
+                                 daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def _fanout_loop(self, tier):
+        output = self.pipeline.outputs[tier]
+        while self.pipeline.running or output.qsize():
+            frame_bytes = output.get(timeout=0.5)
+            if frame_bytes is None:
+                continue
+            with self._lock:
+                subscribers = [sub for sub in self.subscribers if sub.tier == tier]
+            for sub in subscribers:
+                if sub.queue.put(frame_bytes):
+                    sub.missed += 1
+                    if sub.missed > DEMOTE_AFTER_DROPS:
+                        self._demote(sub)
+        # camera gone: end every viewer's stream
+        with self._lock:
+            for sub in self.subscribers:
+                sub.closed = True
+
+    def _demote(self, sub: Subscriber):
+        pos = self.tier_names.index(sub.tier)
+        if pos + 1 < len(self.tier_names):
+            with self._lock:
+                sub.tier = self.tier_names[pos + 1]
+                sub.missed = 0
+                self.demoted += 1
+                self.pipeline.active_tiers = {s.tier for s in self.subscribers}
+            print(f"Viewer of camera {self.source} falling behind, lowering preview to {sub.tier}")
+        elif sub.missed > SLOW_CLIENT_MAX_DROPS:
+            print(f"Disconnecting slow viewer of camera {self.source}")
+            self.disconnected += 1
+            sub.closed = True
+
+    def subscribe(self, tier: str = DEFAULT_PREVIEW_TIER) -> Subscriber:
+        if tier not in self.tier_names:
+            raise ValueError(f"unknown preview tier {tier!r}")
+        sub = Subscriber(self, tier)
+        with self._lock:
+            self.subscribers.add(sub)
+            self.pipeline.active_tiers = {s.tier for s in self.subscribers}
+        return sub
+
+    def unsubscribe(self, sub: Subscriber):
+        sub.closed = True
+        with _BROADCASTERS_LOCK:
+            with self._lock:
+                self.subscribers.discard(sub)
+                self.pipeline.active_tiers = {s.tier for s in self.subscribers}
+                last = not self.subscribers
+            if last and _BROADCASTERS.get(self.source) is self:
+                del _BROADCASTERS[self.source]
+        if last:
+            self.pipeline.stop()
+
+    def stats(self) -> dict:
+        stats = self.pipeline.stats()
+        with self._lock:
+            viewers = {tier: sum(1 for s in self.subscribers if s.tier == tier) for tier in self.tier_names}
+        for tier, count in viewers.items():
+            stats["tiers"][tier]["viewers"] = count
+        stats.update({"subject_id": self.subject_id, "viewers": sum(viewers.values()),
+                      "viewers_demoted": self.demoted, "slow_viewers_disconnected": self.disconnected})
+        stats.update(self.session.stats())
+        stats["process_rss_mb"] = round(process_rss_bytes() / 2 ** 20, 1)
+        return stats
+
+
+def subscribe(source, subject_id, mark_fn, tier: str = DEFAULT_PREVIEW_TIER) -> Subscriber:
+    """
+    Join the broadcaster of `source` at preview tier `tier`, starting it if nobody is watching yet.
+    Raises CameraBusy if the camera is running a session for another subject.
+    """
+    if tier not in PREVIEW_TIERS:
+        raise ValueError(f"unknown preview tier {tier!r}")
+    with _BROADCASTERS_LOCK:
+        broadcaster = _BROADCASTERS.get(source)
+        if broadcaster is not None and not broadcaster.pipeline.running:
+            broadcaster = None  # camera loop ended; start a fresh one
+        if broadcaster is None:
+            broadcaster = CameraBroadcaster(source, subject_id, mark_fn)
+            _BROADCASTERS[source] = broadcaster
+            broadcaster.start()
+        elif broadcaster.subject_id != subject_id:
+            raise CameraBusy(f"camera {source} is in use for subject {broadcaster.subject_id}")
+        return broadcaster.subscribe(tier)
+
+
+def broadcaster_stats():
+    with _BROADCASTERS_LOCK:
+        return [b.stats() for b in _BROADCASTERS.values()]
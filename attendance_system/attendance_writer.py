@@ -0,0 +1,162 @@
+"""
+Write-behind attendance writer.
+
+The camera loop hands marks to submit(), which only touches an in-memory dict
+and returns immediately. A background thread flushes the pending marks every
+`flush_interval` seconds in one transaction (database_manager.bulk_log_attendance),
+so a class walking in at once costs one commit instead of one per student.
+
+- Duplicate marks for the same student, subject and day are coalesced; the latest wins.
+- Backpressure: once `max_pending` marks are waiting, submit() refuses new ones
+  and returns False instead of blocking; the caller can retry on a later frame.
+- A failed flush puts its batch back (newer marks for the same key win) and is
+  retried; nothing is committed partially.
+- close() / interpreter exit drains everything still pending.
+"""
+import atexit
+import threading
+import time
+from datetime import datetime
+
+import database_manager as db
+
+FLUSH_INTERVAL = 0.5    # seconds between flushes
+MAX_BATCH = 500         # marks per transaction
+MAX_PENDING = 10000     # submit() refuses marks beyond this
+RETRY_BACKOFF = (0.5, 10.0)  # first and maximum delay after a failed flush
+
+
+class AttendanceWriter:
+    """Coalescing queue of attendance marks plus the thread that commits them in batches."""
+
+    def __init__(self, write_fn=None, flush_interval: float = FLUSH_INTERVAL, max_batch: int = MAX_BATCH,
+                 max_pending: int = MAX_PENDING):
+        self.write_fn = write_fn or db.bulk_log_attendance  # write_fn(records) -> count, one transaction
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+        self._pending = {}          # (student_id, subject_id, date) -> (timestamp, status)
+        self._cond = threading.Condition()
+        self._thread = None
+        self._closed = False
+        self._flush_now = False
+        self._inflight = 0          # marks taken by the writer thread but not yet committed
+        self.stats = {"submitted": 0, "coalesced": 0, "rejected": 0, "written": 0, "batches": 0, "failures": 0}
+
+    # -- producer side --
+    def submit(self, student_id, subject_id, status: str = 'Present', timestamp=None) -> bool:
+        """Queue one mark; never blocks. Returns False if the writer is full or closed."""
+        if timestamp is None:
+            timestamp = datetime.now()
+        ts = timestamp if isinstance(timestamp, str) else timestamp.strftime('%Y-%m-%d %H:%M:%S')
+        key = (student_id, subject_id, ts[:10])
+        with self._cond:
+            if self._closed:
+                return False
+            if key in self._pending:
+                self.stats["coalesced"] += 1
+            elif len(self._pending) >= self.max_pending:
+                self.stats["rejected"] += 1
+                return False
+            self._pending[key] = (ts, status)
+            self.stats["submitted"] += 1
+            if self._thread is None:
+                self._start()
+            elif len(self._pending) >= self.max_batch:
+                self._cond.notify()
+        return True
+
+    def pending(self) -> int:
+        return len(self._pending)
+
+    # -- writer thread --
+    def _start(self):
+        self._thread = threading.Thread(target=self._run, name="attendance-writer", daemon=True)
+        self._thread.start()
+
+    def _take_batch(self):
+        keys = list(self._pending)[:self.max_batch]
+        return [(key, self._pending.pop(key)) for key in keys]
+
+    def _requeue(self, batch):
+        for key, value in batch:
+            self._pending.setdefault(key, value)  # a newer mark for the same key wins
+
+    def _write(self, batch) -> bool:
+        records = [(student_id, subject_id, ts, status) for (student_id, subject_id, _), (ts, status) in batch]
+        try:
+            self.write_fn(records)
+        except Exception as e:
+            print(f"Attendance flush of {len(records)} mark(s) failed, will retry:", e)
+            with self._cond:
+                self._requeue(batch)
+                self.stats["failures"] += 1
+            return False
+        with self._cond:
+            self.stats["written"] += len(records)
+            self.stats["batches"] += 1
+        return True
+
+    def _run(self):
+        backoff = RETRY_BACKOFF[0]
+        while True:
+            with self._cond:
+                if not (self._flush_now or self._closed or len(self._pending) >= self.max_batch):
+                    self._cond.wait(self.flush_interval)  # gather marks into one batch
+                self._flush_now = False
+                if self._closed and not self._pending:
+                    return
+                batch = self._take_batch()
+                self._inflight = len(batch)
+            if not batch:
+                continue
+            ok = self._write(batch)
+            self._inflight = 0
+            if ok:
+                backoff = RETRY_BACKOFF[0]
+            else:
+                if self._closed:
+                    return  # give up on shutdown; close() reports what was lost
+                time.sleep(backoff)
+                backoff = min(backoff * 2, RETRY_BACKOFF[1])
+
+    # -- control --
+    def flush(self, timeout: float = 10.0) -> bool:
+        """Write everything pending now; returns True once the queue is empty."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self._flush_now = True
+            self._cond.notify()
+        while (self._pending or self._inflight) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return not (self._pending or self._inflight)
+
+    def close(self, timeout: float = 10.0):
+        """Stop accepting marks and drain the queue (called automatically at exit)."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        elif self._pending:
+            self._write(self._take_batch())
+        if self._pending:
+            print(f"Attendance writer closed with {len(self._pending)} unwritten mark(s)")
+
+
+_WRITER = None
+_WRITER_LOCK = threading.Lock()
+
+
+def get_writer() -> AttendanceWriter:
+    """The process-wide writer, drained at interpreter exit."""
+    global _WRITER
+    with _WRITER_LOCK:
+        if _WRITER is None:
+            _WRITER = AttendanceWriter()
+            atexit.register(_WRITER.close)
+        return _WRITER
+
+
+def submit(student_id, subject_id, status: str = 'Present', timestamp=None) -> bool:
+    return get_writer().submit(student_id, subject_id, status, timestamp)
@@ -0,0 +1,188 @@
+"""
+Queries per second of database_manager, per-call connections vs. the pooled, tuned connection.
+
+    python bench_db.py                     # 3 s per workload, seeded scratch database
+    python bench_db.py --seconds 10 --readers 8
+
+Modes:
+    legacy  a new sqlite3 connection per call, rollback journal (the old get_db_connection)
+    pooled  tuned connections (WAL + pragmas) kept per thread and handed between threads by a pool (current)
+
+Workloads:
+    reads   the queries of a teacher's session page, round-robin, one thread
+    requests  the same queries, each page in a new thread inside begin()/finish(),
+            like Flask's threaded development server (one thread per request)
+    writes  log_attendance, each call its own commit, one thread
+    mixed   --readers threads reading while one thread writes
+Every run uses a freshly seeded scratch copy; the real attendance.db is never touched.
+"""
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+import database_manager as db
+import init_db
+
+
+def _legacy_connection():
+    conn = sqlite3.connect(db.DATABASE)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def seed(path, students=500, subjects=20, days=60):
+    init_db.DATABASE = path
+    init_db.init_db()
+    conn = sqlite3.connect(path)
+    conn.executemany("INSERT INTO users (user_id, name, role, password) VALUES (?, ?, ?, ?)",
+                     [(f"S{i:05d}", f"Student {i}", "student", "x") for i in range(students)] +
+                     [(f"T{i:03d}", f"Teacher {i}", "teacher", "x") for i in range(subjects)])
+    conn.executemany("INSERT INTO subjects (subject_name, teacher_id) VALUES (?, ?)",
+                     [(f"Subject {i}", f"T{i:03d}") for i in range(subjects)])
+    rng = random.Random(0)
+    enrollments = {(f"S{rng.randrange(students):05d}", 1 + rng.randrange(subjects)) for _ in range(students * 4)}
+    conn.executemany("INSERT INTO enrollments (student_id, subject_id) VALUES (?, ?)", sorted(enrollments))
+    start = datetime.now() - timedelta(days=days)
+    records = []
+    for d in range(days + 1):
+        day = start + timedelta(days=d)
+        for student_id, subject_id in enrollments:
+            if rng.random() < 0.8:
+                records.append((student_id, subject_id, day.strftime('%Y-%m-%d 09:00:00'),
+                                day.strftime('%Y-%m-%d'), 'Present'))
+    conn.executemany("INSERT INTO attendance_records (student_id, subject_id, timestamp, date, status) "
+                     "VALUES (?, ?, ?, ?, ?)", records)
+    conn.commit()
+    conn.close()
+    return sorted(enrollments)
+
+
+def _run_for(seconds, fn):
+    n, deadline = 0, time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        fn(n)
+        n += 1
+    return n / seconds
+
+
+def workload_reads(enrollments, seconds):
+    subjects = sorted({s for _, s in enrollments})
+
+    def step(i):
+        subject_id = subjects[i % len(subjects)]
+        db.get_subject_by_id(subject_id)
+        db.get_enrolled_students(subject_id)
+        db.get_attendance_for_subject_today(subject_id)
+        db.get_subjects_for_teacher(f"T{(subject_id - 1):03d}")
+    return {"reads qps": 4 * _run_for(seconds, step)}
+
+
+def workload_requests(enrollments, seconds, per_request_transaction=True):
+    subjects = sorted({s for _, s in enrollments})
+
+    def request(subject_id):
+        if per_request_transaction:
+            db.begin()  # what app.py's before_request does
+        try:
+            db.get_subject_by_id(subject_id)
+            db.get_enrolled_students(subject_id)
+            db.get_attendance_for_subject_today(subject_id)
+            db.get_subjects_for_teacher(f"T{(subject_id - 1):03d}")
+        finally:
+            if per_request_transaction:
+                db.finish()
+
+    def step(i):
+        t = threading.Thread(target=request, args=(subjects[i % len(subjects)],))
+        t.start()
+        t.join()
+    return {"requests/s": _run_for(seconds, step)}
+
+
+def workload_writes(enrollments, seconds):
+    def step(i):
+        student_id, subject_id = enrollments[i % len(enrollments)]
+        db.log_attendance(student_id, subject_id)
+    return {"writes qps": _run_for(seconds, step)}
+
+
+def workload_mixed(enrollments, seconds, readers):
+    counts = [0] * (readers + 1)
+    errors = []
+    stop = threading.Event()
+
+    def reader(k):
+        subjects = sorted({s for _, s in enrollments})
+        i = 0
+        while not stop.is_set():
+            try:
+                db.get_attendance_for_subject_today(subjects[i % len(subjects)])
+                counts[k] += 1
+            except sqlite3.OperationalError as e:
+                errors.append(str(e))
+            i += 1
+
+    def writer():
+        i = 0
+        while not stop.is_set():
+            student_id, subject_id = enrollments[i % len(enrollments)]
+            try:
+                db.log_attendance(student_id, subject_id)
+                counts[readers] += 1
+            except sqlite3.OperationalError as e:
+                errors.append(str(e))
+            i += 1
+
+    threads = [threading.Thread(target=reader, args=(k,)) for k in range(readers)] + [threading.Thread(target=writer)]
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    return {"mixed read qps": sum(counts[:readers]) / seconds, "mixed write qps": counts[readers] / seconds,
+            "mixed errors": len(errors)}
+
+
+def run_mode(mode, seconds, readers):
+    original = db.get_db_connection
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        enrollments = seed(path)
+        db.DATABASE = path
+        if mode == "legacy":
+            db.get_db_connection = _legacy_connection
+        try:
+            results = {}
+            results.update(workload_reads(enrollments, seconds))
+            results.update(workload_requests(enrollments, seconds, per_request_transaction=mode != "legacy"))
+            results.update(workload_writes(enrollments, seconds))
+            results.update(workload_mixed(enrollments, seconds, readers))
+        finally:
+            db.get_db_connection = original
+            db.close_thread_connection()
+            db.close_pool()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="database_manager queries per second")
+    parser.add_argument("--seconds", type=float, default=3.0, help="duration of each workload")
+    parser.add_argument("--readers", type=int, default=4, help="reader threads in the mixed workload")
+    args = parser.parse_args(argv)
+
+    results = {mode: run_mode(mode, args.seconds, args.readers) for mode in ("legacy", "pooled")}
+    print(f"{'':<16} {'legacy':>10} {'pooled':>10} {'speedup':>8}")
+    for key in results["legacy"]:
+        before, after = results["legacy"][key], results["pooled"][key]
+        ratio = f"{after / before:.1f}x" if before and key != "mixed errors" else ""
+        print(f"{key:<16} {before:>10.0f} {after:>10.0f} {ratio:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Startup time and memory of a Flask worker, measured in fresh interpreters.
+
+    python bench_startup.py            # 5 runs per mode
+    python bench_startup.py --runs 10
+
+Modes:
+    eager        import app + load the CV/ML stack (what every worker paid before lazy imports)
+    lazy         import app; the CV/ML stack loads on the first recognition request
+    report-only  import app with ATTENDANCE_REPORT_ONLY=1; the CV/ML stack is never loaded
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+_CHILD = r"""
+import json, os, resource, sys, time
+t0 = time.perf_counter()
+import app
+if {eager}:
+    app.ai_modules()
+elapsed = time.perf_counter() - t0
+with open("/proc/self/statm") as f:
+    rss = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+print(json.dumps({{"seconds": elapsed, "rss_mb": rss / 2 ** 20,
+                  "peak_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                  "cv_loaded": "cv2" in sys.modules}}))
+"""
+
+MODES = {
+    "eager": ({}, True),
+    "lazy": ({}, False),
+    "report-only": ({"ATTENDANCE_REPORT_ONLY": "1"}, False),
+}
+
+
+def measure(mode, runs):
+    extra_env, eager = MODES[mode]
+    env = dict(os.environ, **extra_env)
+    samples = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", _CHILD.format(eager=eager)], cwd=HERE, env=env,
+                             capture_output=True, text=True, check=True).stdout
+        samples.append(json.loads(out.strip().splitlines()[-1]))
+    return {
+        "seconds": statistics.median(s["seconds"] for s in samples),
+        "rss_mb": statistics.median(s["rss_mb"] for s in samples),
+        "peak_mb": statistics.median(s["peak_mb"] for s in samples),
+        "cv_loaded": samples[-1]["cv_loaded"],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Flask worker startup time and memory")
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters per mode (median is reported)")
+    parser.add_argument("--modes", nargs="+", choices=list(MODES), default=list(MODES))
+    args = parser.parse_args(argv)
+
+    print(f"{'mode':<12} {'startup s':>10} {'rss MB':>8} {'peak MB':>8}  cv2 loaded")
+    for mode in args.modes:
+        r = measure(mode, args.runs)
+        print(f"{mode:<12} {r['seconds']:>10.2f} {r['rss_mb']:>8.1f} {r['peak_mb']:>8.1f}  {r['cv_loaded']}")
+
+
+if __name__ == "__main__":
+    main()
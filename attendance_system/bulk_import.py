@@ -0,0 +1,312 @@
+"""
+Bulk onboarding: users + enrollments from a CSV, face photos from a ZIP.
+
+    python bulk_import.py --csv students.csv --photos photos.zip
+    python bulk_import.py --csv staff.csv --chunk-size 1000 --report errors.csv
+    python bulk_import.py --photos photos.zip -w 16      # photos only, encode on 16 cores
+
+CSV columns (header required): user_id, name, role, password[, subjects]
+    role      student / teacher / admin
+    password  may be empty for users that already exist (their password is kept)
+    subjects  optional, ';'-separated subject ids or exact subject names to enroll the user in
+
+ZIP layout: <user_id>/<photo>.jpg|jpeg|png, optionally inside one top-level folder.
+
+CSV rows are read as a stream and written `chunk_size` rows per transaction;
+photos are streamed straight from the archive into face_dataset/<user_id>/.
+The gallery is updated once at the end (incremental build_encodings), not
+once per student; the web import runs that update on a background thread
+(GalleryBuild) so the request does not wait for it. Bad rows and archive entries are skipped and reported
+with their line / entry name; the rest is imported.
+"""
+import argparse
+import csv
+import io
+import os
+import posixpath
+import shutil
+import threading
+import time
+import zipfile
+
+from werkzeug.utils import secure_filename
+
+import database_manager as db
+
+DATASET_DIR = os.path.join(os.path.dirname(__file__), "face_dataset")
+REQUIRED_COLUMNS = ("user_id", "name", "role", "password")
+ROLES = ("student", "teacher", "admin")
+PHOTO_EXTENSIONS = {"png", "jpg", "jpeg"}
+CHUNK_SIZE = 500                    # CSV rows per transaction
+MAX_PHOTO_BYTES = 20 * 1024 * 1024  # larger archive entries are rejected (and never extracted)
+
+
+class ImportReport:
+    """Counts plus one (source, location, user_id, message) entry per rejected row or photo."""
+
+    def __init__(self):
+        self.rows = 0
+        self.users_added = 0
+        self.users_updated = 0
+        self.enrollments_added = 0
+        self.photos = 0
+        self.encoded = None     # (num_users, num_images) of the final gallery update
+        self.errors = []
+
+    def error(self, source, location, user_id, message):
+        self.errors.append({"source": source, "location": location, "user_id": user_id, "message": message})
+
+    def summary(self) -> str:
+        text = (f"{self.rows} row(s): {self.users_added} user(s) added, {self.users_updated} updated, "
+                f"{self.enrollments_added} enrollment(s) added; {self.photos} photo(s) extracted; "
+                f"{len(self.errors)} error(s)")
+        if self.encoded is not None:
+            text += f"; gallery: {self.encoded[0]} users, {self.encoded[1]} images encoded"
+        return text
+
+    def write_csv(self, path):
+        with open(path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=["source", "location", "user_id", "message"])
+            writer.writeheader()
+            writer.writerows(self.errors)
+
+
+# -------------------------
+# CSV: users + enrollments
+# -------------------------
+def _subject_lookup():
+    """Subject id (as text) or name -> subject id."""
+    lookup = {}
+    for subject in db.get_all_subjects():
+        lookup[subject['subject_name'].strip()] = subject['id']
+        lookup[str(subject['id'])] = subject['id']
+    return lookup
+
+
+def _flush_chunk(chunk, report):
+    """Validate a chunk against the database and write it in one transaction."""
+    existing = db.get_existing_user_ids({row[1] for row in chunk})
+    users, enrollments = {}, []
+    for line, user_id, name, role, password, subject_ids in chunk:
+        if not password and user_id not in existing and user_id not in users:
+            report.error("csv", line, user_id, "password is required for a new user")
+            continue
+        if user_id not in users:
+            if user_id in existing:
+                report.users_updated += 1
+            else:
+                report.users_added += 1
+        if not password and user_id in users:
+            password = users[user_id][3]  # an empty password keeps the one an earlier row set
+        users[user_id] = (user_id, name, role, password)  # a later row for the same user wins
+        enrollments.extend((user_id, subject_id) for subject_id in subject_ids)
+    with db.transaction():
+        report.enrollments_added += db.import_users(list(users.values()), enrollments)
+
+
+def import_csv(stream, report=None, chunk_size=CHUNK_SIZE) -> ImportReport:
+    """Import users and enrollments from a text stream of CSV rows."""
+    report = report or ImportReport()
+    reader = csv.DictReader(stream)
+    columns = [c.strip().lower() for c in (reader.fieldnames or [])]
+    missing = [c for c in REQUIRED_COLUMNS if c not in columns]
+    if missing:
+        report.error("csv", 1, "", f"missing column(s): {', '.join(missing)}")
+        return report
+    reader.fieldnames = columns
+    subjects = _subject_lookup()
+
+    chunk = []
+    for record in reader:
+        report.rows += 1
+        line = reader.line_num
+        user_id = (record.get("user_id") or "").strip()
+        name = (record.get("name") or "").strip()
+        role = (record.get("role") or "").strip().lower()
+        password = (record.get("password") or "").strip()
+        if not user_id or not name:
+            report.error("csv", line, user_id, "user_id and name are required")
+            continue
+        if role not in ROLES:
+            report.error("csv", line, user_id, f"unknown role '{role}'")
+            continue
+        names = [s.strip() for s in (record.get("subjects") or "").split(";") if s.strip()]
+        unknown = [s for s in names if s not in subjects]
+        if unknown:
+            report.error("csv", line, user_id, f"unknown subject(s): {', '.join(unknown)}")
+            continue
+        chunk.append((line, user_id, name, role, password, [subjects[s] for s in names]))
+        if len(chunk) >= chunk_size:
+            _flush_chunk(chunk, report)
+            chunk = []
+    if chunk:
+        _flush_chunk(chunk, report)
+    return report
+
+
+# -------------------------
+# ZIP: face photos
+# -------------------------
+def _photo_target(entry_name):
+    """(user_id, filename) of an archive entry, or an error message."""
+    if entry_name.startswith("/") or "\\" in entry_name:
+        return None, "absolute or Windows-style path"
+    parts = [p for p in posixpath.normpath(entry_name).split("/") if p not in ("", ".")]
+    if ".." in parts:
+        return None, "path escapes the archive"
+    if len(parts) < 2 or len(parts) > 3:
+        return None, "expected <user_id>/<photo>"
+    user_id, filename = parts[-2], secure_filename(parts[-1])
+    if "." not in filename or filename.rsplit(".", 1)[1].lower() not in PHOTO_EXTENSIONS:
+        return None, f"not a photo (allowed: {', '.join(sorted(PHOTO_EXTENSIONS))})"
+    return (user_id, filename), None
+
+
+def import_photos(archive, report=None, dataset_dir=DATASET_DIR) -> ImportReport:
+    """Extract <user_id>/<photo> entries of a ZIP (path or binary file object) into dataset_dir."""
+    report = report or ImportReport()
+    try:
+        zf = zipfile.ZipFile(archive)
+    except zipfile.BadZipFile as e:
+        report.error("zip", "", "", f"not a ZIP archive: {e}")
+        return report
+    with zf:
+        entries = [info for info in zf.infolist() if not info.is_dir()
+                   and not posixpath.basename(info.filename).startswith(".")
+                   and not info.filename.startswith("__MACOSX/")]
+        targets = {}
+        for info in entries:
+            target, problem = _photo_target(info.filename)
+            if problem is None and info.file_size > MAX_PHOTO_BYTES:
+                problem = f"larger than {MAX_PHOTO_BYTES // 2 ** 20} MB"
+            if problem:
+                report.error("zip", info.filename, "", problem)
+            else:
+                targets[info.filename] = target
+        known = db.get_existing_user_ids({user_id for user_id, _ in targets.values()})
+
+        for info in entries:
+            if info.filename not in targets:
+                continue
+            user_id, filename = targets[info.filename]
+            if user_id not in known:
+                report.error("zip", info.filename, user_id, "no such user")
+                continue
+            user_dir = os.path.join(dataset_dir, user_id)
+            os.makedirs(user_dir, exist_ok=True)
+            path = os.path.join(user_dir, filename)
+            partial = path + ".part"  # build_encodings only sees complete photos
+            try:
+                with zf.open(info) as src, open(partial, "wb") as dst:
+                    shutil.copyfileobj(src, dst, 1024 * 1024)
+                os.replace(partial, path)
+            except (zipfile.BadZipFile, OSError) as e:
+                if os.path.exists(partial):
+                    os.remove(partial)
+                report.error("zip", info.filename, user_id, f"extraction failed: {e}")
+                continue
+            report.photos += 1
+    return report
+
+
+# -------------------------
+# Whole import
+# -------------------------
+def run(csv_stream=None, archive=None, chunk_size=CHUNK_SIZE, build=True, workers=1,
+        dataset_dir=DATASET_DIR) -> ImportReport:
+    """CSV first (so photo owners exist), then photos, then one gallery update if any photo was added."""
+    report = ImportReport()
+    if csv_stream is not None:
+        import_csv(csv_stream, report, chunk_size=chunk_size)
+    if archive is not None:
+        import_photos(archive, report, dataset_dir=dataset_dir)
+    if build and report.photos:
+        from ai_modules import face_recognition as fr  # loads the CV stack; only needed for photos
+        report.encoded = fr.build_encodings(workers=workers)
+    return report
+
+
+class GalleryBuild:
+    """
+    The gallery update after a web import, run on a background thread so the request
+    returns once the photos are saved. One build runs at a time; asking for another
+    while it runs queues a single re-run, which picks up every photo saved meanwhile.
+    """
+
+    def __init__(self, build):
+        self.build = build          # callable() -> (num_users, num_images_encoded)
+        self.state = "idle"         # idle / running / done / failed
+        self.result = None
+        self.error = None
+        self.started = self.finished = None
+        self._rerun = False
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start a build, or queue one re-run if a build is already running."""
+        with self._lock:
+            if self.state == "running":
+                self._rerun = True
+                return
+            self.state, self.error, self.started, self.finished = "running", None, time.time(), None
+        threading.Thread(target=self._run, name="gallery-build", daemon=True).start()
+
+    def _run(self):
+        while True:
+            try:
+                result, error = self.build(), None
+            except Exception as e:
+                result, error = None, str(e)
+                print("Gallery build failed:", e)
+            with self._lock:
+                if self._rerun:
+                    self._rerun = False
+                    continue
+                self.state = "failed" if error else "done"
+                self.result, self.error, self.finished = result, error, time.time()
+                return
+
+    def status(self) -> dict:
+        with self._lock:
+            return {"state": self.state, "result": self.result, "error": self.error,
+                    "started": self.started, "finished": self.finished, "queued": self._rerun}
+
+
+def text_stream(binary):
+    """Text view of an uploaded / opened binary CSV; tolerates a UTF-8 BOM."""
+    return io.TextIOWrapper(binary, encoding="utf-8-sig", newline="")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk import of users, enrollments and face photos")
+    parser.add_argument("--csv", help="users CSV (user_id, name, role, password[, subjects])")
+    parser.add_argument("--photos", help="ZIP of <user_id>/<photo> images")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="CSV rows per transaction")
+    parser.add_argument("--no-build", action="store_true",
+                        help="only extract photos; run 'python manage_faces.py build' later")
+    parser.add_argument("-w", "--workers", type=int, default=1, help="processes for encoding new photos")
+    parser.add_argument("--report", help="write the rejected rows / entries to this CSV")
+    args = parser.parse_args(argv)
+    if not args.csv and not args.photos:
+        parser.error("nothing to import: pass --csv and/or --photos")
+
+    t0 = time.perf_counter()
+    csv_file = open(args.csv, "rb") if args.csv else None
+    try:
+        report = run(text_stream(csv_file) if csv_file else None, args.photos, chunk_size=args.chunk_size,
+                     build=not args.no_build, workers=args.workers)
+    finally:
+        if csv_file:
+            csv_file.close()
+    print(f"{report.summary()} in {time.perf_counter() - t0:.1f}s")
+    for e in report.errors[:50]:
+        print(f"  {e['source']} {e['location']}: {e['user_id'] or '-'}: {e['message']}")
+    if len(report.errors) > 50:
+        print(f"  ... {len(report.errors) - 50} more")
+    if args.report:
+        report.write_csv(args.report)
+        print(f"Error report written to {args.report}")
+
+
+if __name__ == "__main__":
+    main()
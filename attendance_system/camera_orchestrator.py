@@ -0,0 +1,353 @@
+"""
+Run recognition for many classroom cameras, one worker process per camera.
+
+    python camera_orchestrator.py cameras.json
+
+cameras.json:
+
+    {"cameras": [
+        {"name": "room101", "source": 0,
+         "schedule": [{"subject_id": 3, "days": ["mon", "wed"], "start": "09:00", "end": "10:30"}]},
+        {"name": "room102", "source": "rtsp://10.0.0.12/stream1", "cpus": [4, 5],
+         "schedule": [{"subject_id": 5, "start": "11:00", "end": "12:00"}]}
+    ]}
+
+`source` is a device index, an RTSP/HTTP URL or a video file. During a
+scheduled slot the worker runs the attendance_stream pipeline for that subject
+and marks attendance directly; outside slots the camera is closed.
+
+Workers are pinned to their own cores (core 0 is left to Flask and this
+process) and restarted with exponential backoff when they exit with an error or
+stop reporting. Every worker memory-maps the same published gallery read-only,
+so the encodings are shared through the page cache rather than copied.
+
+Workers publish their latest annotated JPEG and a stats file into STATUS_DIR;
+the Flask app only reads those (see camera_status / camera_frames), it runs no
+inference itself.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import re
+import signal
+import time
+from datetime import datetime
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent
+STATUS_DIR = BASE_DIR / "camera_status"
+
+SCHEDULE_POLL = 5.0     # seconds between schedule checks in a worker
+VIEWER_FPS = 10         # max JPEG writes per second per camera
+VIEWER_WIDTH = 640      # published frames are scaled down to this width
+VIEWER_QUALITY = 70
+STATS_INTERVAL = 1.0    # seconds between stats writes
+HANG_TIMEOUT = 30.0     # a worker whose stats are older than this is restarted
+RESTART_BACKOFF = (1, 60)  # first and maximum delay before restarting a failed worker
+STABLE_AFTER = 60.0     # a worker that ran this long gets its backoff reset
+
+_NAME_RE = re.compile(r"[A-Za-z0-9_-]+")
+_DAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+
+
+# -------------------------
+# Config
+# -------------------------
+def load_config(path):
+    """Read and validate a cameras.json file; returns the list of camera dicts."""
+    with open(path, "r", encoding="utf-8") as f:
+        cameras = json.load(f).get("cameras", [])
+    names = set()
+    for cam in cameras:
+        name = cam.get("name", "")
+        if not _NAME_RE.fullmatch(name):
+            raise ValueError(f"camera name {name!r} must be letters, digits, '_' or '-'")
+        if name in names:
+            raise ValueError(f"duplicate camera name {name!r}")
+        names.add(name)
+        if "source" not in cam:
+            raise ValueError(f"camera {name!r} has no source")
+        if isinstance(cam["source"], str) and cam["source"].isdigit():
+            cam["source"] = int(cam["source"])
+        for slot in cam.setdefault("schedule", []):
+            for key in ("subject_id", "start", "end"):
+                if key not in slot:
+                    raise ValueError(f"camera {name!r}: schedule slot without {key!r}")
+            bad = set(slot.get("days", _DAYS)) - set(_DAYS)
+            if bad:
+                raise ValueError(f"camera {name!r}: unknown days {sorted(bad)}")
+    return cameras
+
+
+def active_subject(schedule, now=None):
+    """subject_id of the slot covering `now`, or None."""
+    now = now or datetime.now()
+    day, clock = _DAYS[now.weekday()], now.strftime("%H:%M")
+    for slot in schedule:
+        if day in slot.get("days", _DAYS) and slot["start"] <= clock < slot["end"]:
+            return int(slot["subject_id"])
+    return None
+
+
+def assign_cpus(cameras):
+    """Explicit 'cpus' win; the others get an equal share of the cores after core 0."""
+    if not hasattr(os, "sched_getaffinity"):
+        return {cam["name"]: None for cam in cameras}
+    available = sorted(os.sched_getaffinity(0))
+    cores = available[1:] or available
+    auto = [cam for cam in cameras if not cam.get("cpus")]
+    per_camera = max(1, len(cores) // max(1, len(auto)))
+    plan = {cam["name"]: list(cam["cpus"]) for cam in cameras if cam.get("cpus")}
+    for i, cam in enumerate(auto):
+        plan[cam["name"]] = [cores[(i * per_camera + j) % len(cores)] for j in range(per_camera)]
+    return plan
+
+
+# -------------------------
+# Status files (written by workers, read by Flask)
+# -------------------------
+def _write_atomic(path: Path, data: bytes):
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def camera_status(status_dir=STATUS_DIR):
+    """Latest stats of every camera that has reported, sorted by name."""
+    status = []
+    for path in sorted(Path(status_dir).glob("*.json")):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                stats = json.load(f)
+        except (OSError, ValueError):
+            continue
+        stats["age_s"] = round(time.time() - stats.get("updated", 0), 1)
+        status.append(stats)
+    return status
+
+
+def latest_jpeg(name, status_dir=STATUS_DIR):
+    if not _NAME_RE.fullmatch(name):
+        return None
+    try:
+        with open(Path(status_dir) / f"{name}.jpg", "rb") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def camera_frames(name, status_dir=STATUS_DIR, fps=VIEWER_FPS):
+    """multipart/x-mixed-replace chunks of a camera's latest frame, re-sent whenever the worker updates it."""
+    path = Path(status_dir) / f"{name}.jpg"
+    last_mtime = None
+    while True:
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            mtime = None
+        if mtime is not None and mtime != last_mtime:
+            frame_bytes = latest_jpeg(name, status_dir)
+            if frame_bytes:
+                last_mtime = mtime
+                yield (b'--frame\r\n'
+                       b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
+        time.sleep(1.0 / fps)
+
+
+# -------------------------
+# Worker process
+# -------------------------
+def _mark(student_id, subject_id, status='Present'):
+    import attendance_writer
+    return attendance_writer.submit(student_id, subject_id, status=status)
+
+
+def _exit_on_sigterm(signum, frame):
+    raise SystemExit(0)
+
+
+def camera_worker(camera, status_dir, cpus=None):
+    """Process entry point: run the camera's scheduled sessions until killed."""
+    if cpus and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+        os.environ.setdefault("OMP_NUM_THREADS", str(len(cpus)))  # before numpy/dlib load
+
+    # terminate() from the supervisor: unwind through `finally` so queued marks are written
+    signal.signal(signal.SIGTERM, _exit_on_sigterm)
+
+    # heavy imports happen here, in the worker only
+    import attendance_stream as stream
+    import database_manager as db
+    from ai_modules import face_recognition as fr
+    fr.set_roster_loader(lambda subject_id: [s['user_id'] for s in db.get_enrolled_students(subject_id)],
+                         revision=db.get_roster_revision)
+    stream.set_present_loader(lambda subject_id: [r['student_id'] for r in db.get_attendance_for_subject_today(subject_id)
+                                                  if r['status'] == 'Present'])
+
+    name, source = camera["name"], camera["source"]
+    status_dir = Path(status_dir)
+    stats_path, jpeg_path = status_dir / f"{name}.json", status_dir / f"{name}.jpg"
+    is_file = isinstance(source, str) and os.path.isfile(source)
+
+    pipeline, subject_id = None, None
+    next_schedule_check = last_stats = 0.0
+    try:
+        while True:
+            now = time.monotonic()
+            if now >= next_schedule_check:
+                next_schedule_check = now + SCHEDULE_POLL
+                active = active_subject(camera["schedule"])
+                if active != subject_id:
+                    if pipeline is not None:
+                        pipeline.stop()
+                        pipeline = None
+                    subject_id = active
+                    if active is not None:
+                        print(f"[{name}] starting session for subject {active}")
+                        session = stream.AttendanceSession(active, _mark)
+                        viewer = stream.StreamSettings(VIEWER_WIDTH, VIEWER_QUALITY, VIEWER_FPS)
+                        pipeline = stream.FramePipeline(source, session.process, tiers={"viewer": viewer}).start()
+
+            if now - last_stats >= STATS_INTERVAL:
+                last_stats = now
+                if pipeline is not None:
+                    stats = pipeline.stats()
+                    stats.update(session.stats())
+                else:
+                    stats = {"source": source, "running": False}
+                stats.update({"name": name, "subject_id": subject_id, "pid": os.getpid(), "cpus": cpus,
+                              "process_rss_mb": round(stream.process_rss_bytes() / 2 ** 20, 1),
+                              "updated": time.time()})
+                _write_atomic(stats_path, json.dumps(stats, default=str).encode("utf-8"))
+
+            if pipeline is None:
+                time.sleep(min(STATS_INTERVAL, SCHEDULE_POLL))
+                continue
+            if not pipeline.running and not pipeline.encoded.qsize():
+                if is_file:
+                    print(f"[{name}] end of {source}")
+                    return
+                raise RuntimeError(f"camera {source} stopped delivering frames")
+
+            frame_bytes = pipeline.encoded.get(timeout=0.5)  # already capped at VIEWER_FPS
+            if frame_bytes is not None:
+                _write_atomic(jpeg_path, frame_bytes)
+    finally:
+        if pipeline is not None:
+            pipeline.stop()
+        # multiprocessing children leave through os._exit, which skips the writer's atexit drain
+        import attendance_writer
+        attendance_writer.get_writer().close()
+
+
+# -------------------------
+# Supervisor
+# -------------------------
+class Orchestrator:
+    """Starts one worker per camera and restarts failed or hung workers with exponential backoff."""
+
+    def __init__(self, cameras, status_dir=STATUS_DIR, pin: bool = True):
+        self.cameras = {cam["name"]: cam for cam in cameras}
+        self.status_dir = Path(status_dir)
+        self.cpus = assign_cpus(cameras) if pin else {name: None for name in self.cameras}
+        self.procs = {}       # name -> Process
+        self.started = {}     # name -> monotonic start time
+        self.started_wall = {}  # name -> wall-clock start time, compared with status file mtimes
+        self.backoff = {}     # name -> next restart delay
+        self.restart_at = {}  # name -> monotonic time of a pending restart
+        self._stopping = False
+
+    def _spawn(self, name):
+        # a status file left by an earlier worker must not make this one look hung
+        try:
+            (self.status_dir / f"{name}.json").unlink()
+        except FileNotFoundError:
+            pass
+        proc = multiprocessing.Process(target=camera_worker, name=f"camera-{name}",
+                                       args=(self.cameras[name], str(self.status_dir), self.cpus[name]),
+                                       daemon=True)
+        proc.start()
+        self.procs[name] = proc
+        self.started[name] = time.monotonic()
+        self.started_wall[name] = time.time()
+        print(f"[{name}] worker pid {proc.pid} on cpus {self.cpus[name]}")
+
+    def start(self):
+        self.status_dir.mkdir(parents=True, exist_ok=True)
+        for name in self.cameras:
+            self._spawn(name)
+
+    def _hung(self, name) -> bool:
+        try:
+            last = os.path.getmtime(self.status_dir / f"{name}.json")
+        except OSError:
+            last = 0.0  # never reported yet
+        # every worker gets HANG_TIMEOUT from its own start (importing cv2/dlib takes a while)
+        age = time.time() - max(last, self.started_wall[name])
+        return age > HANG_TIMEOUT
+
+    def check(self):
+        """One supervision pass: restart workers that died or stopped reporting."""
+        now = time.monotonic()
+        for name, proc in list(self.procs.items()):
+            if name in self.restart_at:
+                if now >= self.restart_at[name]:
+                    del self.restart_at[name]
+                    self._spawn(name)
+                continue
+            if proc.is_alive() and not self._hung(name):
+                continue
+            if proc.is_alive():
+                print(f"[{name}] not reporting for {HANG_TIMEOUT:.0f}s, restarting")
+                proc.terminate()
+                proc.join(5)
+            elif proc.exitcode == 0:
+                continue  # a video file that played to the end
+            if now - self.started[name] >= STABLE_AFTER:
+                self.backoff[name] = RESTART_BACKOFF[0]
+            delay = self.backoff.get(name, RESTART_BACKOFF[0])
+            self.backoff[name] = min(delay * 2, RESTART_BACKOFF[1])
+            self.restart_at[name] = now + delay
+            print(f"[{name}] worker exited ({proc.exitcode}), restarting in {delay}s")
+
+    def stop(self):
+        self._stopping = True
+        for proc in self.procs.values():
+            if proc.is_alive():
+                proc.terminate()
+        for proc in self.procs.values():
+            proc.join(5)
+
+    def run_forever(self, interval: float = 1.0):
+        self.start()
+        signal.signal(signal.SIGTERM, lambda *_: self.stop())
+        try:
+            while not self._stopping:
+                self.check()
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="One recognition worker process per classroom camera")
+    parser.add_argument("config", help="cameras.json")
+    parser.add_argument("--status-dir", default=str(STATUS_DIR), help="where workers publish frames and stats")
+    parser.add_argument("--no-pin", action="store_true", help="do not pin workers to cores")
+    args = parser.parse_args(argv)
+
+    try:
+        cameras = load_config(args.config)
+    except (OSError, ValueError) as e:
+        raise SystemExit(f"bad camera config: {e}")
+    if not cameras:
+        raise SystemExit("no cameras configured")
+    Orchestrator(cameras, args.status_dir, pin=not args.no_pin).run_forever()
+
+
+if __name__ == "__main__":
+    main()
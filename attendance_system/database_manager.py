@@ -1,16 +1,222 @@
 import sqlite3
+import threading
+from contextlib import contextmanager
 from datetime import datetime
 import os
 
+import migrations
+
 # DATABASE = 'attendance.db'
 DATABASE = os.path.join(os.path.dirname(__file__), 'attendance.db')
 
+# Connection tuning. WAL lets report readers run while recognition writes.
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",      # fsync at checkpoints, not on every commit (safe with WAL)
+    "PRAGMA cache_size = -20000",       # ~20 MB page cache per connection
+    "PRAGMA mmap_size = 268435456",     # read through a 256 MB memory map
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA busy_timeout = 5000",       # wait for a writer instead of failing with 'database is locked'
+)
+CACHED_STATEMENTS = 256  # prepared statements kept per connection
+POOL_SIZE = 8            # idle tuned connections kept for threads that come and go (one thread per request)
+
+# (path, pid) pairs whose schema this process has already brought up to date
+_migrated = set()
+_migrate_lock = threading.Lock()
+
+
+# Callbacks run after a subject's roster changes, e.g. to drop cached recognition galleries
+_roster_listeners = []
+
+def add_roster_listener(callback):
+    """callback(subject_id) is called after students are enrolled in / removed from subject_id."""
+    _roster_listeners.append(callback)
+
+def _notify_roster_change(subject_id):
+    conn = getattr(_local, "conn", None)
+    if conn is not None and conn.depth > 0:
+        conn.pending_roster_changes.add(subject_id)  # fired once the transaction commits
+        return
+    for callback in _roster_listeners:
+        try:
+            callback(subject_id)
+        except Exception as e:
+            print("Roster listener failed:", e)
+
+
+# --- Connections ---
+_local = threading.local()
+
+
+class _ThreadConnection:
+    """
+    A tuned connection, held by one thread at a time. Functions below keep their
+    connect / commit / close shape, but close() leaves the connection open for
+    the next call (so its prepared statements stay cached), and commit() /
+    rollback() are deferred while a transaction() block is open, so a whole
+    request commits once. The outermost finish() hands it back to the pool.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.pid = os.getpid()
+        self.depth = 0
+        self.pending_roster_changes = set()
+        # moves between threads through the pool, but is only ever used by the thread holding it
+        self.raw = sqlite3.connect(path, timeout=5.0, cached_statements=CACHED_STATEMENTS,
+                                   check_same_thread=False)
+        self.raw.row_factory = sqlite3.Row
+        for pragma in PRAGMAS:
+            self.raw.execute(pragma)
+        _ensure_schema(self.raw, path)
+
+    def cursor(self):
+        return self.raw.cursor()
+
+    def execute(self, sql, params=()):
+        return self.raw.execute(sql, params)
+
+    def executemany(self, sql, seq):
+        return self.raw.executemany(sql, seq)
+
+    def commit(self):
+        if self.depth == 0:
+            self.raw.commit()
+
+    def rollback(self):
+        if self.depth == 0:
+            self.raw.rollback()
+        # inside transaction(): the exception that caused this rolls back the whole block
+
+    def close(self):
+        # like closing a fresh connection: drop whatever the caller did not commit
+        if self.depth == 0 and self.raw.in_transaction:
+            self.raw.rollback()
+
+
+def _ensure_schema(raw, path):
+    key = (path, os.getpid())
+    if key in _migrated:
+        return
+    with _migrate_lock:
+        if key not in _migrated:
+            migrations.migrate(raw)
+            _migrated.add(key)
+
+
+_pool = []  # idle connections, most recently used last
+_pool_lock = threading.Lock()
+
+
+def _current(conn):
+    return conn is not None and conn.path == DATABASE and conn.pid == os.getpid()
+
+
+def _acquire():
+    """An idle pooled connection to DATABASE, or a newly opened (and tuned) one."""
+    with _pool_lock:
+        while _pool:
+            conn = _pool.pop()
+            if _current(conn):
+                return conn
+            if conn.pid == os.getpid():
+                conn.raw.close()  # DATABASE was repointed; a forked child just drops the parent's
+    return _ThreadConnection(DATABASE)
+
+
+def _release(conn):
+    """Return conn to the pool with no open transaction; a connection that cannot roll back is closed."""
+    conn.depth = 0
+    if conn.raw.in_transaction:
+        try:
+            conn.raw.rollback()
+        except sqlite3.Error:
+            conn.raw.close()
+            return
+    with _pool_lock:
+        if _current(conn) and len(_pool) < POOL_SIZE:
+            _pool.append(conn)
+            return
+    conn.raw.close()
+
 
 def get_db_connection():
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
+    """
+    This thread's connection to DATABASE. Taken from the pool on first use; kept by
+    the thread until its outermost transaction finishes (begin/finish, transaction()),
+    so short-lived request threads reuse tuned connections instead of opening new ones.
+    """
+    conn = getattr(_local, "conn", None)
+    if not _current(conn):
+        # first call in this thread, DATABASE was repointed, or we are a forked child
+        conn = _local.conn = _acquire()
+    return conn
+
+
+def begin():
+    """Open a (nestable) transaction on this thread's connection; pair with finish()."""
+    conn = get_db_connection()
+    conn.depth += 1
     return conn
 
+
+def finish(ok=True):
+    """Close the innermost begin(); the outermost one commits (ok) or rolls back."""
+    conn = getattr(_local, "conn", None)
+    if conn is None or conn.depth == 0:
+        return
+    conn.depth -= 1
+    if conn.depth:
+        return
+    changed, conn.pending_roster_changes = conn.pending_roster_changes, set()
+    _local.conn = None
+    try:
+        if not ok:
+            conn.raw.rollback()
+            return
+        try:
+            conn.raw.commit()
+        except sqlite3.Error:
+            conn.raw.rollback()  # e.g. still busy after busy_timeout: nothing was written, nobody to notify
+            raise
+    finally:
+        _release(conn)
+    for subject_id in changed:
+        _notify_roster_change(subject_id)
+
+
+@contextmanager
+def transaction():
+    """
+    Group every database call in the block into one transaction on this thread's
+    connection: committed when the outermost block exits, rolled back on an exception.
+    """
+    conn = begin()
+    try:
+        yield conn
+    except BaseException:
+        finish(ok=False)
+        raise
+    finish()
+
+
+def close_thread_connection():
+    """Return this thread's connection to the pool, e.g. before a worker thread exits."""
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        _local.conn = None
+        _release(conn)
+
+
+def close_pool():
+    """Close every idle pooled connection (after repointing DATABASE, at shutdown, in tests)."""
+    with _pool_lock:
+        idle, _pool[:] = list(_pool), []
+    for conn in idle:
+        if conn.pid == os.getpid():
+            conn.raw.close()
+
 # --- User Management ---
 def validate_login(user_id, password):
     conn = get_db_connection()
@@ -55,6 +261,46 @@ def get_user_by_id(user_id):
     conn.close()
     return user
 
+def get_existing_user_ids(user_ids):
+    """The subset of user_ids that already exist."""
+    user_ids = list(user_ids)
+    found = set()
+    conn = get_db_connection()
+    for i in range(0, len(user_ids), 500):  # stay under SQLite's bound-parameter limit
+        chunk = user_ids[i:i + 500]
+        found.update(row[0] for row in conn.cursor().execute(
+            f"SELECT user_id FROM users WHERE user_id IN ({', '.join('?' * len(chunk))})", chunk))
+    conn.close()
+    return found
+
+def import_users(users, enrollments=()):
+    """
+    Insert or update many users and enroll them, in one transaction.
+    users: (user_id, name, role, password) rows; an empty password keeps an existing user's password.
+    enrollments: (student_id, subject_id) pairs; existing ones are ignored.
+    Returns the number of enrollments added.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.executemany("""
+            INSERT INTO users (user_id, name, role, password) VALUES (?, ?, ?, ?)
+            ON CONFLICT (user_id) DO UPDATE SET name = excluded.name, role = excluded.role,
+                password = COALESCE(NULLIF(excluded.password, ''), users.password)
+        """, users)
+        enrollments = list(enrollments)
+        cursor.executemany("INSERT OR IGNORE INTO enrollments (student_id, subject_id) VALUES (?, ?)", enrollments)
+        added = cursor.rowcount if enrollments else 0
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    for subject_id in {subject_id for _, subject_id in enrollments}:
+        _notify_roster_change(subject_id)
+    return added
+
 def get_user_count_by_role(role):
     conn = get_db_connection()
     count = conn.cursor().execute("SELECT COUNT(*) FROM users WHERE role = ?", (role,)).fetchone()[0]
@@ -87,13 +333,48 @@ def enroll_student(student_id, subject_id):
         conn.commit()
     except sqlite3.IntegrityError: pass
     finally: conn.close()
+    _notify_roster_change(subject_id)
 
 def unenroll_student(student_id, subject_id):
     conn = get_db_connection()
     conn.cursor().execute("DELETE FROM enrollments WHERE student_id = ? AND subject_id = ?", (student_id, subject_id))
     conn.commit()
     conn.close()
-    
+    _notify_roster_change(subject_id)
+
+def set_enrollments(subject_id, student_ids):
+    """
+    Make student_ids the exact roster of subject_id in one transaction.
+    Returns (added, removed) counts; roster listeners are notified once, and only if something changed.
+    """
+    subject_id = int(subject_id)
+    target = set(student_ids)
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        current = {row[0] for row in cursor.execute("SELECT student_id FROM enrollments WHERE subject_id = ?", (subject_id,))}
+        added, removed = target - current, current - target
+        cursor.executemany("INSERT OR IGNORE INTO enrollments (student_id, subject_id) VALUES (?, ?)",
+                           [(sid, subject_id) for sid in sorted(added)])
+        cursor.executemany("DELETE FROM enrollments WHERE student_id = ? AND subject_id = ?",
+                           [(sid, subject_id) for sid in sorted(removed)])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    if added or removed:
+        _notify_roster_change(subject_id)
+    return len(added), len(removed)
+
+def get_roster_revision(subject_id):
+    """Counter bumped by every enrollment change of subject_id (0 if it never had one)."""
+    conn = get_db_connection()
+    row = conn.cursor().execute("SELECT revision FROM roster_revisions WHERE subject_id = ?", (subject_id,)).fetchone()
+    conn.close()
+    return row[0] if row else 0
+
 def get_enrolled_students(subject_id):
     conn = get_db_connection()
     students = conn.cursor().execute("SELECT u.* FROM users u JOIN enrollments e ON u.user_id = e.student_id WHERE e.subject_id = ?", (subject_id,)).fetchall()
@@ -115,14 +396,15 @@ def get_subjects_for_teacher(teacher_id):
     """
     conn = get_db_connection()
     query = """
-    SELECT s.id, s.subject_name, COUNT(e.student_id) as student_count
+    SELECT s.id, s.subject_name, COUNT(e.student_id) as student_count,
+           (SELECT d.present FROM attendance_daily d WHERE d.subject_id = s.id AND d.date = ?) as present_today
     FROM subjects s
     LEFT JOIN enrollments e ON s.id = e.subject_id
     WHERE s.teacher_id = ?
     GROUP BY s.id
     ORDER BY s.subject_name
     """
-    subjects = conn.cursor().execute(query, (teacher_id,)).fetchall()
+    subjects = conn.cursor().execute(query, (datetime.now().strftime('%Y-%m-%d'), teacher_id)).fetchall()
     conn.close()
     return subjects
 
@@ -138,15 +420,16 @@ def get_total_student_count_for_teacher(teacher_id):
     return count
 
 # --- Attendance Logging and Reporting ---
+# One row per student, subject and day (migrations: ux_attendance_student_subject_date); a later mark wins
+UPSERT_ATTENDANCE = """
+    INSERT INTO attendance_records (student_id, subject_id, timestamp, date, status) VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (student_id, subject_id, date) DO UPDATE SET status = excluded.status, timestamp = excluded.timestamp
+"""
+
 def manual_attendance_update(student_id, subject_id, status):
     conn = get_db_connection()
-    cursor = conn.cursor()
     today_date, timestamp = datetime.now().strftime('%Y-%m-%d'), datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    existing_record = cursor.execute("SELECT id FROM attendance_records WHERE student_id = ? AND subject_id = ? AND date = ?", (student_id, subject_id, today_date)).fetchone()
-    if existing_record:
-        cursor.execute("UPDATE attendance_records SET status = ?, timestamp = ? WHERE id = ?", (status, timestamp, existing_record['id']))
-    else:
-        cursor.execute("INSERT INTO attendance_records (student_id, subject_id, timestamp, date, status) VALUES (?, ?, ?, ?, ?)", (student_id, subject_id, timestamp, today_date, status))
+    conn.cursor().execute(UPSERT_ATTENDANCE, (student_id, subject_id, timestamp, today_date, status))
     conn.commit()
     conn.close()
 #new fuction is below rest code is old code:
@@ -155,20 +438,37 @@ def log_attendance(student_id, subject_id, status='Present'):
     Convenience function to mark attendance for now (same logic as manual_attendance_update but callable from recognition)
     """
     conn = get_db_connection()
-    cursor = conn.cursor()
-    today_date = datetime.now().strftime('%Y-%m-%d')
-    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    existing = cursor.execute("SELECT id FROM attendance_records WHERE student_id = ? AND subject_id = ? AND date = ?",
-                              (student_id, subject_id, today_date)).fetchone()
-    if existing:
-        cursor.execute("UPDATE attendance_records SET status = ?, timestamp = ? WHERE id = ?", (status, timestamp, existing['id']))
-    else:
-        cursor.execute("INSERT INTO attendance_records (student_id, subject_id, timestamp, date, status) VALUES (?, ?, ?, ?, ?)",
-                       (student_id, subject_id, timestamp, today_date, status))
+    now = datetime.now()
+    conn.cursor().execute(UPSERT_ATTENDANCE, (student_id, subject_id, now.strftime('%Y-%m-%d %H:%M:%S'),
+                                              now.strftime('%Y-%m-%d'), status))
     conn.commit()
     conn.close()
 
 
+def bulk_log_attendance(records):
+    """
+    Log many (student_id, subject_id, timestamp, status) records in one transaction.
+    timestamp is a datetime or 'YYYY-MM-DD HH:MM:SS' string and also decides the record's date,
+    so recordings are filed under the day they were made. Same upsert as log_attendance.
+    Returns the number of records written.
+    """
+    rows = []
+    for student_id, subject_id, timestamp, status in records:
+        if isinstance(timestamp, datetime):
+            timestamp = timestamp.strftime('%Y-%m-%d %H:%M:%S')
+        rows.append((student_id, subject_id, timestamp, timestamp[:10], status))
+    conn = get_db_connection()
+    try:
+        conn.executemany(UPSERT_ATTENDANCE, rows)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return len(rows)
+
+
 def get_attendance_for_subject_today(subject_id):
     conn = get_db_connection()
     today_date = datetime.now().strftime('%Y-%m-%d')
@@ -197,4 +497,78 @@ def get_student_attendance_history(student_id, subject_id):
     conn = get_db_connection()
     history = conn.cursor().execute("SELECT date, status, timestamp FROM attendance_records WHERE student_id = ? AND subject_id = ? ORDER BY date DESC", (student_id, subject_id)).fetchall()
     conn.close()
-    return history
\ No newline at end of file
+    return history
+
+# --- Report rollups (attendance_daily / attendance_monthly, kept current by triggers; see migrations.py) ---
+def get_daily_totals(subject_id, start_date, end_date):
+    """Present / absent / total records of a subject per day in [start_date, end_date]."""
+    conn = get_db_connection()
+    rows = conn.cursor().execute("""
+        SELECT date, present, absent, total FROM attendance_daily
+        WHERE subject_id = ? AND date BETWEEN ? AND ? AND total > 0 ORDER BY date
+    """, (subject_id, start_date, end_date)).fetchall()
+    conn.close()
+    return rows
+
+def get_monthly_totals(subject_id, start_month, end_month):
+    """Present / absent / total records and class days of a subject per 'YYYY-MM' month in the range."""
+    conn = get_db_connection()
+    rows = conn.cursor().execute("""
+        SELECT substr(date, 1, 7) as month, SUM(present) as present, SUM(absent) as absent,
+               SUM(total) as total, COUNT(*) as days
+        FROM attendance_daily
+        WHERE subject_id = ? AND date BETWEEN ? AND ? AND total > 0
+        GROUP BY month ORDER BY month
+    """, (subject_id, f"{start_month}-01", f"{end_month}-31")).fetchall()
+    conn.close()
+    return rows
+
+def get_student_totals(subject_id, start_month, end_month):
+    """Per-student present / absent / total records of a subject over the 'YYYY-MM' months in the range."""
+    conn = get_db_connection()
+    rows = conn.cursor().execute("""
+        SELECT m.student_id, u.name, SUM(m.present) as present, SUM(m.absent) as absent, SUM(m.total) as total
+        FROM attendance_monthly m JOIN users u ON m.student_id = u.user_id
+        WHERE m.subject_id = ? AND m.month BETWEEN ? AND ?
+        GROUP BY m.student_id HAVING SUM(m.total) > 0 ORDER BY u.name
+    """, (subject_id, start_month, end_month)).fetchall()
+    conn.close()
+    return rows
+
+def get_report_students(subject_id, start_month, end_month):
+    """Students enrolled in the subject plus anyone with records in the 'YYYY-MM' range, by name."""
+    conn = get_db_connection()
+    rows = conn.cursor().execute("""
+        SELECT user_id, name FROM users
+        WHERE user_id IN (SELECT student_id FROM enrollments WHERE subject_id = ?)
+           OR user_id IN (SELECT student_id FROM attendance_monthly
+                          WHERE subject_id = ? AND month BETWEEN ? AND ? AND total > 0)
+        ORDER BY name, user_id
+    """, (subject_id, subject_id, start_month, end_month)).fetchall()
+    conn.close()
+    return rows
+
+def get_month_revisions(subject_id, start_month, end_month):
+    """{'YYYY-MM': (days, revision sum, records)} of the daily rollup; changes whenever a month's records do."""
+    conn = get_db_connection()
+    rows = conn.cursor().execute("""
+        SELECT substr(date, 1, 7) as month, COUNT(*), SUM(revision), SUM(total)
+        FROM attendance_daily WHERE subject_id = ? AND date BETWEEN ? AND ?
+        GROUP BY month
+    """, (subject_id, f"{start_month}-01", f"{end_month}-31")).fetchall()
+    conn.close()
+    return {row[0]: tuple(row[1:]) for row in rows}
+
+def get_attendance_codes(subject_id, start_month, end_month):
+    """
+    (month, student_id, day of month, status code) of every record in the 'YYYY-MM' range,
+    with codes 1 = Present, 2 = Absent, 3 = any other status.
+    """
+    conn = get_db_connection()
+    rows = conn.cursor().execute("""
+        SELECT substr(date, 1, 7), student_id, CAST(substr(date, 9, 2) AS INTEGER),
+               CASE status WHEN 'Present' THEN 1 WHEN 'Absent' THEN 2 ELSE 3 END
+        FROM attendance_records WHERE subject_id = ? AND date BETWEEN ? AND ?
+    """, (subject_id, f"{start_month}-01", f"{end_month}-31")).fetchall()
+    conn.close()
+    return rows
@@ -1,29 +1,21 @@
-import os
-import face_recognition
-import pickle
+"""
+Legacy entry point, kept so old scripts and imports keep working.
 
-DATASET_DIR = "face_dataset"
-ENCODINGS_FILE = "encodings/encodings.pkl"
+The gallery is no longer written to encodings/encodings.pkl (nothing reads
+that file); it is built incrementally and published by
+ai_modules.face_recognition.build_encodings, the same code behind
 
-def build_encodings():
-    known_encodings = []
-    known_ids = []
+    python manage_faces.py build
+"""
+from ai_modules import face_recognition as _fr
 
-    for user_id in os.listdir(DATASET_DIR):
-        user_folder = os.path.join(DATASET_DIR, user_id)
-        if not os.path.isdir(user_folder):
-            continue
 
-        for img_name in os.listdir(user_folder):
-            img_path = os.path.join(user_folder, img_name)
-            image = face_recognition.load_image_file(img_path)
-            encodings = face_recognition.face_encodings(image)
+def build_encodings(full=False, workers=1):
+    """Build and publish the face gallery; returns (num_users, num_images_encoded)."""
+    users, images = _fr.build_encodings(full=full, workers=workers)
+    print(f"Gallery updated: {users} users, {images} images encoded.")
+    return users, images
 
-            if len(encodings) > 0:
-                known_encodings.append(encodings[0])
-                known_ids.append(user_id)
 
-    data = {"encodings": known_encodings, "ids": known_ids}
-    with open(ENCODINGS_FILE, "wb") as f:
-        pickle.dump(data, f)
-    print("Encodings updated successfully.")
+if __name__ == "__main__":
+    build_encodings()
@@ -0,0 +1,125 @@
+"""
+Offline maintenance for the face gallery.
+
+    python manage_faces.py build                 # incremental, like an enrollment
+    python manage_faces.py build --full -w 32    # full rebuild on 32 cores
+    python manage_faces.py migrate               # convert a legacy encodings.pkl
+    python manage_faces.py check                 # validate the gallery files and checksum
+    python manage_faces.py ann-report --pq-m 16  # ANN recall/latency vs exact search
+    python manage_faces.py bench-detect frame.jpg --scales 1 0.5 auto
+"""
+import argparse
+import os
+import time
+
+from ai_modules import face_recognition as fr
+from ai_modules.ann_index import recall_report
+from ai_modules.gallery import load_gallery, published_gallery_dir, read_gallery_header
+
+
+def cmd_build(args):
+    t0 = time.perf_counter()
+    num_users, num_faces = fr.build_encodings(full=args.full, workers=args.workers, chunksize=args.chunksize,
+                                              dtype=args.dtype)
+    print(f"{num_users} users, {num_faces} faces in {time.perf_counter() - t0:.1f}s -> {fr.GALLERY_DIR}")
+
+
+def cmd_migrate(args):
+    if not fr.ENCODINGS_FILE.exists():
+        raise SystemExit(f"nothing to migrate: {fr.ENCODINGS_FILE} not found")
+    header = fr.migrate_pickle_gallery(dtype=args.dtype)
+    print(f"Migrated {header['count']} encodings of {header['users']} users -> {fr.GALLERY_DIR}")
+    if args.remove:
+        os.remove(fr.ENCODINGS_FILE)
+        print(f"Removed {fr.ENCODINGS_FILE}")
+
+
+def cmd_check(args):
+    directory = published_gallery_dir(fr.GALLERY_DIR)
+    header = read_gallery_header(directory) if directory is not None else None
+    if header is None:
+        raise SystemExit(f"no gallery in {fr.GALLERY_DIR}")
+    t0 = time.perf_counter()
+    try:
+        gallery = load_gallery(directory, model=fr.MODEL_VERSION, verify=True)
+    except ValueError as e:
+        raise SystemExit(f"gallery invalid: {e}")
+    print(f"OK: {len(gallery)} encodings, {header['users']} users, {header['dtype']}, "
+          f"model {header['model']} in {directory.name} (verified in {(time.perf_counter() - t0) * 1000:.1f} ms)")
+
+
+def cmd_ann_report(args):
+    gallery = fr.get_gallery()
+    if not len(gallery):
+        raise SystemExit("gallery is empty")
+    t0 = time.perf_counter()
+    index = gallery.build_index(nlist=args.nlist, pq_m=args.pq_m, rerank=args.rerank)
+    print(f"{len(gallery)} encodings, nlist={index.nlist}, pq_m={index.pq_m}, "
+          f"built in {time.perf_counter() - t0:.2f}s")
+    print(f"{'setting':<12} {'recall@' + str(args.k):>9} {'ms/query':>9}")
+    for row in recall_report(gallery, index, k=args.k, nprobes=args.nprobe, num_queries=args.queries):
+        print(f"{row['setting']:<12} {row['recall']:>9.3f} {row['ms_per_query']:>9.3f}")
+
+
+def cmd_bench_detect(args):
+    import cv2
+
+    frame = cv2.imread(args.image)
+    if frame is None:
+        raise SystemExit(f"cannot read {args.image}")
+    rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    print(f"{args.image}: {frame.shape[1]}x{frame.shape[0]}")
+    print(f"{'scale':>6} {'faces':>6} {'resize ms':>10} {'detect ms':>10} {'encode ms':>10}")
+    for requested in args.scales:
+        fr.reset_stage_stats()
+        scale = fr.detection_scale(requested)
+        for _ in range(args.repeat):
+            boxes = fr.detect_faces(rgb, scale)
+        t0 = time.perf_counter()
+        fr.face_recognition.face_encodings(rgb, boxes)
+        encode_ms = (time.perf_counter() - t0) * 1000
+        stages = fr.get_stage_stats().get(scale, {})
+        print(f"{scale:>6.2f} {len(boxes):>6} {stages.get('resize', 0.0):>10.1f} "
+              f"{stages.get('detect', 0.0):>10.1f} {encode_ms:>10.1f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Face gallery maintenance")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("build", help="(re)build the encodings gallery from face_dataset/")
+    p.add_argument("--full", action="store_true", help="ignore the per-image cache and re-encode everything")
+    p.add_argument("-w", "--workers", type=int, default=os.cpu_count() or 1, help="encoder processes (default: all cores)")
+    p.add_argument("--chunksize", type=int, default=8, help="images handed to a worker at a time")
+    p.add_argument("--dtype", choices=("float32", "float16"), default=fr.GALLERY_DTYPE, help="on-disk matrix type")
+    p.set_defaults(func=cmd_build)
+
+    p = sub.add_parser("migrate", help="convert encodings.pkl to the memory-mappable gallery format")
+    p.add_argument("--dtype", choices=("float32", "float16"), default=fr.GALLERY_DTYPE, help="on-disk matrix type")
+    p.add_argument("--remove", action="store_true", help="delete encodings.pkl after a successful migration")
+    p.set_defaults(func=cmd_migrate)
+
+    p = sub.add_parser("check", help="validate the gallery header, layout and checksum")
+    p.set_defaults(func=cmd_check)
+
+    p = sub.add_parser("ann-report", help="compare approximate search with exact search")
+    p.add_argument("--nlist", type=int, default=None, help="inverted lists (default ~sqrt(N))")
+    p.add_argument("--nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32], help="settings to measure")
+    p.add_argument("--pq-m", type=int, default=fr.ANN_PQ_M, help="PQ bytes per encoding (0 = no PQ)")
+    p.add_argument("--rerank", type=int, default=32, help="PQ candidates re-scored exactly")
+    p.add_argument("-k", type=int, default=1, help="neighbours compared per query")
+    p.add_argument("--queries", type=int, default=500, help="number of noisy gallery rows used as queries")
+    p.set_defaults(func=cmd_ann_report)
+
+    p = sub.add_parser("bench-detect", help="per-stage detection cost at several detection scales")
+    p.add_argument("image", help="a representative camera frame")
+    p.add_argument("--scales", nargs="+", default=["1", "0.75", "0.5", "auto"], help="factors in (0, 1] or 'auto'")
+    p.add_argument("--repeat", type=int, default=5)
+    p.set_defaults(func=cmd_bench_detect)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
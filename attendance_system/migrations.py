@@ -0,0 +1,324 @@
+"""
+Versioned schema migrations, tracked in SQLite's PRAGMA user_version.
+
+    python migrations.py              # bring attendance.db up to date
+    python migrations.py --status     # print the current and latest version
+    python migrations.py --rebuild-rollups   # recompute the report rollups from attendance_records
+
+init_db.py and create_database.py used to define two different schemas; both
+now create their tables through migrate(), and an existing database built by
+either script is converged onto the same one. Each migration runs in its own
+transaction together with the version bump, so a failure leaves the database
+at the previous version. database_manager runs migrate() when a process first
+connects to a database.
+"""
+import argparse
+import os
+import sqlite3
+
+DATABASE = os.path.join(os.path.dirname(__file__), 'attendance.db')
+
+
+def _columns(conn, table):
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def _rebuild(conn, table, create_sql, columns):
+    """Recreate `table` from create_sql (which names it {table}), keeping `columns`."""
+    conn.execute(create_sql.format(table=f"{table}_new"))
+    cols = ", ".join(columns)
+    conn.execute(f"INSERT OR IGNORE INTO {table}_new ({cols}) SELECT {cols} FROM {table}")
+    conn.execute(f"DROP TABLE {table}")
+    conn.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+
+
+# -------------------------
+# Migrations: (version, description, function(conn)); append only, never edit a released one
+# -------------------------
+USERS_SQL = '''
+    CREATE TABLE {table} (
+        user_id TEXT PRIMARY KEY,
+        name TEXT NOT NULL,
+        role TEXT NOT NULL,
+        password TEXT NOT NULL
+    )
+'''
+
+SUBJECTS_SQL = '''
+    CREATE TABLE {table} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        subject_name TEXT NOT NULL,
+        teacher_id TEXT NOT NULL,
+        FOREIGN KEY (teacher_id) REFERENCES users (user_id)
+    )
+'''
+
+ENROLLMENTS_SQL = '''
+    CREATE TABLE {table} (
+        student_id TEXT NOT NULL,
+        subject_id INTEGER NOT NULL,
+        PRIMARY KEY (student_id, subject_id),
+        FOREIGN KEY (student_id) REFERENCES users (user_id),
+        FOREIGN KEY (subject_id) REFERENCES subjects (id)
+    )
+'''
+
+ATTENDANCE_SQL = '''
+    CREATE TABLE {table} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        student_id TEXT NOT NULL,
+        subject_id INTEGER NOT NULL,
+        timestamp TEXT NOT NULL,
+        date TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'Present',
+        FOREIGN KEY (student_id) REFERENCES users (user_id),
+        FOREIGN KEY (subject_id) REFERENCES subjects (id)
+    )
+'''
+
+
+def _base_schema(conn):
+    """Create missing tables; converge create_database.py's variant onto init_db.py's."""
+    existing = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    for table, sql in (("users", USERS_SQL), ("subjects", SUBJECTS_SQL),
+                       ("enrollments", ENROLLMENTS_SQL), ("attendance_records", ATTENDANCE_SQL)):
+        if table not in existing:
+            conn.execute(sql.format(table=table))
+
+    # create_database.py: surrogate `id` keys on users and enrollments; user_id / the pair were UNIQUE.
+    # Its CHECK on users.role is not carried over: init_db.py never had it and the app validates roles.
+    if "id" in _columns(conn, "users"):
+        _rebuild(conn, "users", USERS_SQL, ["user_id", "name", "role", "password"])
+    if "id" in _columns(conn, "enrollments"):
+        _rebuild(conn, "enrollments", ENROLLMENTS_SQL, ["student_id", "subject_id"])
+    # status: nullable with a default (create_database.py), NOT NULL without one (init_db.py)
+    status = next(row for row in conn.execute("PRAGMA table_info(attendance_records)") if row[1] == "status")
+    if not status[3] or status[4] != "'Present'":
+        conn.execute("UPDATE attendance_records SET status = 'Present' WHERE status IS NULL")
+        _rebuild(conn, "attendance_records", ATTENDANCE_SQL,
+                 ["id", "student_id", "subject_id", "timestamp", "date", "status"])
+
+
+def _attendance_indexes(conn):
+    """One attendance row per student, subject and day, plus indexes for the report queries."""
+    removed = conn.execute("""
+        DELETE FROM attendance_records WHERE id NOT IN (
+            SELECT id FROM (
+                SELECT id, ROW_NUMBER() OVER (PARTITION BY student_id, subject_id, date
+                                              ORDER BY timestamp DESC, id DESC) AS n
+                FROM attendance_records)
+            WHERE n = 1)
+    """).rowcount
+    if removed:
+        print(f"Removed {removed} duplicate attendance record(s), kept the latest of each day")
+    # serves the upsert key and get_student_attendance_history (student_id, subject_id ORDER BY date)
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS ux_attendance_student_subject_date "
+                 "ON attendance_records (student_id, subject_id, date)")
+    # get_attendance_for_subject_today / _by_date / _by_month
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_attendance_subject_date ON attendance_records (subject_id, date)")
+    # get_enrolled_students; the (student_id, subject_id) key only helps lookups by student
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_enrollments_subject ON enrollments (subject_id)")
+
+
+# Per-(subject, date) and per-(subject, student, month) counts of attendance_records, kept
+# current by triggers in the same transaction as every write; reports read these instead of raw rows.
+ROLLUP_TABLES = ('''
+    CREATE TABLE IF NOT EXISTS attendance_daily (
+        subject_id INTEGER NOT NULL,
+        date TEXT NOT NULL,
+        present INTEGER NOT NULL DEFAULT 0,
+        absent INTEGER NOT NULL DEFAULT 0,
+        total INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (subject_id, date)
+    ) WITHOUT ROWID
+''', '''
+    CREATE TABLE IF NOT EXISTS attendance_monthly (
+        subject_id INTEGER NOT NULL,
+        month TEXT NOT NULL,
+        student_id TEXT NOT NULL,
+        present INTEGER NOT NULL DEFAULT 0,
+        absent INTEGER NOT NULL DEFAULT 0,
+        total INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (subject_id, month, student_id)
+    ) WITHOUT ROWID
+''')
+
+# {row} is NEW or OLD; {sign} +1 to count a record, -1 to uncount it
+_ROLLUP_ADD = '''
+        INSERT INTO attendance_daily (subject_id, date, present, absent, total)
+        VALUES ({row}.subject_id, {row}.date, ({row}.status = 'Present') * {sign}, ({row}.status = 'Absent') * {sign}, {sign})
+        ON CONFLICT (subject_id, date) DO UPDATE SET present = present + excluded.present,
+            absent = absent + excluded.absent, total = total + excluded.total;
+        INSERT INTO attendance_monthly (subject_id, month, student_id, present, absent, total)
+        VALUES ({row}.subject_id, substr({row}.date, 1, 7), {row}.student_id,
+                ({row}.status = 'Present') * {sign}, ({row}.status = 'Absent') * {sign}, {sign})
+        ON CONFLICT (subject_id, month, student_id) DO UPDATE SET present = present + excluded.present,
+            absent = absent + excluded.absent, total = total + excluded.total;
+'''
+
+ROLLUP_TRIGGERS = (f'''
+    CREATE TRIGGER IF NOT EXISTS trg_attendance_rollup_insert AFTER INSERT ON attendance_records BEGIN
+        {_ROLLUP_ADD.format(row="NEW", sign=1)}
+    END
+''', f'''
+    CREATE TRIGGER IF NOT EXISTS trg_attendance_rollup_delete AFTER DELETE ON attendance_records BEGIN
+        {_ROLLUP_ADD.format(row="OLD", sign=-1)}
+    END
+''', f'''
+    -- the attendance upsert rewrites status on every mark; only real changes touch the rollups
+    CREATE TRIGGER IF NOT EXISTS trg_attendance_rollup_update AFTER UPDATE OF student_id, subject_id, date, status
+    ON attendance_records
+    WHEN OLD.status IS NOT NEW.status OR OLD.date IS NOT NEW.date
+      OR OLD.subject_id IS NOT NEW.subject_id OR OLD.student_id IS NOT NEW.student_id BEGIN
+        {_ROLLUP_ADD.format(row="OLD", sign=-1)}
+        {_ROLLUP_ADD.format(row="NEW", sign=1)}
+    END
+''')
+
+
+def rebuild_rollups(conn):
+    """Recompute both rollup tables from attendance_records (inside the caller's transaction)."""
+    revisioned = "revision" in _columns(conn, "attendance_daily")
+    if revisioned:
+        last = conn.execute("SELECT COALESCE(MAX(revision), 0) FROM attendance_daily").fetchone()[0]
+    conn.execute("DELETE FROM attendance_daily")
+    conn.execute("DELETE FROM attendance_monthly")
+    conn.execute("""
+        INSERT INTO attendance_daily (subject_id, date, present, absent, total)
+        SELECT subject_id, date, SUM(status = 'Present'), SUM(status = 'Absent'), COUNT(*)
+        FROM attendance_records GROUP BY subject_id, date
+    """)
+    conn.execute("""
+        INSERT INTO attendance_monthly (subject_id, month, student_id, present, absent, total)
+        SELECT subject_id, substr(date, 1, 7), student_id, SUM(status = 'Present'), SUM(status = 'Absent'), COUNT(*)
+        FROM attendance_records GROUP BY subject_id, substr(date, 1, 7), student_id
+    """)
+    if revisioned:  # past every earlier revision, so no cached month looks current by accident
+        conn.execute("UPDATE attendance_daily SET revision = ?", (last + 1,))
+
+
+# Bumped whenever a subject-day's counts change, so report caches can tell a month is stale
+# without re-reading its records (recursive_triggers is off: the trigger's own UPDATE does not re-fire it).
+REVISION_TRIGGER = '''
+    CREATE TRIGGER IF NOT EXISTS trg_attendance_daily_revision AFTER UPDATE OF present, absent, total
+    ON attendance_daily BEGIN
+        UPDATE attendance_daily SET revision = revision + 1 WHERE subject_id = NEW.subject_id AND date = NEW.date;
+    END
+'''
+
+
+def _attendance_rollups(conn):
+    for statement in ROLLUP_TABLES + ROLLUP_TRIGGERS:
+        conn.execute(statement)
+    rebuild_rollups(conn)
+
+
+def _rollup_revisions(conn):
+    conn.execute("ALTER TABLE attendance_daily ADD COLUMN revision INTEGER NOT NULL DEFAULT 0")
+    conn.execute(REVISION_TRIGGER)
+
+
+# Bumped on every enrollment change, so processes that cache a subject's roster (the camera
+# workers' recognition galleries) notice edits made in another process, e.g. the web app.
+ROSTER_REVISIONS = ('''
+    CREATE TABLE IF NOT EXISTS roster_revisions (
+        subject_id INTEGER PRIMARY KEY,
+        revision INTEGER NOT NULL DEFAULT 0
+    )
+''', '''
+    CREATE TRIGGER IF NOT EXISTS trg_roster_revision_insert AFTER INSERT ON enrollments BEGIN
+        INSERT INTO roster_revisions (subject_id, revision) VALUES (NEW.subject_id, 1)
+        ON CONFLICT (subject_id) DO UPDATE SET revision = revision + 1;
+    END
+''', '''
+    CREATE TRIGGER IF NOT EXISTS trg_roster_revision_delete AFTER DELETE ON enrollments BEGIN
+        INSERT INTO roster_revisions (subject_id, revision) VALUES (OLD.subject_id, 1)
+        ON CONFLICT (subject_id) DO UPDATE SET revision = revision + 1;
+    END
+''', '''
+    CREATE TRIGGER IF NOT EXISTS trg_roster_revision_update AFTER UPDATE OF student_id, subject_id
+    ON enrollments BEGIN
+        INSERT INTO roster_revisions (subject_id, revision) VALUES (OLD.subject_id, 1)
+        ON CONFLICT (subject_id) DO UPDATE SET revision = revision + 1;
+        INSERT INTO roster_revisions (subject_id, revision) VALUES (NEW.subject_id, 1)
+        ON CONFLICT (subject_id) DO UPDATE SET revision = revision + 1;
+    END
+''')
+
+
+def _roster_revisions(conn):
+    for statement in ROSTER_REVISIONS:
+        conn.execute(statement)
+
+
+MIGRATIONS = [
+    (1, "base schema", _base_schema),
+    (2, "unique daily attendance + report indexes", _attendance_indexes),
+    (3, "daily / monthly attendance rollups", _attendance_rollups),
+    (4, "revision counter on the daily rollup", _rollup_revisions),
+    (5, "per-subject roster revisions", _roster_revisions),
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+# -------------------------
+# Runner
+# -------------------------
+def current_version(conn) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn, verbose=False) -> int:
+    """Apply every pending migration to an open sqlite3 connection; returns the new version."""
+    if current_version(conn) >= LATEST_VERSION:
+        return current_version(conn)
+    if conn.in_transaction:
+        conn.commit()
+    for version, description, apply in MIGRATIONS:
+        conn.execute("BEGIN IMMEDIATE")  # one process migrates, the others wait and then skip
+        try:
+            if current_version(conn) >= version:
+                conn.rollback()
+                continue
+            apply(conn)
+            conn.execute(f"PRAGMA user_version = {version}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        if verbose:
+            print(f"Migrated database to version {version}: {description}")
+    return current_version(conn)
+
+
+def migrate_file(path=DATABASE, verbose=True) -> int:
+    conn = sqlite3.connect(path)
+    try:
+        return migrate(conn, verbose=verbose)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply pending database schema migrations")
+    parser.add_argument("--db", default=DATABASE, help="database file")
+    parser.add_argument("--status", action="store_true", help="only print the schema version")
+    parser.add_argument("--rebuild-rollups", action="store_true",
+                        help="recompute attendance_daily / attendance_monthly from attendance_records")
+    args = parser.parse_args()
+
+    if args.rebuild_rollups:
+        print(f"{args.db}: version {migrate_file(args.db)}")
+        conn = sqlite3.connect(args.db)
+        with conn:
+            rebuild_rollups(conn)
+        days, months = (conn.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0]
+                        for t in ("attendance_daily", "attendance_monthly"))
+        conn.close()
+        print(f"Rebuilt rollups: {days} subject-day row(s), {months} student-month row(s)")
+    elif args.status:
+        conn = sqlite3.connect(args.db)
+        print(f"{args.db}: version {current_version(conn)} (latest {LATEST_VERSION})")
+        conn.close()
+    else:
+        print(f"{args.db}: version {migrate_file(args.db)}")
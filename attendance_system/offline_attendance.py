@@ -0,0 +1,159 @@
+"""
+Mark attendance from recorded lecture videos instead of a live webcam.
+
+    python offline_attendance.py 3 room101_0900.mp4 --start "2024-03-04 09:00:00"
+    python offline_attendance.py 3 a.mp4 b.mp4 --stride 2 --chunk-seconds 300 -w 16
+
+Each video is cut into time chunks (overlapping by CHUNK_OVERLAP_SECONDS, so
+liveness state survives the cut) that are processed in parallel by a process
+pool, with the same recognition + blink liveness logic as the live stream
+(attendance_stream.AttendanceSession). Timestamps come from the video: the
+recording start plus the frame's offset. All records are written at the end
+in one transaction.
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+import cv2
+
+import database_manager as db
+from ai_modules import face_recognition as fr
+from attendance_stream import AttendanceSession
+
+DEFAULT_STRIDE = 2           # every 2nd frame; a blink still spans liveness_detection.CONSEC_FRAMES samples
+DEFAULT_CHUNK_SECONDS = 300
+# Each chunk after the first starts this much earlier, so a blink (and the face track that
+# carries it) crossing a chunk boundary is seen whole by the later chunk; marks are merged.
+CHUNK_OVERLAP_SECONDS = 2.0
+
+
+def _init_worker():
+    fr.set_roster_loader(lambda subject_id: [s['user_id'] for s in db.get_enrolled_students(subject_id)])
+
+
+def probe_video(path):
+    """(fps, frame_count) of a video file."""
+    cap = cv2.VideoCapture(path)
+    try:
+        if not cap.isOpened():
+            raise SystemExit(f"cannot open {path}")
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    finally:
+        cap.release()
+    if fps <= 0 or frames <= 0:
+        raise SystemExit(f"{path}: video reports no frame rate / frame count")
+    return fps, frames
+
+
+def process_chunk(path, subject_id, fps, first_frame, end_frame, stride, tracking=True):
+    """
+    Run recognition + liveness on frames [first_frame, end_frame) of one video,
+    sampling every `stride`-th frame. Returns {student_id: seconds into the video when first marked}.
+    """
+    marked = {}
+    clock = {"offset": 0.0}
+
+    def collect(student_id, subject_id, status='Present'):
+        marked.setdefault(student_id, clock["offset"])
+
+    session = AttendanceSession(subject_id, collect, tracking=tracking)
+    cap = cv2.VideoCapture(path)
+    try:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, first_frame)
+        for index in range(first_frame, end_frame):
+            if not cap.grab():
+                break
+            if index % stride:
+                continue
+            ok, frame = cap.retrieve()
+            if not ok:
+                continue
+            clock["offset"] = index / fps
+            session.process(frame, now_ts=clock["offset"])
+    finally:
+        cap.release()
+    return marked
+
+
+def recording_start(path, fps, frames, start=None):
+    """Explicit start time, else the file's modification time minus the video's duration."""
+    if start is not None:
+        return datetime.strptime(start, '%Y-%m-%d %H:%M:%S')
+    return datetime.fromtimestamp(os.path.getmtime(path)) - timedelta(seconds=frames / fps)
+
+
+def run(subject_id, videos, start=None, stride=DEFAULT_STRIDE, chunk_seconds=DEFAULT_CHUNK_SECONDS,
+        workers=1, tracking=True, dry_run=False):
+    """Process all videos; returns {(student_id, date): earliest timestamp}."""
+    jobs = []
+    video_seconds = 0.0
+    starts = {}
+    for path in videos:
+        fps, frames = probe_video(path)
+        starts[path] = recording_start(path, fps, frames, start)
+        video_seconds += frames / fps
+        step = max(1, int(chunk_seconds * fps))
+        overlap = int(CHUNK_OVERLAP_SECONDS * fps)
+        for first in range(0, frames, step):
+            jobs.append((path, subject_id, fps, max(0, first - overlap), min(first + step, frames), stride, tracking))
+    print(f"{len(videos)} video(s), {video_seconds / 60:.1f} min of footage in {len(jobs)} chunks")
+
+    t0 = time.perf_counter()
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+            results = list(pool.map(process_chunk, *zip(*jobs)))
+    else:
+        _init_worker()
+        results = [process_chunk(*job) for job in jobs]
+    elapsed = time.perf_counter() - t0
+
+    first_seen = {}
+    for job, marked in zip(jobs, results):
+        for student_id, offset in marked.items():
+            ts = starts[job[0]] + timedelta(seconds=offset)
+            key = (student_id, ts.strftime('%Y-%m-%d'))
+            if key not in first_seen or ts < first_seen[key]:
+                first_seen[key] = ts
+    print(f"Processed in {elapsed:.1f}s ({video_seconds / max(elapsed, 1e-9):.1f}x real time), "
+          f"{len(first_seen)} attendance record(s)")
+
+    for (student_id, day), ts in sorted(first_seen.items()):
+        print(f"  {day}  {student_id:<12} {ts:%H:%M:%S}")
+    if not dry_run and first_seen:
+        written = db.bulk_log_attendance((student_id, subject_id, ts, 'Present')
+                                         for (student_id, _), ts in sorted(first_seen.items()))
+        print(f"Wrote {written} record(s) for subject {subject_id}")
+    return first_seen
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk attendance from recorded lecture videos")
+    parser.add_argument("subject_id", type=int)
+    parser.add_argument("videos", nargs="+", help="video files recorded during the subject's lectures")
+    parser.add_argument("--start", help="recording start 'YYYY-MM-DD HH:MM:SS' (single video only; "
+                                        "default: file modification time minus duration)")
+    parser.add_argument("--stride", type=int, default=DEFAULT_STRIDE, help="process every Nth frame")
+    parser.add_argument("--chunk-seconds", type=float, default=DEFAULT_CHUNK_SECONDS,
+                        help="length of the video pieces handed to workers")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count() or 1, help="processes (default: all cores)")
+    parser.add_argument("--no-tracking", action="store_true", help="run full detection on every sampled frame")
+    parser.add_argument("--dry-run", action="store_true", help="print the records instead of writing them")
+    args = parser.parse_args(argv)
+
+    if args.start and len(args.videos) > 1:
+        parser.error("--start can only be used with a single video")
+    if args.stride < 1:
+        parser.error("--stride must be at least 1")
+    if db.get_subject_by_id(args.subject_id) is None:
+        raise SystemExit(f"no subject with id {args.subject_id}")
+
+    run(args.subject_id, args.videos, start=args.start, stride=args.stride, chunk_seconds=args.chunk_seconds,
+        workers=args.workers, tracking=not args.no_tracking, dry_run=args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
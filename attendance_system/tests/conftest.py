@@ -0,0 +1,30 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database_manager as db  # noqa: E402
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """database_manager pointed at a fresh, migrated database in tmp_path."""
+    monkeypatch.setattr(db, "DATABASE", str(tmp_path / "attendance.db"))
+    monkeypatch.setattr(db, "_roster_listeners", [])
+    db.get_db_connection()
+    yield db
+    db.close_thread_connection()
+    db.close_pool()
+
+
+@pytest.fixture
+def school(database):
+    """One teacher, subject 1 taught by them, and students s1..s3 enrolled in it."""
+    database.add_user("t1", "Teacher", "teacher", "pw")
+    database.add_subject("Maths", "t1")
+    for n in (1, 2, 3):
+        database.add_user(f"s{n}", f"Student {n}", "student", "pw")
+        database.enroll_student(f"s{n}", 1)
+    return database
@@ -0,0 +1,62 @@
+import pytest
+
+import attendance_matrix as am
+
+
+@pytest.fixture
+def matrix_db(school, monkeypatch):
+    monkeypatch.setattr(am, "_CACHE", am._MonthCache())
+    queried = []
+    load = school.get_attendance_codes
+
+    def spy(subject_id, start_month, end_month):
+        queried.append((start_month, end_month))
+        return load(subject_id, start_month, end_month)
+
+    monkeypatch.setattr(school, "get_attendance_codes", spy)
+    school.bulk_log_attendance([(f"s{n}", 1, f"2024-{month:02d}-{day:02d} 09:00:00", status)
+                                for month in range(1, 13) for day in (3, 17)
+                                for n, status in ((1, "Present"), (2, "Absent"), (3, "Late"))])
+    return school, queried
+
+
+def test_build_matrix_codes_and_totals(matrix_db):
+    _, queried = matrix_db
+    matrix = am.build_matrix(1, "2024-01", "2024-02")
+    assert matrix.dates == ["2024-01-03", "2024-01-17", "2024-02-03", "2024-02-17"]
+    assert [s["user_id"] for s in matrix.students] == ["s1", "s2", "s3"]
+    assert matrix.codes.tolist() == [[am.PRESENT] * 4, [am.ABSENT] * 4, [am.OTHER] * 4]
+    assert (matrix.present_count, matrix.absent_count) == (4, 4)
+    assert next(matrix.rows())[1:] == (["P", "P", "P", "P"], 4, 0, 0)
+    assert queried == [("2024-01", "2024-02")]
+
+
+def test_cached_months_are_not_read_again(matrix_db):
+    _, queried = matrix_db
+    am.build_matrix(1, "2024-01", "2024-12")
+    queried.clear()
+    am.build_matrix(1, "2024-03", "2024-06")
+    assert queried == []
+
+
+def test_only_changed_months_are_reloaded_in_contiguous_runs(matrix_db):
+    db, queried = matrix_db
+    am.build_matrix(1, "2024-01", "2024-12")
+    queried.clear()
+    db.bulk_log_attendance([("s3", 1, "2024-02-03 10:00:00", "Present"),
+                            ("s3", 1, "2024-03-17 10:00:00", "Present"),
+                            ("s2", 1, "2024-11-03 10:00:00", "Present")])
+    matrix = am.build_matrix(1, "2024-01", "2024-12")
+    assert queried == [("2024-02", "2024-03"), ("2024-11", "2024-11")]
+    am._CACHE.clear()
+    cold = am.build_matrix(1, "2024-01", "2024-12")
+    assert matrix.codes.tolist() == cold.codes.tolist() and matrix.dates == cold.dates
+
+
+def test_new_class_day_invalidates_the_month(matrix_db):
+    db, queried = matrix_db
+    am.build_matrix(1, "2024-05")
+    db.bulk_log_attendance([("s1", 1, "2024-05-20 09:00:00", "Present")])
+    matrix = am.build_matrix(1, "2024-05")
+    assert matrix.dates == ["2024-05-03", "2024-05-17", "2024-05-20"]
+    assert matrix.codes[:, 2].tolist() == [am.PRESENT, am.NONE, am.NONE]
@@ -0,0 +1,83 @@
+import io
+import threading
+import time
+import zipfile
+
+import bulk_import
+
+
+def _csv(*rows):
+    return io.StringIO("\n".join(("user_id,name,role,password,subjects",) + rows) + "\n")
+
+
+def test_run_imports_users_and_enrollments(school):
+    report = bulk_import.run(_csv("n1,New One,student,pw1,Maths", "n2,New Two,student,pw2,1;Maths",
+                                  "s1,Renamed,student,,"), build=False)
+    assert (report.rows, report.users_added, report.users_updated, report.enrollments_added) == (3, 2, 1, 2)
+    assert report.errors == []
+    assert school.validate_login("n1", "pw1")["name"] == "New One"
+    assert school.validate_login("s1", "pw")["name"] == "Renamed"  # empty password keeps the old one
+    assert {s["user_id"] for s in school.get_enrolled_students(1)} == {"s1", "s2", "s3", "n1", "n2"}
+
+
+def test_run_reports_bad_rows(school):
+    report = bulk_import.run(_csv("n1,New,wizard,pw,", "n2,New,student,,", "n3,New,student,pw,History"),
+                             build=False)
+    assert sorted((e["location"], e["user_id"]) for e in report.errors) == [(2, "n1"), (3, "n2"), (4, "n3")]
+    assert school.get_existing_user_ids({"n1", "n2", "n3"}) == set()
+
+
+def test_later_row_without_password_keeps_new_users_password(school):
+    report = bulk_import.run(_csv("n1,N,student,pw,", "n1,N,student,,"), build=False)
+    assert report.errors == []
+    assert school.validate_login("n1", "") is None
+    assert school.validate_login("n1", "pw") is not None
+
+
+def test_run_extracts_photos_of_known_users(school, tmp_path):
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as zf:
+        zf.writestr("s1/a.jpg", b"jpeg")
+        zf.writestr("ghost/a.jpg", b"jpeg")
+        zf.writestr("../s1/b.jpg", b"jpeg")
+    archive.seek(0)
+    report = bulk_import.run(archive=archive, build=False, dataset_dir=str(tmp_path / "faces"))
+    assert report.photos == 1
+    assert (tmp_path / "faces" / "s1" / "a.jpg").read_bytes() == b"jpeg"
+    assert sorted(e["message"] for e in report.errors) == ["no such user", "path escapes the archive"]
+
+
+def test_gallery_build_runs_in_the_background_and_reruns_once():
+    release, calls = threading.Event(), []
+
+    def build():
+        calls.append(len(calls))
+        release.wait(5)
+        return (1, len(calls))
+
+    job = bulk_import.GalleryBuild(build)
+    assert job.status()["state"] == "idle"
+    job.start()
+    job.start()
+    job.start()  # both requests made during the first run collapse into one re-run
+    assert job.status()["state"] == "running" and job.status()["queued"]
+    release.set()
+    for _ in range(500):
+        if job.status()["state"] != "running":
+            break
+        time.sleep(0.01)
+    assert job.status()["state"] == "done"
+    assert job.status()["result"] == (1, 2)
+
+
+def test_gallery_build_reports_failures():
+    def build():
+        raise RuntimeError("no model")
+
+    job = bulk_import.GalleryBuild(build)
+    job.start()
+    for _ in range(500):
+        if job.status()["state"] != "running":
+            break
+        time.sleep(0.01)
+    assert job.status()["state"] == "failed" and job.status()["error"] == "no model"
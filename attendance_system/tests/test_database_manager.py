@@ -0,0 +1,63 @@
+import sqlite3
+import threading
+
+import pytest
+
+
+class _FailingCommit:
+    """sqlite3 connection stand-in whose commit() fails like SQLITE_BUSY after busy_timeout."""
+
+    def __init__(self, raw):
+        self._raw = raw
+
+    def commit(self):
+        raise sqlite3.OperationalError("database is locked")
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+
+def test_request_threads_reuse_pooled_connections(database):
+    database.close_thread_connection()
+    seen = []
+
+    def request():
+        conn = database.begin()
+        database.get_user_count_by_role("student")
+        seen.append(conn)
+        database.finish()
+
+    for _ in range(3):
+        thread = threading.Thread(target=request)
+        thread.start()
+        thread.join()
+    assert seen[0] is seen[1] is seen[2]
+
+
+def test_nested_transactions_commit_once(school):
+    with school.transaction():
+        school.add_user("s4", "Student 4", "student", "pw")
+        with school.transaction():
+            school.enroll_student("s4", 1)
+        assert school.get_db_connection().raw.in_transaction
+    assert school.get_user_by_id("s4") is not None
+
+
+def test_failed_commit_rolls_back_and_returns_the_connection(school):
+    changed = []
+    school.add_roster_listener(changed.append)
+    conn = school.begin()
+    school.enroll_student("s1", 1)
+    school.add_user("s4", "Student 4", "student", "pw")
+    school.enroll_student("s4", 1)
+    raw, conn.raw = conn.raw, _FailingCommit(conn.raw)
+    with pytest.raises(sqlite3.OperationalError):
+        school.finish()
+    conn.raw = raw
+    assert not raw.in_transaction
+    assert school._pool[-1] is conn
+    assert changed == []
+    assert school.get_user_by_id("s4") is None
+    with school.transaction():  # the pooled connection is usable again
+        school.add_user("s5", "Student 5", "student", "pw")
+    assert school.get_user_by_id("s5") is not None
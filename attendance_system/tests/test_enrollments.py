@@ -0,0 +1,41 @@
+def _roster(db, subject_id):
+    return {s["user_id"] for s in db.get_enrolled_students(subject_id)}
+
+
+def test_set_enrollments_makes_the_exact_roster(school):
+    school.add_user("s4", "Student 4", "student", "pw")
+    assert school.set_enrollments(1, ["s2", "s3", "s4"]) == (1, 1)
+    assert _roster(school, 1) == {"s2", "s3", "s4"}
+    assert school.set_enrollments(1, ["s2", "s3", "s4"]) == (0, 0)
+
+
+def test_set_enrollments_notifies_listeners_once_per_change(school):
+    changed = []
+    school.add_roster_listener(changed.append)
+    school.set_enrollments(1, ["s1"])
+    school.set_enrollments(1, ["s1"])
+    assert changed == [1]
+
+
+def test_roster_listeners_wait_for_the_transaction(school):
+    changed = []
+    school.add_roster_listener(changed.append)
+    with school.transaction():
+        school.set_enrollments(1, ["s1"])
+        school.enroll_student("s2", 1)
+        assert changed == []
+    assert changed == [1]
+
+
+def test_roster_revision_moves_with_every_enrollment_change(school):
+    school.add_subject("History", "t1")
+    assert school.get_roster_revision(2) == 0
+    school.enroll_student("s1", 2)
+    first = school.get_roster_revision(2)
+    school.set_enrollments(2, ["s1"])  # no change
+    assert school.get_roster_revision(2) == first
+    school.set_enrollments(2, ["s2"])
+    assert school.get_roster_revision(2) > first
+    revision = school.get_roster_revision(1)
+    school.unenroll_student("s3", 1)
+    assert school.get_roster_revision(1) > revision
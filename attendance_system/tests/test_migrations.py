@@ -0,0 +1,106 @@
+import sqlite3
+
+import pytest
+
+import migrations
+
+INIT_DB_SCHEMA = '''
+    CREATE TABLE users (user_id TEXT PRIMARY KEY, name TEXT NOT NULL, role TEXT NOT NULL, password TEXT NOT NULL);
+    CREATE TABLE subjects (id INTEGER PRIMARY KEY AUTOINCREMENT, subject_name TEXT NOT NULL, teacher_id TEXT NOT NULL,
+        FOREIGN KEY (teacher_id) REFERENCES users (user_id));
+    CREATE TABLE enrollments (student_id TEXT NOT NULL, subject_id INTEGER NOT NULL,
+        PRIMARY KEY (student_id, subject_id),
+        FOREIGN KEY (student_id) REFERENCES users (user_id), FOREIGN KEY (subject_id) REFERENCES subjects (id));
+    CREATE TABLE attendance_records (id INTEGER PRIMARY KEY AUTOINCREMENT, student_id TEXT NOT NULL,
+        subject_id INTEGER NOT NULL, timestamp TEXT NOT NULL, date TEXT NOT NULL, status TEXT NOT NULL,
+        FOREIGN KEY (student_id) REFERENCES users (user_id), FOREIGN KEY (subject_id) REFERENCES subjects (id));
+'''
+
+CREATE_DATABASE_SCHEMA = '''
+    CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT NOT NULL UNIQUE, name TEXT NOT NULL,
+        role TEXT NOT NULL CHECK(role IN ('student', 'teacher', 'admin')), password TEXT NOT NULL);
+    CREATE TABLE subjects (id INTEGER PRIMARY KEY AUTOINCREMENT, subject_name TEXT NOT NULL, teacher_id TEXT NOT NULL,
+        FOREIGN KEY (teacher_id) REFERENCES users (user_id));
+    CREATE TABLE enrollments (id INTEGER PRIMARY KEY AUTOINCREMENT, student_id TEXT NOT NULL,
+        subject_id INTEGER NOT NULL, UNIQUE(student_id, subject_id),
+        FOREIGN KEY (student_id) REFERENCES users (user_id), FOREIGN KEY (subject_id) REFERENCES subjects (id));
+    CREATE TABLE attendance_records (id INTEGER PRIMARY KEY AUTOINCREMENT, student_id TEXT NOT NULL,
+        subject_id INTEGER NOT NULL, timestamp TEXT NOT NULL, date TEXT NOT NULL, status TEXT DEFAULT 'Present',
+        FOREIGN KEY (student_id) REFERENCES users (user_id), FOREIGN KEY (subject_id) REFERENCES subjects (id));
+'''
+
+SAMPLE_DATA = '''
+    INSERT INTO users (user_id, name, role, password) VALUES
+        ('t1', 'Teacher', 'teacher', 'pw'), ('s1', 'One', 'student', 'pw'), ('s2', 'Two', 'student', 'pw');
+    INSERT INTO subjects (subject_name, teacher_id) VALUES ('Maths', 't1');
+    INSERT INTO enrollments (student_id, subject_id) VALUES ('s1', 1), ('s2', 1);
+    INSERT INTO attendance_records (student_id, subject_id, timestamp, date, status) VALUES
+        ('s1', 1, '2024-03-01 09:00:00', '2024-03-01', 'Absent'),
+        ('s1', 1, '2024-03-01 09:05:00', '2024-03-01', 'Present'),
+        ('s2', 1, '2024-03-01 09:00:00', '2024-03-01', 'Absent');
+'''
+
+
+def _database(path, schema=None):
+    conn = sqlite3.connect(str(path))
+    if schema:
+        conn.executescript(schema + SAMPLE_DATA)
+    return conn
+
+
+def _schema(conn):
+    """Columns, indexes and triggers of every table, independent of how the tables were created."""
+    tables = [row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name")]
+    shape = {}
+    for table in tables:
+        columns = [row[1:] for row in conn.execute(f"PRAGMA table_info({table})")]
+        indexes = sorted((row[1], row[2]) for row in conn.execute(f"PRAGMA index_list({table})")
+                         if not row[1].startswith("sqlite_autoindex"))
+        shape[table] = (columns, indexes)
+    shape["triggers"] = sorted(row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'"))
+    return shape
+
+
+def test_fresh_database_reaches_latest_version(tmp_path):
+    conn = _database(tmp_path / "fresh.db")
+    assert migrations.migrate(conn) == migrations.LATEST_VERSION
+    assert migrations.migrate(conn) == migrations.LATEST_VERSION
+
+
+def test_legacy_schemas_converge_on_the_fresh_one(tmp_path):
+    fresh = _database(tmp_path / "fresh.db")
+    migrations.migrate(fresh)
+    for name, schema in (("init_db", INIT_DB_SCHEMA), ("create_database", CREATE_DATABASE_SCHEMA)):
+        legacy = _database(tmp_path / f"{name}.db", schema)
+        assert migrations.migrate(legacy) == migrations.LATEST_VERSION
+        assert _schema(legacy) == _schema(fresh), name
+
+
+def test_legacy_data_survives_migration(tmp_path):
+    for name, schema in (("init_db", INIT_DB_SCHEMA), ("create_database", CREATE_DATABASE_SCHEMA)):
+        conn = _database(tmp_path / f"{name}.db", schema)
+        migrations.migrate(conn)
+        assert conn.execute("SELECT user_id, role FROM users ORDER BY user_id").fetchall() == [
+            ("s1", "student"), ("s2", "student"), ("t1", "teacher")]
+        assert conn.execute("SELECT student_id, subject_id FROM enrollments ORDER BY student_id").fetchall() == [
+            ("s1", 1), ("s2", 1)]
+        # one record per student and day, the latest kept
+        assert conn.execute("SELECT student_id, status FROM attendance_records ORDER BY student_id").fetchall() == [
+            ("s1", "Present"), ("s2", "Absent")]
+        assert conn.execute("SELECT present, absent, total FROM attendance_daily").fetchall() == [(1, 1, 2)]
+
+
+def test_null_status_becomes_present_and_status_is_required(tmp_path):
+    conn = _database(tmp_path / "legacy.db", CREATE_DATABASE_SCHEMA)
+    conn.execute("INSERT INTO attendance_records (student_id, subject_id, timestamp, date, status) "
+                 "VALUES ('s2', 1, '2024-03-02 09:00:00', '2024-03-02', NULL)")
+    conn.commit()
+    migrations.migrate(conn)
+    assert conn.execute("SELECT status FROM attendance_records WHERE date = '2024-03-02'").fetchone() == ("Present",)
+    conn.execute("INSERT INTO attendance_records (student_id, subject_id, timestamp, date) "
+                 "VALUES ('s1', 1, '2024-03-03 09:00:00', '2024-03-03')")
+    assert conn.execute("SELECT status FROM attendance_records WHERE date = '2024-03-03'").fetchone() == ("Present",)
+    with pytest.raises(sqlite3.IntegrityError, match="attendance_records.status"):
+        conn.execute("INSERT INTO attendance_records (student_id, subject_id, timestamp, date, status) "
+                     "VALUES ('s1', 1, '2024-03-04 09:00:00', '2024-03-04', NULL)")
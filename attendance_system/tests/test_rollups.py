@@ -0,0 +1,58 @@
+import migrations
+
+
+def _rollups(db):
+    conn = db.get_db_connection()
+    daily = conn.execute("SELECT subject_id, date, present, absent, total FROM attendance_daily "
+                         "WHERE total > 0 ORDER BY 1, 2").fetchall()
+    monthly = conn.execute("SELECT subject_id, month, student_id, present, absent, total FROM attendance_monthly "
+                           "WHERE total > 0 ORDER BY 1, 2, 3").fetchall()
+    return [tuple(r) for r in daily], [tuple(r) for r in monthly]
+
+
+def _rebuilt(db):
+    with db.transaction() as conn:
+        migrations.rebuild_rollups(conn.raw)
+    return _rollups(db)
+
+
+def _revision(db, date):
+    return db.get_db_connection().execute(
+        "SELECT revision FROM attendance_daily WHERE subject_id = 1 AND date = ?", (date,)).fetchone()[0]
+
+
+def test_triggers_keep_rollups_equal_to_a_rebuild(school):
+    school.bulk_log_attendance([("s1", 1, "2024-03-01 09:00:00", "Present"),
+                                ("s2", 1, "2024-03-01 09:01:00", "Absent"),
+                                ("s3", 1, "2024-03-01 09:02:00", "Late"),
+                                ("s1", 1, "2024-03-04 09:00:00", "Absent"),
+                                ("s2", 1, "2024-04-01 09:00:00", "Present")])
+    school.bulk_log_attendance([("s2", 1, "2024-03-01 09:30:00", "Present"),   # upsert changes the status
+                                ("s1", 1, "2024-03-04 09:30:00", "Absent")])   # ... or leaves it
+    with school.transaction() as conn:
+        conn.execute("UPDATE attendance_records SET date = '2024-03-05' WHERE student_id = 's3'")
+        conn.execute("DELETE FROM attendance_records WHERE student_id = 's2' AND date = '2024-04-01'")
+    live = _rollups(school)
+    assert live == _rebuilt(school)
+    daily, monthly = live
+    assert daily == [(1, "2024-03-01", 2, 0, 2), (1, "2024-03-04", 0, 1, 1), (1, "2024-03-05", 0, 0, 1)]
+    assert (1, "2024-03", "s1", 1, 1, 2) in monthly
+
+
+def test_report_totals_read_the_rollups(school):
+    school.bulk_log_attendance([("s1", 1, "2024-03-01 09:00:00", "Present"),
+                                ("s2", 1, "2024-03-01 09:00:00", "Absent"),
+                                ("s1", 1, "2024-05-02 09:00:00", "Present")])
+    assert [tuple(r) for r in school.get_monthly_totals(1, "2024-03", "2024-05")] == [
+        ("2024-03", 1, 1, 2, 1), ("2024-05", 1, 0, 1, 1)]
+    assert [(r["student_id"], r["present"], r["total"]) for r in school.get_student_totals(1, "2024-03", "2024-05")] == [
+        ("s1", 2, 2), ("s2", 0, 1)]
+
+
+def test_revision_moves_only_when_counts_change(school):
+    school.bulk_log_attendance([("s1", 1, "2024-03-01 09:00:00", "Present")])
+    first = _revision(school, "2024-03-01")
+    school.bulk_log_attendance([("s1", 1, "2024-03-01 09:10:00", "Present")])  # re-mark, same status
+    assert _revision(school, "2024-03-01") == first
+    school.bulk_log_attendance([("s1", 1, "2024-03-01 09:20:00", "Absent")])
+    assert _revision(school, "2024-03-01") > first